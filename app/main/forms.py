@@ -17,11 +17,15 @@ from app.tasks.info import BadUrlError
 QUALITY_LIST = [(1, 64), (2, 128), (3, 192), (4, 320)]
 
 
+FORMAT_LIST = [('mp3', 'mp3'), ('original', 'original(m4a/opus)')]
+
+
 def get_quality(num):
     return QUALITY_LIST[num - 1][1]
 
 
 def content_check(form, field):
+    """Check link for correctness and duration, received soundcloud info is kept in field.extracted_info"""
     if field.data.startswith('https://www.youtube.com/watch?v=') or field.data.startswith('https://youtu.be/'):
         try:
             info = get_yt_file_info(field.data)
@@ -35,6 +39,7 @@ def content_check(form, field):
             info = get_sc_file_info(field.data)
         except BadUrlError:
             raise ValidationError(f'Please check the link for correctness.')
+        field.extracted_info = info
         if not is_allowed_duration(info):
             raise ValidationError(f'Video/music file must be shorter '
                                   f'than {current_app.config["ALLOWED_DURATION"]} minutes.')
@@ -54,6 +59,10 @@ class DownloadForm2(FlaskForm):
                           default=3,
                           validators=[DataRequired()],
                           coerce=int)
+    output_format = SelectField('Format',
+                                choices=FORMAT_LIST,
+                                default='mp3',
+                                validators=[DataRequired()])
     repair_tags = BooleanField('Tag it', default=True)
     submit = SubmitField('Download')
 
@@ -70,6 +79,10 @@ class DownloadPlaylistItemsForm(FlaskForm):
                           default=3,
                           validators=[DataRequired()],
                           coerce=int)
+    output_format = SelectField('Format',
+                                choices=FORMAT_LIST,
+                                default='mp3',
+                                validators=[DataRequired()])
     submit = SubmitField('Download')
 
     def validate_link(self, link):
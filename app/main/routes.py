@@ -1,8 +1,12 @@
 from app import db
 from app.tasks.info import get_yt_playlist_items
-from app.tasks.download import download
+from app.tasks.download import download_file
 from app.tasks.download import download_yt_files
-from app.tasks.download import get_download_response
+from app.tasks.download import get_stream_response
+from app.tasks.download import get_ready_file_response
+from app.tasks.progress import get_progress_channel
+from app.tasks.progress import get_task_progress
+from app.tasks.progress import progress_events
 from app.main import bp
 from app.main.forms import DownloadForm
 from app.main.forms import DownloadForm2
@@ -17,8 +21,8 @@ from flask import flash
 from flask import url_for
 from flask import jsonify
 from flask import current_app
+from flask import Response
 from flask_login import current_user
-from youtube_dl import DownloadError
 
 import os
 import time
@@ -44,9 +48,30 @@ def index():
                                active_slide=2)
 
 
+def is_ajax():
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def get_form_error_response(message, category, active_slide):
+    """Get response of download form with error, json for ajax requests and redirect to index page otherwise"""
+    if is_ajax():
+        return jsonify({'Status_code': 2, 'Progress': message})
+    flash(message, category)
+    return redirect(url_for('main.index', active_slide=active_slide))
+
+
+def get_download_started_response(active_slide):
+    """Get response of download form when file downloading is started, progress is received from /get_progress
+       and file is received from /get_ready_file when task is ready"""
+    if is_ajax():
+        return jsonify({'Status_code': 0, 'Progress': 'Waiting'})
+    return redirect(url_for('main.index', active_slide=active_slide))
+
+
 @bp.route('/download_yt', methods=['GET', 'POST'])
 def download_yt():
     repair_tags = False
+    output_format = 'mp3'
     dir = f'app{os.path.sep}tasks{os.path.sep}temp{os.path.sep}'
     if request.method == "GET":
         return redirect(url_for('main.index', active_slide=1))
@@ -55,49 +80,45 @@ def download_yt():
         if youtube_form.validate_on_submit():
             t = Task.query.filter_by(user_ip=str(request.remote_addr), status_code=0).first()
             if t:
-                flash('Please wait while your other downloading is complete.', 'yt')
-                return redirect(url_for('main.index', active_slide=1))
+                return get_form_error_response('Please wait while your other downloading is complete.', 'yt', 1)
             t = Task(description="Downloading mp3", user_ip=str(request.remote_addr), status_code=0, progress='Waiting')
             quality = 192
             dir += str(request.remote_addr)
             print(f'Loading from youtube user ip:{request.remote_addr} data:{youtube_form.link.data}')
         else:
-            flash(youtube_form.link.errors[0], 'yt')
-            return redirect(url_for('main.index', active_slide=1))
+            return get_form_error_response(youtube_form.link.errors[0], 'yt', 1)
 
     else:
         youtube_form = DownloadForm2()
         if youtube_form.validate_on_submit():
             t = Task.query.filter_by(user_id=current_user.id, status_code=0).first()
             if t:
-                flash('Please wait while your other downloading is complete.', 'yt')
-                return redirect(url_for('main.index', active_slide=1))
+                return get_form_error_response('Please wait while your other downloading is complete.', 'yt', 1)
             t = Task(description="Downloading mp3", user_id=current_user.id, status_code=0, progress='Waiting')
             quality = get_quality(youtube_form.quality.data)
             repair_tags = youtube_form.repair_tags.data
+            output_format = youtube_form.output_format.data
             dir += str(current_user.id)
             print(f'Loading from youtube user id:{current_user.id} data:{youtube_form.link.data}')
         else:
-            flash(youtube_form.link.errors[0], 'yt')
-            return redirect(url_for('main.index', active_slide=1))
+            return get_form_error_response(youtube_form.link.errors[0], 'yt', 1)
 
     db.session.add(t)
     db.session.commit()
-    try:
-        if youtube_form.link.data.startswith('https://www.youtube.com/watch?v='):
-            file = download(youtube_form.link.data[:43], task=t, quality=quality, repair_tags=repair_tags, dir=dir)
-        else:
-            file = download(youtube_form.link.data[:28], task=t, quality=quality, repair_tags=repair_tags, dir=dir)
-    except DownloadError as err:
-        t.force_stop('Download error')
-        raise err
-    return get_download_response(file, t)
+    if youtube_form.link.data.startswith('https://www.youtube.com/watch?v='):
+        download_file(youtube_form.link.data[:43], task=t, quality=quality, repair_tags=repair_tags, dir=dir,
+                      output_format=output_format)
+    else:
+        download_file(youtube_form.link.data[:28], task=t, quality=quality, repair_tags=repair_tags, dir=dir,
+                      output_format=output_format)
+    return get_download_started_response(1)
 
 
 @bp.route('/download_sc', methods=['GET', 'POST'])
 def download_sc():
     dir = f'app{os.path.sep}tasks{os.path.sep}temp{os.path.sep}'
     repair_tags = False
+    output_format = 'mp3'
     if request.method == "GET":
         return redirect(url_for('main.index', active_slide=2))
     if not current_user.is_authenticated:
@@ -105,40 +126,35 @@ def download_sc():
         if soundcloud_form.validate_on_submit():
             t = Task.query.filter_by(user_ip=str(request.remote_addr), status_code=0).first()
             if t:
-                flash('Please wait while your other downloading is complete.', 'yt')
-                return redirect(url_for('main.index', active_slide=1))
+                return get_form_error_response('Please wait while your other downloading is complete.', 'yt', 1)
             t = Task(description="Downloading mp3", user_ip=str(request.remote_addr), status_code=0, progress='Waiting')
             quality = 192
             dir += str(request.remote_addr)
             print(f'Loading from youtube user ip:{request.remote_addr} data:{soundcloud_form.link.data}')
         else:
-            flash(soundcloud_form.link.errors[0], 'sc')
-            return redirect(url_for('main.index', active_slide=2))
+            return get_form_error_response(soundcloud_form.link.errors[0], 'sc', 2)
 
     else:
         soundcloud_form = DownloadForm2()
         if soundcloud_form.validate_on_submit():
             t = Task.query.filter_by(user_id=current_user.id, status_code=0).first()
             if t:
-                flash('Please wait while your other downloading is complete.', 'yt')
-                return redirect(url_for('main.index', active_slide=1))
+                return get_form_error_response('Please wait while your other downloading is complete.', 'yt', 1)
             t = Task(description="Downloading mp3", user_id=current_user.id, status_code=0, progress='Waiting')
             quality = get_quality(soundcloud_form.quality.data)
             repair_tags = soundcloud_form.repair_tags.data
+            output_format = soundcloud_form.output_format.data
             dir += str(current_user.id)
             print(f'Loading from youtube user id:{current_user.id} data:{soundcloud_form.link.data}')
         else:
-            flash(soundcloud_form.link.errors[0], 'sc')
-            return redirect(url_for('main.index', active_slide=2))
+            return get_form_error_response(soundcloud_form.link.errors[0], 'sc', 2)
 
     db.session.add(t)
     db.session.commit()
-    try:
-        file = download(soundcloud_form.link.data, task=t, quality=quality, repair_tags=repair_tags, dir=dir)
-    except DownloadError as err:
-        t.force_stop('Download error')
-        raise err
-    return get_download_response(file, t)
+    sc_info = getattr(soundcloud_form.link, 'extracted_info', None)
+    download_file(soundcloud_form.link.data, task=t, quality=quality, repair_tags=repair_tags, dir=dir,
+                  info=sc_info['info'] if sc_info and sc_info['type'] == 0 else None, output_format=output_format)
+    return get_download_started_response(2)
 
 
 @bp.route('/download_playlist_items', methods=['GET', 'POST'])
@@ -178,6 +194,7 @@ def download_playlist_items():
                          progress='Waiting')
                 quality = get_quality(form.quality.data)
                 repair_tags = form.repair_tags.data
+                output_format = form.output_format.data
                 dir = f'app{os.path.sep}tasks{os.path.sep}temp{os.path.sep}{current_user.id}'
                 print(f'Loading playlist items from youtube user id:{current_user.id} data:{form.link.data}')
             else:
@@ -197,7 +214,8 @@ def download_playlist_items():
 
     files_list = get_yt_playlist_items(form.link.data, form.first_item_number.data - 1, form.last_item_number.data)
 
-    download_yt_files(files_list, task=t, quality=quality, repair_tags=repair_tags, dir=dir)
+    download_yt_files(files_list, task=t, quality=quality, repair_tags=repair_tags, dir=dir,
+                      output_format=output_format)
 
     return render_template('/download_playlist_progress.html',
                            exp_time=current_app.config['PLAYLIST_LIVE_TIME'])
@@ -207,9 +225,11 @@ def download_playlist_items():
 def get_file():
     if current_user.is_authenticated:
         t = Task.query.filter_by(user_id=current_user.id, status_code=4).first()
+        if not t:
+            t = Task.query.filter_by(user_id=current_user.id, status_code=3).first()
         if t:
-            if t.progress.startswith('Files downloaded') and t.description == 'Downloading playlist items':
-                return get_download_response(t.unique_process_info, t, ext='.zip', end_task=False)
+            if t.description == 'Downloading playlist items' and t.unique_process_info:
+                return get_stream_response(t)
             else:
                 return abort(403)
         else:
@@ -218,15 +238,68 @@ def get_file():
         return abort(404)
 
 
-@bp.route('/get_progress', methods=['GET'])
-def get_progress():
-    time.sleep(1)
+def get_ready_file_task():
+    """Get the last task of current user with file downloaded by 'download_file' which is not received yet"""
+    if not current_user.is_authenticated:
+        query = Task.query.filter_by(user_ip=str(request.remote_addr))
+    else:
+        query = Task.query.filter_by(user_id=str(current_user.id))
+    return query.filter_by(description='Downloading mp3', status_code=4).order_by(Task.id.desc()).first()
+
+
+@bp.route('/get_ready_file', methods=['GET'])
+def get_ready_file():
+    t = get_ready_file_task()
+    if not t:
+        return abort(404)
+    return get_ready_file_response(t)
+
+
+def get_progress_task():
+    """Get active task of current user with single file or the last task with file which is not received yet"""
     if not current_user.is_authenticated:
         t = Task.query.filter_by(user_ip=str(request.remote_addr), status_code=0).first()
     else:
         t = Task.query.filter_by(user_id=str(current_user.id), status_code=0).first()
+    if not t:
+        t = get_ready_file_task()
+    return t
+
+
+def get_playlist_task():
+    """Get active or ready playlist task of current user"""
+    t = Task.query.filter_by(user_id=str(current_user.id), status_code=3).first()
+    if not t:
+        t = Task.query.filter_by(user_id=str(current_user.id), status_code=4).first()
+    return t
+
+
+def get_playlist_progress(t):
+    """Get progress of playlist task and positions of its items in 'Status_codes' string
+
+    :returns: tuple of progress dict and dict with positions by item index
+    :rtype: tuple
+    """
+    statuses = str()
+    positions = dict()
+    progress = get_task_progress(t)
+    files = t.files.all()
+    if files and len(files) > 0:
+        for el in sorted(files, key=files.index):
+            if el.index != 0:
+                positions[el.index] = len(statuses)
+                statuses += str(el.status_code)
+        return dict(progress, Status_codes=statuses), positions
+    else:
+        return dict(progress, Status_codes=None), positions
+
+
+@bp.route('/get_progress', methods=['GET'])
+def get_progress():
+    time.sleep(1)
+    t = get_progress_task()
     if t:
-        return jsonify({'Status_code': t.status_code, 'Progress': t.progress})
+        return jsonify(get_task_progress(t))
     else:
         return jsonify({'Status_code': 1, 'Progress': 'Done'})
 
@@ -234,20 +307,61 @@ def get_progress():
 @bp.route('/get_playlist_downloading_progress')
 def get_playlist_downloading_progress():
     if current_user.is_authenticated:
-        t = Task.query.filter_by(user_id=str(current_user.id), status_code=3).first()
-        if not t:
-            t = Task.query.filter_by(user_id=str(current_user.id), status_code=4).first()
+        t = get_playlist_task()
         if t:
-            statuses = str()
-            files = t.files.all()
-            if files and len(files) > 0:
-                for el in sorted(files, key=files.index):
-                    if el.index != 0:
-                        statuses += str(el.status_code)
-                return jsonify({'Status_code': t.status_code, 'Progress': t.progress, 'Status_codes': statuses})
-            else:
-                return jsonify({'Status_code': t.status_code, 'Progress': t.progress, 'Status_codes': None})
+            return jsonify(get_playlist_progress(t)[0])
         else:
             return jsonify({'Status_code': 1, 'Progress': 'Done'})
     else:
         abort(403)
+
+
+@bp.route('/progress_stream', methods=['GET'])
+def progress_stream():
+    """Stream progress of single file task(or playlist task if 'task' argument is 'playlist') as server-sent
+       events, the first event contains the whole progress and next ones only changed fields
+
+       Every stream holds a worker thread, so number of streams of the process is limited by PROGRESS_STREAMS_MAX
+       (other clients receive the current progress and reconnect after PROGRESS_KEEPALIVE seconds) and every stream
+       is finished after PROGRESS_STREAM_MAX_DURATION seconds(client reconnects at once). Request context and
+       database session are released before streaming, progress is read in its own app context."""
+    subscription = None
+    positions = None
+    retry = None
+    playlist = request.args.get('task') == 'playlist'
+    channel = get_progress_channel()
+    if channel.subscribers() >= current_app.config['PROGRESS_STREAMS_MAX']:
+        retry = int(current_app.config['PROGRESS_KEEPALIVE'] * 1000)
+    if playlist:
+        if not current_user.is_authenticated:
+            abort(403)
+        t = get_playlist_task()
+        if t:
+            if retry is None:
+                subscription = channel.subscribe(t.id)
+            db.session.refresh(t)
+            state, positions = get_playlist_progress(t)
+    else:
+        t = get_progress_task()
+        if t:
+            if retry is None:
+                subscription = channel.subscribe(t.id)
+            db.session.refresh(t)
+            state = get_task_progress(t)
+    if not t:
+        state = {'Status_code': 1, 'Progress': 'Done'}
+    task_id = t.id if t else None
+    app = current_app._get_current_object()
+
+    def refresh():
+        with app.app_context():
+            task = Task.query.get(task_id)
+            if not task:
+                return dict()
+            return get_playlist_progress(task)[0] if playlist else get_task_progress(task)
+
+    events = progress_events(subscription, state, positions, keepalive=current_app.config['PROGRESS_KEEPALIVE'],
+                             refresh=refresh, max_duration=current_app.config['PROGRESS_STREAM_MAX_DURATION'],
+                             retry=retry)
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
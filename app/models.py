@@ -130,6 +130,7 @@ class FileInfo(db.Model):
 
     status_codes = {'not_processed': 0, 'processed': 1, 'error': 2}
 
+    filename is a path to downloaded file relative to the task directory.
     index 0 is used for all archives of the task.
     """
 
@@ -139,6 +140,7 @@ class FileInfo(db.Model):
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), index=True)
     status_code = db.Column(db.Integer, nullable=False, default=0)
     file_hash = db.Column(db.String(32), index=True)
+    filename = db.Column(db.String(256))
 
     @classmethod
     def make_records(cls, list_, task_id):
@@ -3,6 +3,8 @@ from app.models import Task
 from app.models import User
 from app.scheduler import Timer
 from app.tasks.download import resume_yt_files_downloading
+from app.tasks.cache import get_source_cache
+from app.tasks.progress import publish_task_progress
 from sqlalchemy.exc import OperationalError
 from datetime import datetime
 from datetime import timedelta
@@ -80,6 +82,19 @@ def clear_junk(print_lock):
                 print(f'[Scheduler] Deleted {count} junk directories')
 
 
+def clear_source_cache(print_lock):
+    """Delete downloaded files which were not used for SOURCE_CACHE_TTL minutes from the source cache"""
+    app = create_app()
+    with app.app_context():
+        cache = get_source_cache()
+        if not cache:
+            return
+        count = cache.expire(app.config['SOURCE_CACHE_TTL'] * 60)
+        if count:
+            with print_lock:
+                print(f'[Scheduler] Deleted {count} expired sources')
+
+
 def check_ready_to_download_tasks(print_lock):
     """Check tasks with status code 4 for expiration(if task expired it will be marked as completed)"""
     app = create_app()
@@ -94,6 +109,7 @@ def check_ready_to_download_tasks(print_lock):
                 task.status_code = 1
                 db.session.add(task)
                 db.session.commit()
+                publish_task_progress(task)
                 counter += 1
                 with print_lock:
                     if counter == 1:
@@ -135,27 +151,19 @@ def resume_long_term_task(kwargs, task, path_to_task):
     :param path_to_task: path to task
     :type path_to_task: str
     """
-    archives = list()
     playlist = list()
-    for file in task.files.all():
+    for file in sorted(task.files.all(), key=operator.attrgetter('index')):
         if file.index == 0:
-            archives.append(file)
-        else:
-            playlist.append(file)
-    index = 0
-    for file in sorted(archives, key=operator.attrgetter('file_id'))[:-1]:
-        try:
-            if file.check_file_hash(path_to_task + os.path.sep + file.file_id):
-                index += 1
-            else:
-                break
-        except FileNotFoundError:
-            break
-    loaded_files_num = kwargs['part_size'] * index
-    playlist = [el.file_id for el in sorted(playlist, key=operator.attrgetter('index'))[loaded_files_num:]]
+            continue
+        if file.status_code == 1 and file.filename:
+            try:
+                if file.check_file_hash(path_to_task + os.path.sep + file.filename):
+                    continue
+            except FileNotFoundError:
+                pass
+        playlist.append(file.file_id)
     resume_yt_files_downloading(playlist, task=task, dir=kwargs['dir'], quality=kwargs['quality'],
-                                repair_tags=kwargs['repair_tags'], part_size=kwargs['part_size'],
-                                first_part_index=index)
+                                repair_tags=kwargs['repair_tags'], output_format=kwargs.get('output_format', 'mp3'))
 
 
 app = create_app()
@@ -171,5 +179,6 @@ task5 = {'func': check_ready_to_download_tasks, 'args': [], 'time': 'on_timer',
 task6 = {'func': clear_junk, 'args': [], 'time': 'on_exit'}
 task7 = {'func': clear_junk, 'args': [], 'time': 'on_timer', 'timer_name': 'main_timer'}
 task8 = {'func': resume_long_term_tasks, 'args': [], 'time': 'on_start'}
+task9 = {'func': clear_source_cache, 'args': [], 'time': 'on_timer', 'timer_name': 'main_timer'}
 
-tasks = [task1, task2, task3, task4, task5, task6, task7, task8]
+tasks = [task1, task2, task3, task4, task5, task6, task7, task8, task9]
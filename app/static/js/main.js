@@ -2,6 +2,55 @@
 // 	alert('loaded');
 // });
 
+function stopDownloading(button, progress, message){
+	if (message){
+		$(progress).html(message);
+	}else{
+		$(progress).css("display", "none");
+	}
+	$(button).prop("disabled", false);
+	$("#carousel-control1").prop("disabled", false);
+	$("#carousel-control2").prop("disabled", false);
+}
+
+function downloadFile(form, button, progress){
+	// file is downloaded in background, progress is received from /progress_stream and when task is ready(status code 4) file is received from /get_ready_file
+	$(button).prop("disabled", true);
+	$("#carousel-control1").prop("disabled", true);
+	$("#carousel-control2").prop("disabled", true);
+	$(progress).css("display", "block");
+	$(progress).html("Checking url");
+
+	$.post($(form).attr("action"), $(form).serialize()).done(
+		function(response) {
+			if (response["Status_code"] == 2){
+				stopDownloading(button, progress, response["Progress"]);
+				return;
+			}
+			// progress is pushed by the server, events after the first one contain only changed fields
+			var state = {};
+			var source = new EventSource('/progress_stream');
+			source.onmessage = function(event) {
+				Object.assign(state, JSON.parse(event.data));
+				if (state["Status_code"] == 0){
+					$(progress).html(state["Progress"]);
+				}
+				else{
+					source.close();
+					if (state["Status_code"] == 4){
+						window.location = "/get_ready_file";
+					}
+					stopDownloading(button, progress);
+				}
+			};
+		}
+	).fail(
+		function() {
+			stopDownloading(button, progress, "Download error");
+		}
+	);
+}
+
 $(document).ready(function(){
 	$('.carousel').carousel({
 		interval: false,
@@ -128,32 +177,8 @@ $(document).ready(function(){
 			}
 		},
 		submitHandler: function(form) {
-			$("#BtnSubmit1").prop("disabled", true);
-			$("#carousel-control1").prop("disabled", true);
-			$("#carousel-control2").prop("disabled", true);
-			$("#progress_yt").css("display", "block");
-			$("#progress_yt").html("Checking url");
-
-			var interval;
-			interval = setInterval(function() {
-        $.ajax('/get_progress').done(
-          function(response) {
-						console.log(response);
-						if (response["Status_code"] == 0){
-							$("#progress_yt").html(response["Progress"]);
-						}
-						else{
-							console.log("Stopping status checker");
-							$("#progress_yt").css("display", "none");
-							$("#BtnSubmit1").prop("disabled", false);
-							$("#carousel-control1").prop("disabled", false);
-							$("#carousel-control2").prop("disabled", false);
-							clearInterval(interval);
-						}
-          }
-				);
-      }, 2000);
-			return true
+			downloadFile(form, "#BtnSubmit1", "#progress_yt");
+			return false
 		}
 	});
 
@@ -174,32 +199,8 @@ $(document).ready(function(){
 			}
 		},
 		submitHandler: function(form) {
-			$("#BtnSubmit2").prop("disabled", true);
-			$("#carousel-control1").prop("disabled", true);
-			$("#carousel-control2").prop("disabled", true);
-			$("#progress_sc").css("display", "block");
-			$("#progress_sc").html("Downloading");
-
-			var interval;
-			interval = setInterval(function() {
-        $.ajax('/get_progress').done(
-          function(response) {
-						console.log(response);
-						if (response["Status_code"] == 0){
-							$("#progress_sc").html(response["Progress"]);
-						}
-						else{
-							console.log("Stopping status checker");
-							$("#progress_sc").css("display", "none");
-							$("#BtnSubmit2").prop("disabled", false);
-							$("#carousel-control1").prop("disabled", false);
-							$("#carousel-control2").prop("disabled", false);
-							clearInterval(interval);
-						}
-          }
-				);
-      }, 2000);
-			return true
+			downloadFile(form, "#BtnSubmit2", "#progress_sc");
+			return false
 		}
 	});
 
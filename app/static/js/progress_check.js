@@ -1,151 +1,94 @@
+function showDownloadButton(response){
+  // files are sent as soon as they are downloaded, so button is available after first ready file
+  if (response["Status_codes"] && response["Status_codes"].indexOf("1") > -1){
+    $("#download_playlist_button").prop("disabled", false);
+    $("#download_playlist_button").css("display", "block");
+  }
+}
+
+function getItemStatusCode(response, index){
+  if (response["Status_codes"]){
+    return parseInt(response["Status_codes"].slice(index - 1, index));
+  }
+  return 0;
+}
+
+function appendProgressBarItem(index, parts_num, status_code){
+  $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + index + "\">\
+                                            <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + index + "\"></div></div>");
+  $("#download_progress_bar_item_holder" + index).css("width", (100 / parts_num) + "%");
+  if (status_code == 2){
+    $("#download_progress_bar_item" + index).css("background-color", "#e36d12");
+  }
+}
+
 window.addEventListener("load", function(){
-  var interval;
   var interval2;
   var last_part = 0;
-  interval = setInterval(function() {
-    $.ajax('/get_playlist_downloading_progress').done(
-      function(response) {
-        console.log(response);
-        if ((response["Status_code"] == 3) && (response["Progress"].startsWith("Downloading"))){
-          var str = response["Progress"];
-          var i = str.indexOf("of");
-          var downloaded_parts = str.slice(12, i - 1);
-          var parts_num = str.slice(i + 3);
-          downloaded_parts = parseInt(downloaded_parts);
-          parts_num = parseInt(parts_num);
-          var displayed_progress = 1;
-          while (last_part < downloaded_parts - 1){
-            last_part++;
-            var status_code = response["Status_codes"].slice(last_part-1, last_part);
-            status_code = parseInt(status_code);
-            $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + last_part + "\">\
-                                                      <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + last_part + "\"></div></div>");
-            $("#download_progress_bar_item_holder" + last_part).css("width", (100 / parts_num) + "%");
-            if (status_code == 2){
-              $("#download_progress_bar_item" + last_part).css("background-color", "#e36d12");
-            }
-            $("#download_progress_bar_item" + last_part).css("width", "100%");
-          }
-          if (last_part < downloaded_parts){
-            last_part++;
-            var status_code = response["Status_codes"].slice(last_part-1, last_part);
-            status_code = parseInt(status_code);
-            $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + last_part + "\">\
-                                                      <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + last_part + "\"></div></div>");
-            $("#download_progress_bar_item_holder" + last_part).css("width", (100 / parts_num) + "%");
-            if (status_code == 2){
-              $("#download_progress_bar_item" + last_part).css("background-color", "#e36d12");
-            }
-            interval2 = setInterval(function() {
-              if (displayed_progress < 101){
-                $("#download_progress_bar_item" + last_part).css("width", displayed_progress + "%");
-                displayed_progress += 1;
-              }else{
-                clearInterval(interval2);
-              }
-            }, 35);
-          }
-        }
+  var state = {};
+  // progress is pushed by the server, the first event contains the whole progress and next ones only changed fields
+  var source = new EventSource('/progress_stream?task=playlist');
 
-        if (response["Status_code"] == 3){
-          $("#playlist_downloading_progress").html(response["Progress"]);
-        }else{
-          console.log("Stopping status checker");
-          str = response["Progress"];
-          var i = str.indexOf("(");
-          var i2 = str.indexOf(")");
-          var parts_num = str.slice(i + 1, i2);
-          parts_num = parseInt(parts_num);
-          $("#download_progress_bar_holder").html("");
-          for (i = 1; i <= parts_num; i++){
-            if (response["Status_codes"]){
-              var status_code = response["Status_codes"].slice(i-1, i);
-              status_code = parseInt(status_code);
-              $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + i + "\">\
-                                                        <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + i + "\"></div></div>");
-              $("#download_progress_bar_item_holder" + i).css("width", (100 / parts_num) + "%");
-              if (status_code == 2){
-                $("#download_progress_bar_item" + i).css("width", 100 + "%");
-                $("#download_progress_bar_item" + i).css("background-color", "#e36d12");
-              }else{
-                $("#download_progress_bar_item" + i).css("width", 100 + "%");
-              }
-            }
-          }
-          $("#download_progress_bar_bg").css("width", "100%");
-          $("#playlist_downloading_progress").css("display", "none");
-          $("#download_playlist_button").prop("disabled", false);
-          $("#download_playlist_button").css("display", "block");
-          clearInterval(interval);
-        }
+  function showProgress(response) {
+    if ((response["Status_code"] == 3) && (response["Progress"].startsWith("Downloading"))){
+      var str = response["Progress"];
+      var i = str.indexOf("of");
+      var downloaded_parts = parseInt(str.slice(12, i - 1));
+      var parts_num = parseInt(str.slice(i + 3));
+      var displayed_progress = 1;
+      // items downloaded before the page is opened are shown at once
+      while (last_part < downloaded_parts - 1){
+        last_part++;
+        appendProgressBarItem(last_part, parts_num, getItemStatusCode(response, last_part));
+        $("#download_progress_bar_item" + last_part).css("width", "100%");
       }
-    );
-  }, 9000);
-
-  $.ajax('/get_playlist_downloading_progress').done(
-    function(response) {
-      console.log(response);
-      if ((response["Status_code"] == 3) && (response["Progress"].startsWith("Downloading"))){
-        $("#playlist_downloading_progress").html(response["Progress"]);
-        var str = response["Progress"];
-        var i = str.indexOf("of");
-        var downloaded_parts = str.slice(12, i - 1);
-        var parts_num = str.slice(i + 3);
-        downloaded_parts = parseInt(downloaded_parts);
-        parts_num = parseInt(parts_num);
-        for (i = 1; i <= downloaded_parts; i++){
-          if (response["Status_codes"]){
-            var status_code = response["Status_codes"].slice(i-1, i);
-            status_code = parseInt(status_code);
-            $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + i + "\">\
-                                                      <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + i + "\"></div></div>");
-            $("#download_progress_bar_item_holder" + i).css("width", (100 / parts_num) + "%");
-            if (status_code == 2){
-              $("#download_progress_bar_item" + i).css("width", 100 + "%");
-              $("#download_progress_bar_item" + i).css("background-color", "#e36d12");
-            }else{
-              $("#download_progress_bar_item" + i).css("width", 100 + "%");
-            }
+      if (last_part < downloaded_parts){
+        // progress of the next item is received before animation of the previous one is finished
+        clearInterval(interval2);
+        $("#download_progress_bar_item" + last_part).css("width", "100%");
+        last_part++;
+        appendProgressBarItem(last_part, parts_num, getItemStatusCode(response, last_part));
+        interval2 = setInterval(function() {
+          if (displayed_progress < 101){
+            $("#download_progress_bar_item" + last_part).css("width", displayed_progress + "%");
+            displayed_progress += 1;
           }else{
-            $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + i + "\">\
-                                                      <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + i + "\"></div></div>");
-            $("#download_progress_bar_item_holder" + i).css("width", (100 / parts_num) + "%");
-            $("#download_progress_bar_item" + i).css("width", 100 + "%");
+            clearInterval(interval2);
           }
+        }, 35);
+      }
+      // status of the item is received after its bar is shown
+      for (var j = 1; j <= last_part; j++){
+        if (getItemStatusCode(response, j) == 2){
+          $("#download_progress_bar_item" + j).css("background-color", "#e36d12");
         }
-        last_part = downloaded_parts;
       }
+    }
 
-      if (response["Status_code"] == 3){
-        $("#playlist_downloading_progress").html(response["Progress"]);
-      }else{
-      console.log("Stopping status checker");
-      str = response["Progress"];
-      var i = str.indexOf("(");
-      var i2 = str.indexOf(")");
-      var parts_num = str.slice(i + 1, i2);
-      parts_num = parseInt(parts_num);
-      for (i = 1; i <= parts_num; i++){
-        if (response["Status_codes"]){
-          var status_code = response["Status_codes"].slice(i-1, i);
-          status_code = parseInt(status_code);
-          $("#download_progress_bar_holder").append("<div class=\"download_progress_bar_item_holder\" id=\"download_progress_bar_item_holder" + i + "\">\
-                                                    <div class=\"download_progress_bar_item\" id=\"download_progress_bar_item" + i + "\"></div></div>");
-          $("#download_progress_bar_item_holder" + i).css("width", (100 / parts_num) + "%");
-          if (status_code == 2){
-            $("#download_progress_bar_item" + i).css("width", 100 + "%");
-            $("#download_progress_bar_item" + i).css("background-color", "#e36d12");
-          }else{
-            $("#download_progress_bar_item" + i).css("width", 100 + "%");
-          }
+    if (response["Status_code"] == 3){
+      $("#playlist_downloading_progress").html(response["Progress"]);
+      showDownloadButton(response);
+    }else{
+      clearInterval(interval2);
+      var str = response["Progress"];
+      var parts_num = parseInt(str.slice(str.indexOf("(") + 1, str.indexOf(")")));
+      $("#download_progress_bar_holder").html("");
+      if (response["Status_codes"]){
+        for (var i = 1; i <= parts_num; i++){
+          appendProgressBarItem(i, parts_num, getItemStatusCode(response, i));
+          $("#download_progress_bar_item" + i).css("width", "100%");
         }
       }
       $("#download_progress_bar_bg").css("width", "100%");
       $("#playlist_downloading_progress").css("display", "none");
       $("#download_playlist_button").prop("disabled", false);
       $("#download_playlist_button").css("display", "block");
-      clearInterval(interval);
-      }
+      source.close();
     }
-  );
+  }
+
+  source.onmessage = function(event) {
+    Object.assign(state, JSON.parse(event.data));
+    showProgress(state);
+  };
 });
@@ -0,0 +1,85 @@
+import hashlib
+import zipfile
+import mmap
+import os
+
+
+class StreamSink:
+    """Write only file object which keeps written data until it is taken"""
+    def __init__(self):
+        self.chunks = list()
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Get all data written since last call"""
+        data = b''.join(self.chunks)
+        self.chunks = list()
+        return data
+
+
+def stream_zip(files, block_size=1000000):
+    """Build zip archive on the fly and yield it by chunks
+       Files are mapped to memory, so their content is read directly from page cache,
+       files are stored without compression(mp3 can not be compressed anyway)
+
+
+    :param files: iterable of tuples with path to file(or content of file as bytes) and its name inside archive,
+                  can be a generator which waits for the next file to be ready
+    :type files: iterable
+    :param block_size: size of file block to be sent at once
+    :type block_size: int
+
+    :returns: generator of bytes
+    """
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for path, arcname in files:
+            if isinstance(path, bytes):
+                archive.writestr(arcname, path)
+                yield sink.take()
+                continue
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            force_zip64 = info.file_size > zipfile.ZIP64_LIMIT
+            with open(path, 'rb') as file, archive.open(info, 'w', force_zip64=force_zip64) as entry:
+                if os.fstat(file.fileno()).st_size:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data, memoryview(data) as view:
+                        for offset in range(0, len(view), block_size):
+                            entry.write(view[offset:offset + block_size])
+                            yield sink.take()
+            yield sink.take()
+    yield sink.take()
+
+
+def write_zip(files, path, block_size=1000000):
+    """Write zip archive built by 'stream_zip' to disk
+       Archive is written in one sequential pass and its hash is computed from the same chunks while they are
+       written, so neither files nor archive are read again
+
+
+    :param files: iterable of tuples with path to file and its name inside archive
+    :type files: iterable
+    :param path: path to archive
+    :type path: str
+    :param block_size: size of file block to be written at once
+    :type block_size: int
+
+    :returns: hex sha256 hash of archive
+    :rtype: str
+    """
+    archive_hash = hashlib.sha256()
+    with open(path, 'wb') as archive:
+        for chunk in stream_zip(files, block_size):
+            archive.write(chunk)
+            archive_hash.update(chunk)
+    return archive_hash.hexdigest()
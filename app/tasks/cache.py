@@ -0,0 +1,207 @@
+from flask import current_app
+from threading import Lock
+
+import hashlib
+import shutil
+import time
+import json
+import os
+
+# name of the file with entry metadata inside entry directory
+META_FILENAME = '.meta.json'
+
+
+class FileCache:
+    """Disk cache of ready(converted and tagged) files
+
+    Files are stored under key, which is sha256 of the values that define file content,
+    every entry is a directory with one file(and optional file with metadata), so original file name is preserved.
+    Entries are linked(or copied if linking is not possible) into the destination directory.
+    Least recently used entries are evicted when cache size exceeds max_size,
+    time of the last use is stored as entry modification time, so cache can be shared between processes.
+    """
+    def __init__(self, path, max_size):
+        """Create cache instance
+
+        :param path: path to cache directory
+        :type path: str
+        :param max_size: max size of all cached files(in bytes)
+        :type max_size: int
+        """
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def make_key(*args):
+        """Get cache key from values which define file content"""
+        return hashlib.sha256('|'.join(str(arg) for arg in args).encode()).hexdigest()
+
+    def get_entry_path(self, key):
+        return self.path + os.path.sep + key[:2] + os.path.sep + key
+
+    def get(self, key, dir):
+        """Place cached file into the directory
+
+        :param key: cache key
+        :type key: str
+        :param dir: destination directory
+        :type dir: str
+
+        :returns: path to file or None if there is no such entry
+        :rtype: str or None
+        """
+        entry_path = self.get_entry_path(key)
+        try:
+            filename = [name for name in os.listdir(entry_path) if name != META_FILENAME][0]
+            os.makedirs(dir, exist_ok=True)
+            filepath = dir + os.path.sep + filename
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+            place_file(entry_path + os.path.sep + filename, filepath)
+            os.utime(entry_path)
+        except (FileNotFoundError, IndexError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return filepath
+
+    def get_meta(self, key):
+        """Get metadata stored with the entry
+
+        :param key: cache key
+        :type key: str
+
+        :returns: dict with metadata(empty if entry has no metadata)
+        :rtype: dict
+        """
+        try:
+            with open(self.get_entry_path(key) + os.path.sep + META_FILENAME) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return dict()
+
+    def put(self, key, filepath, meta=None):
+        """Store file in cache and evict old entries if cache is overflowed
+
+        :param key: cache key
+        :type key: str
+        :param filepath: path to file
+        :type filepath: str
+        :param meta: json serializable metadata to be stored with the file(see 'get_meta')
+        :type meta: dict or None
+        """
+        entry_path = self.get_entry_path(key)
+        if os.path.isdir(entry_path):
+            return
+        temp_path = f'{entry_path}.{os.getpid()}.{time.time_ns()}'
+        os.makedirs(temp_path)
+        place_file(filepath, temp_path + os.path.sep + os.path.basename(filepath))
+        if meta:
+            with open(temp_path + os.path.sep + META_FILENAME, 'w') as file:
+                json.dump(meta, file)
+        try:
+            os.rename(temp_path, entry_path)
+        except OSError:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries while cache size exceeds max_size"""
+        entries = list()
+        size = 0
+        for root, dirs, files in os.walk(self.path):
+            if files and root != self.path:
+                entry_size = sum(os.path.getsize(root + os.path.sep + file) for file in files)
+                entries.append((os.path.getmtime(root), entry_size, root))
+                size += entry_size
+        for mtime, entry_size, entry_path in sorted(entries):
+            if size <= self.max_size:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            size -= entry_size
+            with self._lock:
+                self.evictions += 1
+
+    def expire(self, max_age):
+        """Delete entries which were not used for max_age seconds
+
+        :param max_age: max time in seconds since the last use of entry
+        :type max_age: float
+
+        :returns: number of deleted entries
+        :rtype: int
+        """
+        count = 0
+        deadline = time.time() - max_age
+        for root, dirs, files in os.walk(self.path):
+            if files and root != self.path and os.path.getmtime(root) < deadline:
+                shutil.rmtree(root, ignore_errors=True)
+                count += 1
+        with self._lock:
+            self.evictions += count
+        return count
+
+    def stats(self):
+        """Get cache counters
+
+        :returns: dict with number of hits, misses and evictions
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def place_file(src, dst):
+    """Create hard link to the file or copy it if linking is not possible"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+_file_cache = None
+_file_cache_lock = Lock()
+
+
+def get_file_cache():
+    """Get process wide file cache configured by FILE_CACHE_PATH and FILE_CACHE_SIZE(in megabytes)
+
+    :returns: cache object or None if USE_FILE_CACHE is disabled
+    :rtype: FileCache or None
+    """
+    global _file_cache
+    if not current_app.config['USE_FILE_CACHE']:
+        return None
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = FileCache(current_app.config['FILE_CACHE_PATH'],
+                                    current_app.config['FILE_CACHE_SIZE'] * 1024 * 1024)
+    return _file_cache
+
+
+_source_cache = None
+_source_cache_lock = Lock()
+
+
+def get_source_cache():
+    """Get process wide cache of downloaded(not converted) files configured by SOURCE_CACHE_PATH
+       and SOURCE_CACHE_SIZE(in megabytes), entries are expired after SOURCE_CACHE_TTL minutes(see 'FileCache.expire')
+
+    :returns: cache object or None if USE_SOURCE_CACHE is disabled
+    :rtype: FileCache or None
+    """
+    global _source_cache
+    if not current_app.config['USE_SOURCE_CACHE']:
+        return None
+    with _source_cache_lock:
+        if _source_cache is None:
+            _source_cache = FileCache(current_app.config['SOURCE_CACHE_PATH'],
+                                      current_app.config['SOURCE_CACHE_SIZE'] * 1024 * 1024)
+    return _source_cache
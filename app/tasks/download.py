@@ -3,125 +3,818 @@ from app import db
 from app.models import Task
 from app.models import FileInfo
 from app.tasks.mail import send_file_ready_email
-from app.tasks.mail import send_file_fail_email
 from app.tasks.info import get_yt_file_info
+from app.tasks.info import get_yt_files_info
 from app.tasks.info import is_allowed_duration
 from app.tasks.info import BadUrlError
 from app.tasks.tags import get_repaired_tags_for_yt
 from app.tasks.tags import get_repaired_tags_for_sc
-from app.tasks.tags import insert_tags
+from app.tasks.tags import get_image_bytes_from_url
+from app.tasks.tags import get_ffmpeg_metadata_options
+from app.tasks.tags import insert_audio_tags
+from app.tasks.pipeline import Pipeline
+from app.tasks.pipeline import Stage
+from app.tasks.archive import stream_zip
+from app.tasks.archive import write_zip
+from app.tasks.cache import get_file_cache
+from app.tasks.cache import get_source_cache
+from app.tasks.singleflight import get_single_flight
+from app.tasks.http_client import get_http_client
+from app.tasks.ydl_pool import get_ydl_pool
+from app.tasks.transcode import transcode_segments
+from app.tasks.progress import get_progress_channel
+from app.tasks.progress import set_task_progress
 from flask import send_from_directory
+from flask import stream_with_context
+from flask import Response
 from flask import current_app
 from threading import Thread
-from sqlalchemy.exc import InvalidRequestError
+from functools import partial
+from concurrent.futures import Future
+from youtube_dl.postprocessor import FFmpegExtractAudioPP
+from youtube_dl.utils import PostProcessingError
+from requests.exceptions import RequestException
 from config import Config
 
+import operator
 import pickle
-import datetime
 import shutil
+import datetime
 import youtube_dl
 import time
-import zipfile
 import os
 
 
-def download(link: str, task=None, dir=None, quality=192, log_info=None, repair_tags=False):
-    """Download file and convert to mp3 using youtube-dl API
+class NotAllowedDurationError(BadUrlError):
+    pass
+
+
+# bitrates allowed by mp3 format
+MP3_BITRATES = [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+
+
+def get_source_format(quality=None):
+    """Get youtube-dl format selector for the target quality
+       The smallest audio stream which bitrate is not lower than target is chosen,
+       if there is no such stream the best audio stream is chosen and video is chosen only when there is no audio
+
+
+    :param quality: quality that needs to be converted or None
+    :type quality: int or None
+
+    :rtype: str
+    """
+    if not quality or quality < 10:
+        return 'bestaudio/best'
+    return f'worstaudio[abr>={quality}]/bestaudio/best'
+
+
+def cap_quality(quality: int, source_bitrate=None):
+    """Get quality which is not higher than needed to keep quality of the source
+       (the lowest mp3 bitrate which is not lower than source bitrate)
+
+
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param source_bitrate: bitrate of the source in kbps or None if it is unknown
+    :type source_bitrate: float or None
+
+    :rtype: int
+    """
+    if not source_bitrate or quality < 10:
+        return quality
+    for bitrate in MP3_BITRATES:
+        if bitrate >= source_bitrate:
+            return min(quality, bitrate)
+    return quality
+
+
+def fetch(link: str, dir: str, task=None, log_info=None, info=None, quality=None, source=None):
+    """Download file without any conversion using youtube-dl API
+       Stream is chosen by target quality(see 'get_source_format')
 
 
     :param link: link to youtube or soundcloud file
     :type link: str
-    :param dir: path to directory where should be downloaded file,
-                if not specified or None, using temp directory in where placed this .py file
+    :param dir: path to directory where should be downloaded file
     :type dir: str
     :param task: task object which describe current task
     :type task: Task or None
-    :param quality: quality that needs to be converted
-    :type quality: int
     :param log_info: string to be printed before downloading starts
     :type log_info: str
-    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
-    :type repair_tags: bool
+    :param info: youtube-dl info dict of the link(see 'get_sc_file_info'), if passed link is not extracted again
+    :type info: dict or None
+    :param quality: quality that needs to be converted, if None the best stream is downloaded
+    :type quality: int or None
+    :param source: dict which is filled with info about downloaded stream: number of downloaded bytes assigned
+                   to key "bytes", bitrate(or None) assigned to key "abr", format id assigned to key "format"
+                   and duration(or None) assigned to key "duration"
+    :type source: dict or None
 
     :returns: path to downloaded file
     :rtype: str
     """
-    print(f'quality is: {quality}')
-
-    if current_app.config['DOWNLOAD_PATH']:
-        dir = current_app.config['DOWNLOAD_PATH']
-    else:
-        dir = dir or os.path.dirname(os.path.realpath(__file__)) + os.path.sep + 'temp'
-    if task:
-        dir += os.path.sep + f'Task{task.id}'
     filename = str()
-
-    class Logger:
-        def debug(self, msg):
-            pass
-
-        def info(self, msg):
-            pass
-
-        @staticmethod
-        def error(msg):
-            print(msg)
+    percent = None
+    if source is None:
+        source = dict()
 
     def progress_hook(d):
         if d['status'] == 'finished':
-            print('Done downloading, now converting...')
+            source['bytes'] = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            print(f'Done downloading {source["bytes"]} bytes, now converting...')
             if task and task.description == 'Downloading mp3':
-                task.progress = 'Converting'
-                db.session.add(task)
-                db.session.commit()
+                set_task_progress(task, 'Converting', Stage='converting', Downloaded_bytes=source['bytes'],
+                                  Total_bytes=source['bytes'], Speed=None, Eta=None)
 
             nonlocal filename
             filename = d['filename']
         else:
             try:
                 print(f'progress: {d["downloaded_bytes"] / d["total_bytes"] * 100:2.2f}%  speed:{d["speed"] / 1000}')
+                nonlocal percent
+                if task and task.description == 'Downloading mp3' and \
+                        int(d['downloaded_bytes'] * 100 / d['total_bytes']) != percent:
+                    percent = int(d['downloaded_bytes'] * 100 / d['total_bytes'])
+                    set_task_progress(task, f'Downloading {percent}%', Stage='downloading',
+                                      Downloaded_bytes=d['downloaded_bytes'], Total_bytes=d['total_bytes'],
+                                      Speed=d.get('speed'), Eta=d.get('eta'))
             except TypeError:
                 pass
             except KeyError:
                 print(f'progress: {d["_percent_str"]}')
 
-    ydl_opts = {
-        'outtmpl': f'{dir}/%(title)s.%(ext)s',
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': str(quality),
-        }],
-        'logger': Logger(),
-        'progress_hooks': [progress_hook],
-    }
-
     if log_info:
         print(log_info)
     else:
         print('Downloading')
     if task and task.description == 'Downloading mp3':
-        task.progress = 'Downloading'
-        db.session.add(task)
-        db.session.commit()
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([link])
+        set_task_progress(task, 'Downloading', Stage='downloading')
+    with get_ydl_pool().borrow('fetch', [progress_hook], outtmpl=f'{dir}/%(title)s.%(ext)s',
+                               format=get_source_format(quality)) as ydl:
+        # info of the video is returned together with fields of the downloaded format
+        if info:
+            info = ydl.process_ie_result(info, download=True)
+        else:
+            info = ydl.extract_info(link, download=True)
+    info = info or dict()
+    source['abr'] = info.get('abr')
+    source['format'] = info.get('format_id')
+    source['duration'] = info.get('duration')
+    print(f'Downloaded format {source["format"]}({source["abr"]} kbps, {source["duration"]} seconds)')
+    return filename
+
+
+def convert(filename: str, quality=192, tags=None, source_bitrate=None, extra_qualities=(), outputs=None,
+            duration=None):
+    """Convert downloaded file to mp3 using ffmpeg through youtube-dl postprocessor and delete source file
+       If tags are passed, they are written(together with cover) by the same ffmpeg call,
+       so mp3 file is written only once
+       If extra qualities are passed, files of these qualities are written by the same ffmpeg call(source is decoded
+       once), every extra file is placed to subdirectory named as its quality
+       If file is longer than SEGMENT_TRANSCODE_DURATION seconds, it is encoded by segments in parallel
+       (see tasks/transcode.py)
+
+
+    :param filename: path to downloaded file
+    :type filename: str
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param tags: dict of tags(see tasks/tags.py to more info) or None
+    :type tags: dict or None
+    :param source_bitrate: bitrate of downloaded file in kbps, if passed quality is capped by it(see 'cap_quality')
+    :type source_bitrate: float or None
+    :param extra_qualities: qualities of additional files
+    :type extra_qualities: iterable
+    :param outputs: dict which is filled with paths to additional files assigned to their qualities
+    :type outputs: dict or None
+    :param duration: duration of downloaded file in seconds or None if it is unknown
+    :type duration: float or None
+
+    :raises youtube_dl.DownloadError: when conversion is failed
+
+    :returns: path to mp3 file
+    :rtype: str
+    """
+    if cap_quality(quality, source_bitrate) != quality:
+        print(f'Quality is capped to {cap_quality(quality, source_bitrate)} by source bitrate {source_bitrate}')
+        quality = cap_quality(quality, source_bitrate)
+    if outputs is None:
+        outputs = dict()
+    segmented = bool(duration and current_app.config['SEGMENT_TRANSCODE_DURATION'] and
+                     duration > current_app.config['SEGMENT_TRANSCODE_DURATION'] and not extra_qualities)
+    with get_ydl_pool().borrow('convert') as ydl:
+        pp = FFmpegExtractAudioPP(ydl, preferredcodec='mp3', preferredquality=str(quality))
+        if not tags and not extra_qualities and not segmented:
+            try:
+                files_to_delete, info = pp.run({'filepath': filename})
+            except PostProcessingError as err:
+                raise youtube_dl.DownloadError(err.msg)
+            for file in files_to_delete:
+                os.remove(file)
+            print('Done converting')
+            return info['filepath']
+
+        tags = tags or dict()
+        mp3_filename = os.path.splitext(filename)[0] + '.mp3'
+        if mp3_filename == filename:
+            filename = os.path.splitext(filename)[0] + '.source.mp3'
+            os.rename(mp3_filename, filename)
+        for extra_quality in extra_qualities:
+            os.makedirs(os.path.dirname(mp3_filename) + os.path.sep + str(extra_quality), exist_ok=True)
+            outputs[extra_quality] = os.path.dirname(mp3_filename) + os.path.sep + str(extra_quality) + \
+                os.path.sep + os.path.basename(mp3_filename)
+        cover_filename = get_cover_file(tags, filename + '.cover')
+        try:
+            copy = pp.get_audio_codec(filename) == 'mp3'
+            if cover_filename:
+                inputs = [filename, cover_filename]
+            else:
+                inputs = [filename]
+            if segmented and not copy:
+                print(f'Converting {duration} seconds by segments')
+                transcode_segments(pp.executable, filename, mp3_filename, quality, duration,
+                                   current_app.config['SEGMENT_TRANSCODE_WORKERS'], inputs[1:],
+                                   get_mp3_output_options(quality, True, bool(cover_filename)) +
+                                   get_ffmpeg_metadata_options(tags))
+                inputs = list()
+            options = list()
+            for extra_quality, extra_filename in outputs.items():
+                options += get_mp3_output_options(cap_quality(extra_quality, source_bitrate), copy,
+                                                  bool(cover_filename)) + get_ffmpeg_metadata_options(tags)
+                options.append(extra_filename)
+            options += get_mp3_output_options(quality, copy, bool(cover_filename)) + get_ffmpeg_metadata_options(tags)
+            if inputs:
+                pp.run_ffmpeg_multiple_files(inputs, mp3_filename, options)
+        except PostProcessingError as err:
+            raise youtube_dl.DownloadError(err.msg)
+        finally:
+            if cover_filename:
+                os.remove(cover_filename)
+    os.remove(filename)
     print('Done converting')
+    return mp3_filename
+
+
+def get_mp3_output_options(quality: int, copy=False, cover=False):
+    """Get ffmpeg options of one mp3 output(options are applied to the output which path follows them)
+
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param copy: if True audio stream is copied(source is mp3)
+    :type copy: bool
+    :param cover: if True the second input is written as cover
+    :type cover: bool
+
+    :returns: list of ffmpeg options
+    :rtype: list
+    """
+    if copy:
+        options = ['-c:a', 'copy']
+    elif quality < 10:
+        options = ['-c:a', 'libmp3lame', '-q:a', str(quality)]
+    else:
+        options = ['-c:a', 'libmp3lame', '-b:a', f'{quality}k']
+    if cover:
+        return ['-map', '0:a:0', '-map', '1:0', '-c:v', 'copy',
+                '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)'] + options
+    return ['-map', '0:a:0', '-vn'] + options
+
+
+def remux(filename: str, tags=None):
+    """Put downloaded audio to the container of its codec(m4a for aac, opus, ogg for vorbis) without re-encoding,
+       tag it with mutagen and delete source file, if codec has no own container file is converted to mp3
+
+
+    :param filename: path to downloaded file
+    :type filename: str
+    :param tags: dict of tags(see tasks/tags.py to more info) or None
+    :type tags: dict or None
+
+    :raises youtube_dl.DownloadError: when remuxing is failed
+
+    :returns: path to remuxed file
+    :rtype: str
+    """
+    with get_ydl_pool().borrow('convert') as ydl:
+        pp = FFmpegExtractAudioPP(ydl, preferredcodec='best')
+        try:
+            files_to_delete, info = pp.run({'filepath': filename})
+        except PostProcessingError as err:
+            raise youtube_dl.DownloadError(err.msg)
+    for file in files_to_delete:
+        os.remove(file)
+    if tags:
+        # file which is not remuxed can be linked to the source cache entry, so it is tagged in its own copy
+        if os.stat(info['filepath']).st_nlink > 1:
+            shutil.copyfile(info['filepath'], info['filepath'] + '.copy')
+            os.replace(info['filepath'] + '.copy', info['filepath'])
+        insert_audio_tags(info['filepath'], tags)
+    print('Done remuxing')
+    return info['filepath']
+
+
+def get_cover_file(tags: dict, filename: str):
+    """Write cover image specified in tags to file
+
+    :param tags: dict of tags
+    :type tags: dict
+    :param filename: path to image file
+    :type filename: str
+
+    :returns: path to image file or None if there is no cover or it is failed to be received
+    :rtype: str or None
+    """
+    if not tags.get('image'):
+        return None
+    try:
+        data = get_image_bytes_from_url(tags['image'])
+    except RequestException as err:
+        print(f'Failed to receive cover {tags["image"]}: {err}')
+        return None
+    with open(filename, 'wb') as file:
+        file.write(data)
+    return filename
+
+
+def get_source_id(link: str):
+    """Get resource name and file id from the link
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+
+    :returns: tuple with resource("yt" or "sc") and file id(video id or url path)
+    :rtype: tuple
+    """
+    if link.startswith('https://www.youtube.com/watch?v='):
+        return 'yt', link[32:43]
+    elif link.startswith('https://youtu.be/'):
+        return 'yt', link[17:28]
+    else:
+        return 'sc', link.split('?')[0].rstrip('/')
+
+
+def download(link: str, task=None, dir=None, quality=192, log_info=None, repair_tags=False, info=None,
+             output_format='mp3'):
+    """Download file and convert to mp3 using youtube-dl API
+
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+    :param dir: path to directory where should be downloaded file,
+                if not specified or None, using temp directory in where placed this .py file
+    :type dir: str
+    :param task: task object which describe current task
+    :type task: Task or None
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param log_info: string to be printed before downloading starts
+    :type log_info: str
+    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
+    :type repair_tags: bool
+    :param info: youtube-dl info dict of soundcloud file received while link was checked(see 'get_sc_file_info'),
+                 if passed it is used for tags and downloading instead of extracting link again
+    :type info: dict or None
+    :param output_format: "mp3" or "original"(audio is only put to the container of its codec, see 'remux')
+    :type output_format: str
+
+    If the same file is being downloaded by other thread or process(when celery is used),
+    waits for it and takes its result from the file cache
+
+    :returns: path to converted(or remuxed) file, downloaded file is deleted by conversion
+    :rtype: str
+    """
+    print(f'quality is: {quality}')
+
+    if current_app.config['DOWNLOAD_PATH']:
+        dir = current_app.config['DOWNLOAD_PATH']
+    else:
+        dir = dir or os.path.dirname(os.path.realpath(__file__)) + os.path.sep + 'temp'
+    if task:
+        dir += os.path.sep + f'Task{task.id}'
+
+    cache = get_file_cache()
+    if not cache:
+        return fetch_and_convert(link, task, dir, quality, log_info, repair_tags, info, output_format)[1]
+
+    key = cache.make_key(*get_source_id(link), quality, repair_tags, output_format)
+    with get_single_flight().hold(key):
+        filename = cache.get(key, dir)
+        if filename:
+            print(f'Taken from cache: {filename}')
+            return filename
+        filename = fetch_and_convert(link, task, dir, quality, log_info, repair_tags, info, output_format)[1]
+        cache.put(key, filename)
+    return filename
+
+
+def fetch_and_convert(link: str, task=None, dir=None, quality=192, log_info=None, repair_tags=False, info=None,
+                      output_format='mp3'):
+    """Download file and convert it to mp3(or remux it) with tags, which are received while file is downloaded
+       (see 'download' for params description)
+
+    :returns: tuple of paths to downloaded and converted files
+    :rtype: tuple
+    """
+    tags = None
     if repair_tags:
         if link.startswith('https://www.youtube.com/watch?v='):
-            tags = get_repaired_tags_for_yt(link[32:43])
+            tags = run_in_background(get_repaired_tags_for_yt, link[32:43])
         elif link.startswith('https://youtu.be/'):
-            tags = get_repaired_tags_for_yt(link[17:])
+            tags = run_in_background(get_repaired_tags_for_yt, link[17:])
+        else:
+            tags = run_in_background(get_repaired_tags_for_sc, link, info)
+    source = dict()
+    filename = fetch_source(link, dir, quality, task=task, log_info=log_info, info=info, source=source)
+    if tags:
+        tags = tags.result()
+    if output_format == 'original':
+        return filename, remux(filename, tags)
+    outputs = dict()
+    # sources cached without stream info use duration of passed info
+    mp3_filename = convert(filename, quality, tags, source.get('abr'),
+                           get_extra_qualities(link, quality, repair_tags, output_format), outputs,
+                           source.get('duration') or (info or dict()).get('duration'))
+    cache_extra_outputs(link, outputs, repair_tags)
+    return filename, mp3_filename
+
+
+def get_source_keys(link: str, quality=None):
+    """Get keys of source cache entries which can be used to convert file to the quality
+       (sources downloaded for the same or higher quality and sources downloaded as the best stream)
+
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+    :param quality: quality that needs to be converted or None
+    :type quality: int or None
+
+    :returns: list of keys, the first one is the key of the source downloaded for this quality
+    :rtype: list
+    """
+    cache = get_source_cache()
+    if not quality or quality < 10:
+        qualities = [None]
+    else:
+        qualities = [quality] + [bitrate for bitrate in MP3_BITRATES if bitrate > quality] + [None]
+    return [cache.make_key(*get_source_id(link), 'source', source_quality) for source_quality in qualities]
+
+
+def fetch_source(link: str, dir: str, quality=None, task=None, log_info=None, info=None, source=None):
+    """Take downloaded file from the source cache or download it through 'fetch' and put to the source cache
+       (see 'fetch' for params description), info about downloaded stream is kept with the cached file,
+       so source dict is filled on cache hits as well
+
+    :returns: path to downloaded file
+    :rtype: str
+    """
+    cache = get_source_cache()
+    if not cache:
+        return fetch(link, dir, task=task, log_info=log_info, info=info, quality=quality, source=source)
+
+    if source is None:
+        source = dict()
+    keys = get_source_keys(link, quality)
+    for key in keys:
+        if os.path.isdir(cache.get_entry_path(key)):
+            filename = cache.get(key, dir)
+            if filename:
+                print(f'Source taken from cache: {filename}')
+                source.update(cache.get_meta(key))
+                return filename
+    filename = fetch(link, dir, task=task, log_info=log_info, info=info, quality=quality, source=source)
+    cache.put(keys[0], filename, meta=source)
+    return filename
+
+
+def get_extra_qualities(link: str, quality=192, repair_tags=False, output_format='mp3'):
+    """Get qualities from PREENCODE_QUALITIES which should be converted together with the requested one
+       (only qualities which are not in the file cache yet)
+
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+    :param quality: requested quality
+    :type quality: int
+    :param repair_tags: define use repair tags functions or not(used as part of the cache key)
+    :type repair_tags: bool
+    :param output_format: requested output format, extra qualities are converted only for mp3
+    :type output_format: str
+
+    :rtype: list
+    """
+    cache = get_file_cache()
+    if not cache or output_format != 'mp3':
+        return []
+    return [extra_quality for extra_quality in current_app.config['PREENCODE_QUALITIES'] if extra_quality != quality and
+            not os.path.isdir(cache.get_entry_path(cache.make_key(*get_source_id(link), extra_quality, repair_tags,
+                                                                  'mp3')))]
+
+
+def cache_extra_outputs(link: str, outputs: dict, repair_tags=False):
+    """Put files converted to extra qualities(see 'convert') to the file cache and delete them from task directory
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+    :param outputs: dict with paths to files assigned to their qualities
+    :type outputs: dict
+    :param repair_tags: define use repair tags functions or not(used as part of the cache key)
+    :type repair_tags: bool
+    """
+    cache = get_file_cache()
+    for quality, filename in outputs.items():
+        cache.put(cache.make_key(*get_source_id(link), quality, repair_tags, 'mp3'), filename)
+        shutil.rmtree(os.path.dirname(filename), ignore_errors=True)
+
+
+def run_in_background(func, *args, **kwargs):
+    """Start function in separate thread with current application context
+
+    :param func: function to be called
+    :type func: callable
+
+    :returns: future of function result, exception raised by function is raised by its 'result' method
+    :rtype: Future
+    """
+    app = current_app._get_current_object()
+    future = Future()
+
+    def target():
+        with app.app_context():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as err:
+                future.set_exception(err)
+
+    Thread(target=target, daemon=True).start()
+    return future
+
+
+def resolve_playlist_item(entry: tuple, dir=None, quality=192, repair_tags=False, infos=None, output_format='mp3'):
+    """Check youtube video for availability and duration and receive its tags
+       First stage of playlist pipeline, it runs ahead of downloading, so tags are ready when file is downloaded,
+       if file is found in the file cache it is placed to the directory and next stages do nothing,
+       if the same file is being downloaded by other job, waits for it(key is released by convert stage)
+
+
+    :param entry: tuple with youtube video id and name of the item directory(unique for every playlist item,
+                  so items are downloaded simultaneously without sharing files)
+    :type entry: tuple
+    :param dir: path to directory in which will be created item directory for downloaded file
+    :type dir: str
+    :param quality: quality that needs to be converted(used as part of the cache key)
+    :type quality: int
+    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
+    :type repair_tags: bool
+    :param infos: info about playlist videos received by 'get_yt_files_info', if None video info is requested
+    :type infos: dict or None
+    :param output_format: "mp3" or "original"(used as part of the cache key)
+    :type output_format: str
+
+    :raises BadUrlError: when no information is received about the video
+    :raises NotAllowedDurationError: when video is longer than allowed
+
+    :returns: dict with video id assigned to key "record", path to item directory assigned to key "dir",
+              path to cached file(or None) assigned to key "filename", tags(or None) assigned to key "tags",
+              cache key(or None) assigned to key "key", boolean assigned to key "cached"
+              and held single flight key(or None) assigned to key "flight"
+    :rtype: dict
+    """
+    record, item_dir = entry
+    item_dir = dir + os.path.sep + item_dir
+    cache = get_file_cache()
+    key = None
+    flight = None
+    if cache:
+        key = cache.make_key('yt', record, quality, repair_tags, output_format)
+        flight = get_single_flight().acquire(key)
+        filename = cache.get(key, item_dir)
+        if filename:
+            get_single_flight().release(flight)
+            return {'record': record, 'dir': item_dir, 'filename': filename, 'tags': None, 'key': key,
+                    'cached': True, 'flight': None}
+
+    try:
+        link = 'https://www.youtube.com/watch?v=' + record
+        if infos is None:
+            info = get_yt_file_info(link)
+        elif record in infos:
+            info = infos[record]
+        else:
+            raise BadUrlError('No information about this video.')
+        if not is_allowed_duration(info):
+            raise NotAllowedDurationError(f'Video {record} is longer than allowed.')
+        if repair_tags:
+            tags = get_repaired_tags_for_yt(record, info['API_response'] if infos is not None else None)
+        else:
+            tags = None
+    except Exception:
+        if flight:
+            get_single_flight().release(flight)
+        raise
+    return {'record': record, 'dir': item_dir, 'filename': None, 'tags': tags, 'key': key, 'cached': False,
+            'flight': flight}
+
+
+def fetch_playlist_item(item: dict, quality=192):
+    """Download playlist item to its own directory
+       Network bound stage of playlist pipeline
+
+
+    :param item: dict returned by 'resolve_playlist_item'
+    :type item: dict
+    :param quality: quality that needs to be converted(used to choose downloaded stream)
+    :type quality: int
+
+    :raises youtube_dl.DownloadError: when downloading is failed
+
+    :returns: item dict with path to downloaded file assigned to key "filename"
+             and info about downloaded stream(see 'fetch') assigned to key "source"
+    :rtype: dict
+    """
+    if item['cached']:
+        return item
+    record = item['record']
+    item['source'] = dict()
+    try:
+        item['filename'] = fetch_source('https://www.youtube.com/watch?v=' + record, item['dir'], quality,
+                                        log_info=f'Downloading {record}', source=item['source'])
+    except Exception:
+        if item['flight']:
+            get_single_flight().release(item['flight'])
+        raise
+    return item
+
+
+def convert_playlist_item(item: dict, quality=192, output_format='mp3', repair_tags=False):
+    """Convert downloaded playlist item to mp3(or remux it) with tags
+       Cpu bound stage of playlist pipeline
+
+
+    :param item: dict returned by 'fetch_playlist_item'
+    :type item: dict
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
+    :param repair_tags: define use repair tags functions or not(used as part of the cache key of extra qualities)
+    :type repair_tags: bool
+
+    :raises youtube_dl.DownloadError: when conversion is failed
+
+    :returns: path to mp3 file
+    :rtype: str
+    """
+    if item['cached']:
+        return item['filename']
+    try:
+        if output_format == 'original':
+            filename = remux(item['filename'], item['tags'])
         else:
-            tags = get_repaired_tags_for_sc(link)
-        insert_tags(filename[:filename.rfind('.')] + '.mp3', tags)
+            link = 'https://www.youtube.com/watch?v=' + item['record']
+            outputs = dict()
+            filename = convert(item['filename'], quality, item['tags'], item['source'].get('abr'),
+                               get_extra_qualities(link, quality, repair_tags, output_format), outputs,
+                               item['source'].get('duration'))
+            cache_extra_outputs(link, outputs, repair_tags)
+        if item['key']:
+            get_file_cache().put(item['key'], filename)
+    finally:
+        if item['flight']:
+            get_single_flight().release(item['flight'])
     return filename
 
 
+def make_playlist_pipeline(app, dir=None, quality=192, repair_tags=False, infos=None, output_format='mp3'):
+    """Create pipeline for playlist items downloading
+       Pipeline consists of lookup(PLAYLIST_LOOKUP_WORKERS threads), fetching(PLAYLIST_WORKERS threads)
+       and converting(PLAYLIST_TRANSCODERS threads) stages connected by queues with PLAYLIST_QUEUE_SIZE capacity,
+       results should be consumed by one writer
+
+
+    :param app: flask application object
+    :type app: Flask
+    :param dir: path to directory where should be downloaded files
+    :type dir: str
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
+    :type repair_tags: bool
+    :param infos: info about playlist videos received by 'get_yt_files_info'
+    :type infos: dict or None
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
+
+    :returns: pipeline object
+    :rtype: Pipeline
+    """
+    return Pipeline([Stage('lookup', partial(resolve_playlist_item, dir=dir, quality=quality, repair_tags=repair_tags,
+                                             infos=infos, output_format=output_format),
+                           workers=app.config['PLAYLIST_LOOKUP_WORKERS']),
+                     Stage('fetch', partial(fetch_playlist_item, quality=quality),
+                           workers=app.config['PLAYLIST_WORKERS']),
+                     Stage('convert', partial(convert_playlist_item, quality=quality, output_format=output_format,
+                                                      repair_tags=repair_tags),
+                           workers=app.config['PLAYLIST_TRANSCODERS'])],
+                    queue_size=app.config['PLAYLIST_QUEUE_SIZE'], app=app)
+
+
+def download_playlist_items(app, playlist: list, task=None, dir=None, quality=192, repair_tags=False, first_index=0,
+                            output_format='mp3'):
+    """Download playlist items through the pipeline and keep downloaded files in the task directory
+       Results are written in playlist order, so as soon as FileInfo of the item gets status code 1
+       its file is ready to be sent, info about all items is requested at once before downloading starts
+       Every item is downloaded to its own directory(named as record, repeated records get a number suffix)
+       and is written to its own FileInfo(not processed FileInfo objects are taken in index order)
+
+
+    :param app: flask application object
+    :type app: Flask
+    :param playlist: list of youtube video ids represented as strings
+    :type playlist: list
+    :param task: task object which describe this process or None
+    :type task: Task or None
+    :param dir: path to directory where should be downloaded files
+    :type dir: str
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
+    :type repair_tags: bool
+    :param first_index: number of items of the task which were downloaded before
+    :type first_index: int
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
+
+    :returns: tuple with list of paths to downloaded files and list of links that was failed to download
+    :rtype: tuple
+    """
+    counter = first_index
+    files_len = len(playlist) + first_index
+    filenames = list()
+    errors_list = list()
+
+    try:
+        infos = get_yt_files_info(playlist)
+    except (ConnectionError, RequestException) as err:
+        print(f'Failed to receive playlist info at once, every item will be requested separately: {err}')
+        infos = None
+    entries = list()
+    occurrences = dict()
+    for record in playlist:
+        occurrences[record] = occurrences.get(record, 0) + 1
+        entries.append((record, record if occurrences[record] == 1 else f'{record}_{occurrences[record]}'))
+    file_infos = dict()
+    if task:
+        for file_info in sorted(task.files.filter_by(status_code=0).all(), key=operator.attrgetter('index')):
+            file_infos.setdefault(file_info.file_id, list()).append(file_info)
+
+    pipeline = make_playlist_pipeline(app, dir=dir, quality=quality, repair_tags=repair_tags, infos=infos,
+                                      output_format=output_format)
+    results = pipeline.run(entries)
+
+    for record in playlist:
+        counter += 1
+        link = 'https://www.youtube.com/watch?v=' + record
+        file_info = None
+        if task:
+            file_info = file_infos[record].pop(0)
+            set_task_progress(task, f'Downloading {counter} of {files_len}', Stage='downloading',
+                              Current_item=counter, Items=files_len)
+
+        filename, err = next(results)
+        try:
+            if err:
+                raise err
+            filenames.append(filename)
+            if task:
+                file_info.filename = os.path.relpath(filename, dir)
+                file_info.set_file_hash(filename)
+                file_info.status_code = 1
+                db.session.add(file_info)
+                db.session.commit()
+                get_progress_channel().publish(task.id, {'Item': file_info.index, 'Item_status': 1})
+
+        except (BadUrlError, youtube_dl.DownloadError):
+            if task:
+                file_info.status_code = 2
+                db.session.add(file_info)
+                db.session.commit()
+                get_progress_channel().publish(task.id, {'Item': file_info.index, 'Item_status': 2})
+
+            errors_list.append(link)
+
+    print(f'Playlist pipeline stats: {pipeline.stats()}')
+    if get_file_cache():
+        print(f'File cache stats: {get_file_cache().stats()}')
+    print(f'HTTP client stats: {get_http_client().stats()}')
+    return filenames, errors_list
+
+
 def download_yt_files_sync(playlist: list, task_id=None, dir=None, quality=192, repair_tags=False, app=None,
-                           send_mails=True):
-    """Download couple of youtube files using param playlist through 'download' function
+                           send_mails=True, output_format='mp3'):
+    """Download couple of youtube files using param playlist through 'download_playlist_items' function
+       Downloaded files are kept in task directory and sent to user as zip archive built on the fly
+       (see 'get_stream_response'), if task is not passed files are packed to playlist.zip
 
 
     :param task_id: id of current task, which describe this process or None
@@ -139,9 +832,11 @@ def download_yt_files_sync(playlist: list, task_id=None, dir=None, quality=192,
     :type app: Flask
     :param send_mails: boolean variable to define, send mails or not
     :type send_mails: bool
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
 
-    :returns: path to downloaded file(in case when task_id not passed)
-    :rtype: str
+    :returns: path to archive, number of fails and sha256 hash of archive(in case when task_id not passed)
+    :rtype: tuple
     """
     if not app:
         app = create_app()
@@ -149,133 +844,30 @@ def download_yt_files_sync(playlist: list, task_id=None, dir=None, quality=192,
     app_context = app.app_context()
     app_context.push()
 
-    part_size = current_app.config['PLAYLIST_PART_SIZE']
     if task_id:
         task = Task.query.get(task_id)
     else:
         task = None
 
-    arcpath = (dir + os.path.sep + 'playlist.zip' or 'playlist.zip')
-
-    working_dir = os.getcwd()
-    errors_num = 0
-    counter = 0
+    dir = dir or os.path.dirname(os.path.realpath(__file__)) + os.path.sep + 'temp'
     files_len = len(playlist)
-    parts_num = int(files_len / part_size + 1) if files_len % part_size else int(files_len / part_size)
 
-    arc_info = None
     if task:
-        try:
-            task.progress = f'Preparing for downloading'
-            db.session.add(task)
-            db.session.commit()
-        except InvalidRequestError:
-            time.sleep(5)
-            task.progress = f'Preparing for downloading'
-            db.session.add(task)
-            db.session.commit()
+        set_task_progress(task, 'Preparing for downloading', Stage='preparing', Items=files_len)
 
-        arc_info = FileInfo.query.filter_by(index=0, file_id='playlist.zip', task_id=task.id).first()
-
-    errors_list = []
-
-    for part in range(0, parts_num):
-        part_info = None
-        if task:
-            part_info = FileInfo(index=0, file_id=f'part{part + 1}.zip', task_id=task.id)
-            db.session.add(part_info)
-            db.session.commit()
-        with zipfile.ZipFile(dir + os.path.sep + f'part{part + 1}.zip', 'w') as archive:
-            for record in playlist[part * part_size: (part + 1) * part_size]:
-                counter += 1
-                time.sleep(2)
-                if task:
-                    file_info = task.files.filter_by(file_id=record).first()
-                try:
-                    link = 'https://www.youtube.com/watch?v=' + record
-                    info = get_yt_file_info(link)
-                except BadUrlError:
-                    if task:
-                        file_info.status_code = 2
-                        db.session.add(file_info)
-                        db.session.commit()
-                    errors_num += 1
-                    errors_list.append(link)
-                    continue
-
-                if not is_allowed_duration(info):
-                    if task:
-                        file_info.status_code = 2
-                        db.session.add(file_info)
-                        db.session.commit()
-                    errors_num += 1
-                    errors_list.append(link)
-                    continue
-
-                if task:
-                    task.progress = f'Downloading {counter} of {files_len}'
-                    db.session.add(task)
-                    db.session.commit()
-
-                try:
-                    filename = download(link, task=None, dir=dir, quality=quality, repair_tags=repair_tags,
-                                        log_info=f'Downloading {counter} of {files_len}', )
-                    dirname = os.path.dirname(filename)
-                    os.chdir(dirname)
-                    filename = '.'.join((filename.split(os.sep)[-1].split('.')[:-1])) + '.mp3'
-                    archive.write(filename)
-                    os.remove(filename)
-                    os.chdir(working_dir)
-                    if task:
-                        file_info.status_code = 1
-                        db.session.add(file_info)
-                        db.session.commit()
-
-                except youtube_dl.DownloadError:
-                    if task:
-                        file_info.status_code = 2
-                        db.session.add(file_info)
-                        db.session.commit()
-
-                    errors_num += 1
-                    errors_list.append(link)
-
-        if task:
-            part_info.set_file_hash(dir + os.path.sep + f'part{part + 1}.zip')
-            db.session.add(part_info)
-            db.session.commit()
-
-    with zipfile.ZipFile(arcpath, 'w') as archive:
-        for part in range(0, parts_num):
-            with zipfile.ZipFile(dir + os.path.sep + f'part{part + 1}.zip', 'r') as part_:
-                extraction_dir = dir + os.path.sep + 'extract'
-                os.mkdir(extraction_dir)
-                part_.extractall(path=extraction_dir)
-                os.chdir(extraction_dir)
-                for el in os.listdir('./'):
-                    archive.write(el)
-                os.chdir(working_dir)
-                shutil.rmtree(extraction_dir)
-                if task:
-                    arc_info.set_file_hash(arcpath)
-                    db.session.add(arc_info)
-                    db.session.commit()
-
-    for part in range(0, parts_num):
-        os.remove(dir + os.path.sep + f'part{part + 1}.zip')
+    filenames, errors_list = download_playlist_items(app, playlist, task=task, dir=dir, quality=quality,
+                                                     repair_tags=repair_tags, output_format=output_format)
 
     if task:
         send_file_ready_email(task.user, 'Your files is ready.', 'emails/file_ready', errors_list)
-        task.progress = f'Files downloaded({files_len}) with {errors_num} fails'
-        task.status_code = 4
         task.completed_at = datetime.datetime.now()
-        task.unique_process_info = os.path.abspath(arcpath)
-        db.session.add(task)
-        db.session.commit()
+        set_task_progress(task, f'Files downloaded({files_len}) with {len(errors_list)} fails', status_code=4)
         app_context.pop()
     else:
+        arcpath = dir + os.path.sep + 'playlist.zip'
+        arc_hash = write_zip([(filename, os.path.basename(filename)) for filename in filenames], arcpath)
         app_context.pop()
-        return os.path.abspath(arcpath), errors_num
+        return os.path.abspath(arcpath), len(errors_list), arc_hash
 
 
 if Config.USE_CELERY:
@@ -283,14 +875,14 @@ if Config.USE_CELERY:
 
     @celery.task
     def download_yt_files_async(playlist: list, task_id=None, dir=None, quality=192, repair_tags=False,
-                                send_mails=True):
+                                send_mails=True, output_format='mp3'):
         return download_yt_files_sync(playlist, task_id=task_id, dir=dir, quality=quality, repair_tags=repair_tags,
-                                      send_mails=send_mails)
+                                      send_mails=send_mails, output_format=output_format)
 
 
-def download_yt_files(playlist: list, task=None, dir=None, quality=192, repair_tags=False):
+def download_yt_files(playlist: list, task=None, dir=None, quality=192, repair_tags=False, output_format='mp3'):
     """Wrapper to 'download_yt_files_sync' function. Create directory for downloading, kwargs file and FileInfo objects
-       for all ids in playlist and main archive
+       for all ids in playlist
        Depending on configuration can run 'download_yt_files_sync' directly in the 'main' thread,
        in child thread or as celery task
 
@@ -306,11 +898,12 @@ def download_yt_files(playlist: list, task=None, dir=None, quality=192, repair_t
     :type quality: int
     :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
     :type repair_tags: bool
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
 
     :returns: path to downloaded file(in case when task_id not passed)
     :rtype: str
     """
-    part_size = current_app.config['PLAYLIST_PART_SIZE']
     send_mails = current_app.config['SEND_MAILS']
 
     if current_app.config['DOWNLOAD_PATH']:
@@ -322,7 +915,7 @@ def download_yt_files(playlist: list, task=None, dir=None, quality=192, repair_t
               'quality': quality,
               'repair_tags': repair_tags,
               'send_mails': send_mails,
-              'part_size': part_size}
+              'output_format': output_format}
 
     if not os.path.isdir(dir):
         try:
@@ -342,28 +935,129 @@ def download_yt_files(playlist: list, task=None, dir=None, quality=192, repair_t
 
     if task:
         task.progress = 'Waiting'
+        task.unique_process_info = os.path.abspath(dir)
         db.session.add(task)
         db.session.commit()
         FileInfo.make_records(playlist, task.id)
-        arc_info = FileInfo(index=0, file_id='playlist.zip', task_id=task.id)
-        db.session.add(arc_info)
-        db.session.commit()
 
     if current_app.config['SYNC_DOWNLOADINGS']:
         app = current_app._get_current_object()
         download_yt_files_sync(playlist, task_id=task.id, quality=quality, dir=dir, repair_tags=repair_tags,
-                               send_mails=send_mails, app=app)
+                               send_mails=send_mails, app=app, output_format=output_format)
     elif current_app.config['USE_CELERY']:
         download_yt_files_async.apply_async(args=[playlist],
                                             kwargs={'task_id': task.id, 'quality': quality, 'dir': dir,
-                                                    'repair_tags': repair_tags, 'send_mails': send_mails},
+                                                    'repair_tags': repair_tags, 'send_mails': send_mails,
+                                                    'output_format': output_format},
                                             queue='downloading_tasks',
                                             routing_key='download.playlist')
     else:
         Thread(target=download_yt_files_sync,
                args=[playlist],
                kwargs={'task_id': task.id, 'quality': quality, 'dir': dir, 'repair_tags': repair_tags,
-                       'send_mails': send_mails}).start()
+                       'send_mails': send_mails, 'output_format': output_format}).start()
+
+
+def download_file_sync(link: str, task_id=None, dir=None, quality=192, repair_tags=False, info=None,
+                       output_format='mp3', app=None):
+    """Download single file through 'download' function and mark task as ready to download(status code 4)
+       Task directory is kept in task unique_process_info and path to file relative to it
+       is kept in the FileInfo object of the task, if downloading is failed(by any error) task is stopped,
+       so user can start other downloading
+
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+    :param task_id: id of task object which describe this process
+    :type task_id: int
+    :param dir: path to directory where should be downloaded file(see 'download')
+    :type dir: str
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
+    :type repair_tags: bool
+    :param info: youtube-dl info dict of soundcloud file(see 'download')
+    :type info: dict or None
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
+    :param app: flask application object, if case it not passed function will create its own with base config
+    :type app: Flask
+    """
+    if not app:
+        app = create_app()
+    with app.app_context():
+        task = Task.query.get(task_id)
+        try:
+            filename = download(link, task=task, dir=dir, quality=quality, repair_tags=repair_tags, info=info,
+                                output_format=output_format)
+        except Exception as err:
+            print(f'Failed to download {link}: {err!r}')
+            db.session.rollback()
+            task.completed_at = datetime.datetime.now()
+            set_task_progress(task, 'Download error', status_code=1)
+            return
+
+        task.unique_process_info = os.path.abspath(os.path.dirname(filename))
+        file_info = FileInfo(index=1, file_id=link[:128], task_id=task.id, status_code=1,
+                             filename=os.path.basename(filename))
+        task.completed_at = datetime.datetime.now()
+        db.session.add(file_info)
+        set_task_progress(task, 'Ready', status_code=4)
+
+
+if Config.USE_CELERY:
+    from app import celery
+
+    @celery.task
+    def download_file_async(link: str, task_id=None, dir=None, quality=192, repair_tags=False, info=None,
+                            output_format='mp3'):
+        return download_file_sync(link, task_id=task_id, dir=dir, quality=quality, repair_tags=repair_tags, info=info,
+                                  output_format=output_format)
+
+
+def download_file(link: str, task=None, dir=None, quality=192, repair_tags=False, info=None, output_format='mp3'):
+    """Wrapper to 'download_file_sync' function
+       Depending on configuration can run 'download_file_sync' directly in the 'main' thread,
+       in child thread or as celery task, when file is ready task gets status code 4(see 'get_ready_file_response')
+
+
+    :param link: link to youtube or soundcloud file
+    :type link: str
+    :param task: task object which describe this process
+    :type task: Task
+    :param dir: path to directory where should be downloaded file(see 'download')
+    :type dir: str
+    :param quality: quality that needs to be converted
+    :type quality: int
+    :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
+    :type repair_tags: bool
+    :param info: youtube-dl info dict of soundcloud file(see 'download')
+    :type info: dict or None
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
+    """
+    kwargs = {'task_id': task.id, 'dir': dir, 'quality': quality, 'repair_tags': repair_tags, 'info': info,
+              'output_format': output_format}
+    if current_app.config['SYNC_DOWNLOADINGS']:
+        download_file_sync(link, app=current_app._get_current_object(), **kwargs)
+    elif current_app.config['USE_CELERY']:
+        download_file_async.apply_async(args=[link], kwargs=kwargs, queue='downloading_tasks',
+                                        routing_key='download.file')
+    else:
+        Thread(target=download_file_sync, args=[link], kwargs=dict(kwargs, app=current_app._get_current_object()),
+               daemon=True).start()
+
+
+def get_ready_file_response(t: Task):
+    """Get response with the file downloaded by 'download_file' and end task
+
+    :param t: task object with status code 4
+    :type t: Task
+
+    :returns: flask response
+    """
+    filename = t.unique_process_info + os.path.sep + t.files.first().filename
+    return get_download_response(filename, t, ext=os.path.splitext(filename)[1])
 
 
 def get_download_response(filename: str, t: Task, ext='.mp3', end_task=True):
@@ -383,25 +1077,82 @@ def get_download_response(filename: str, t: Task, ext='.mp3', end_task=True):
     """
 
     if end_task:
-        t.progress = 'Done'
-        t.status_code = 1
         t.completed_at = datetime.datetime.now()
-        db.session.add(t)
-        db.session.commit()
+        set_task_progress(t, 'Done', status_code=1)
 
     return send_from_directory(os.path.sep.join(os.path.realpath(filename).split(os.path.sep)[:-1]),
                                '.'.join(filename.split(os.sep)[-1].split('.')[:-1]) + ext,
                                as_attachment=True)
 
 
+def iter_playlist_files(t: Task, check_interval=1, timeout=None):
+    """Yield downloaded files of playlist task in playlist order, waiting for files which are not processed yet
+       Waiting is stopped when task is completed(for example expired) or timeout is passed, then only ready files
+       are yielded. Files which are failed, missing or not ready are skipped and listed in errors.txt at the end
+
+
+    :param t: task object
+    :type t: Task
+    :param check_interval: time interval between checks of file status(in seconds)
+    :type check_interval: int
+    :param timeout: max time of waiting for files in seconds(None to wait until task is completed)
+    :type timeout: float
+
+    :returns: generator of tuples with path to file(or content of errors.txt) and its name inside archive
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    stop_reason = None
+    skipped = list()
+    for file_info in sorted(t.files.all(), key=operator.attrgetter('index')):
+        if stop_reason:
+            db.session.refresh(file_info)
+        while not stop_reason and file_info.status_code == 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                stop_reason = 'not downloaded in time'
+                break
+            time.sleep(check_interval)
+            db.session.refresh(t)
+            db.session.refresh(file_info)
+            if t.status_code not in (3, 4):
+                stop_reason = 'not downloaded before task is completed'
+        if file_info.status_code == 0:
+            skipped.append(f'{file_info.index}. {file_info.file_id}: {stop_reason}')
+        elif file_info.status_code == 2:
+            skipped.append(f'{file_info.index}. {file_info.file_id}: failed to download')
+        else:
+            filepath = t.unique_process_info + os.path.sep + file_info.filename
+            if not os.path.isfile(filepath):
+                skipped.append(f'{file_info.index}. {file_info.file_id}: file is missing')
+                continue
+            yield filepath, os.path.basename(filepath)
+    if skipped:
+        yield ('\n'.join(skipped) + '\n').encode(), 'errors.txt'
+
+
+def get_stream_response(t: Task):
+    """Get flask streaming response with zip archive built on the fly from downloaded files of playlist task
+       Can be used while task is running, files are sent as soon as they are ready
+
+
+    :param t: task object
+    :type t: Task
+
+    :returns: flask response
+    """
+    files = iter_playlist_files(t, timeout=current_app.config['PLAYLIST_STREAM_TIMEOUT'])
+    return Response(stream_with_context(stream_zip(files)),
+                    mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=playlist.zip'})
+
+
 def resume_yt_files_downloading_sync(playlist: list, task_id=None, dir=None, quality=192, repair_tags=False,
-                                     first_part_index=0, part_size=None):
+                                     output_format='mp3'):
     """Resume youtube files downloading
 
 
     :param task_id: id of task object which describe this process or None
     :type task_id: int or None
-    :param playlist: list of youtube video ids represented as strings
+    :param playlist: list of youtube video ids represented as strings, which should be downloaded
     :type playlist: list
     :param dir: path to directory where should be downloaded file,
                 if not specified or None, using temp directory in where placed this .py file
@@ -410,10 +1161,8 @@ def resume_yt_files_downloading_sync(playlist: list, task_id=None, dir=None, qua
     :type quality: int
     :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
     :type repair_tags: bool
-    :param first_part_index: last successfully downloaded part number
-    :type first_part_index: int
-    :param part_size: size of part archive(in files number)
-    :type part_size: int
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
     """
     app = create_app()
     app_context = app.app_context()
@@ -422,122 +1171,30 @@ def resume_yt_files_downloading_sync(playlist: list, task_id=None, dir=None, qua
     task = Task.query.get(task_id)
     dir = dir or os.path.dirname(os.path.realpath(__file__)) + os.path.sep + 'temp'
     dir += os.path.sep + f'Task{task_id}'
-    arcpath = (dir + os.path.sep + 'playlist.zip' or 'playlist.zip')
-
-    working_dir = os.getcwd()
-    playlist_offset_left = first_part_index * part_size
-    counter = playlist_offset_left
-    files_len = len(playlist) + counter
-    parts_num = int(files_len / part_size + 1) if files_len % part_size else int(files_len / part_size)
-    parts_num += first_part_index
-
-    try:
-        arc_info = FileInfo.query.filter_by(file_id='playlist.zip', task_id=task.id).all()[0]
-    except IndexError:
-        send_file_fail_email(task.user, 'Failed to download your files.', 'emails/file_fail')
-        task.force_stop()
-        db.session.add(task)
-        db.session.commit()
-        app_context.pop()
-        return
 
+    files = [file for file in task.files.all() if file.index != 0]
+    files_len = len(files)
+
+    # every occurrence of record in playlist resets one FileInfo object, not finished ones first
+    occurrences = dict()
+    for record in playlist:
+        occurrences[record] = occurrences.get(record, 0) + 1
+    for file in sorted(files, key=lambda file: (file.status_code == 1, file.index)):
+        if occurrences.get(file.file_id):
+            occurrences[file.file_id] -= 1
+            file.status_code = 0
+            db.session.add(file)
+    task.unique_process_info = os.path.abspath(dir)
     db.session.add(task)
+    db.session.commit()
 
-    errors_list = ['https://www.youtube.com/watch?v=' + file.file_id for file in task.files.all()
-                   if file.index != 0 and file.status_code == 2]
-    errors_num = len(errors_list)
-
-    for part in range(first_part_index, parts_num):
-        try:
-            part_info = FileInfo.query.filter_by(index=0, task_id=task.id, file_id=f'part{part + 1}.zip').all()[0]
-        except IndexError:
-            part_info = FileInfo(index=0, file_id=f'part{part + 1}.zip', task_id=task.id)
-            db.session.add(part_info)
-            db.session.commit()
-
-        with zipfile.ZipFile(dir + os.path.sep + f'part{part + 1}.zip', 'w') as archive:
-            for record in playlist[part*part_size - playlist_offset_left: (part + 1)*part_size - playlist_offset_left]:
-                counter += 1
-                time.sleep(2)
-                file_info = task.files.filter_by(file_id=record).first()
-
-                try:
-                    link = 'https://www.youtube.com/watch?v=' + record
-                    info = get_yt_file_info(link)
-                except BadUrlError:
-                    if task:
-                        file_info.status_code = 2
-                        db.session.add(file_info)
-                        db.session.commit()
-                    errors_num += 1
-                    errors_list.append(link)
-                    continue
-
-                if not is_allowed_duration(info):
-                    if task:
-                        file_info.status_code = 2
-                        db.session.add(file_info)
-                        db.session.commit()
-                    errors_num += 1
-                    errors_list.append(link)
-                    continue
-
-                task.progress = f'Downloading {counter} of {files_len}'
-                db.session.add(task)
-                db.session.commit()
-
-                try:
-                    filename = download(link, task=None, dir=dir, quality=quality, repair_tags=repair_tags,
-                                        log_info=f'Downloading {counter} of {files_len}', )
-                    dirname = os.path.dirname(filename)
-                    os.chdir(dirname)
-                    filename = '.'.join((filename.split(os.sep)[-1].split('.')[:-1])) + '.mp3'
-                    archive.write(filename)
-                    os.remove(filename)
-                    os.chdir(working_dir)
-
-                    file_info.status_code = 1
-                    db.session.add(file_info)
-                    db.session.commit()
-
-                except youtube_dl.DownloadError:
-                    file_info.status_code = 2
-                    db.session.add(file_info)
-                    db.session.commit()
-
-                    errors_num += 1
-                    errors_list.append(link)
-
-        part_info.set_file_hash(dir + os.path.sep + f'part{part + 1}.zip')
-        db.session.add(part_info)
-        db.session.commit()
-
-    with zipfile.ZipFile(arcpath, 'w') as archive:
-        for part in range(0, parts_num):
-            with zipfile.ZipFile(dir + os.path.sep + f'part{part + 1}.zip', 'r') as part_:
-                extraction_dir = dir + os.path.sep + 'extract'
-                os.mkdir(extraction_dir)
-                part_.extractall(path=extraction_dir)
-                os.chdir(extraction_dir)
-                for el in os.listdir('./'):
-                    archive.write(el)
-                os.chdir(working_dir)
-                shutil.rmtree(extraction_dir)
-
-                arc_info.set_file_hash(arcpath)
-                db.session.add(arc_info)
-                db.session.commit()
-
-    for part in range(0, parts_num):
-        os.remove(dir + os.path.sep + f'part{part + 1}.zip')
+    filenames, errors_list = download_playlist_items(app, playlist, task=task, dir=dir, quality=quality,
+                                                     repair_tags=repair_tags, first_index=files_len - len(playlist),
+                                                     output_format=output_format)
 
     send_file_ready_email(task.user, 'Your files is ready.', 'emails/file_ready', errors_list)
-    task.progress = f'Files downloaded({files_len}) with {errors_num} fails'
-    task.status_code = 4
     task.completed_at = datetime.datetime.now()
-    task.unique_process_info = os.path.abspath(arcpath)
-    db.session.add(task)
-    db.session.commit()
+    set_task_progress(task, f'Files downloaded({files_len}) with {len(errors_list)} fails', status_code=4)
     app_context.pop()
 
 
@@ -546,14 +1203,13 @@ if Config.USE_CELERY:
 
     @celery.task
     def resume_yt_files_downloading_async(playlist: list, task_id=None, dir=None, quality=192, repair_tags=False,
-                                          first_part_index=0, part_size=None):
+                                          output_format='mp3'):
         return resume_yt_files_downloading_sync(playlist, task_id=task_id, dir=dir, quality=quality,
-                                                repair_tags=repair_tags, first_part_index=first_part_index,
-                                                part_size=part_size)
+                                                repair_tags=repair_tags, output_format=output_format)
 
 
 def resume_yt_files_downloading(playlist: list, task=None, dir=None, quality=192, repair_tags=False,
-                                first_part_index=0, part_size=None):
+                                output_format='mp3'):
     """Wrapper to the 'resume_yt_files_downloading_sync' function
        Depending on configuration can run 'download_yt_files_sync' directly in the 'main' thread,
        in child thread or as celery task
@@ -561,7 +1217,7 @@ def resume_yt_files_downloading(playlist: list, task=None, dir=None, quality=192
 
     :param task: task object which describe this process or None
     :type task: Task or None
-    :param playlist: list of youtube video ids represented as strings
+    :param playlist: list of youtube video ids represented as strings, which should be downloaded
     :type playlist: list
     :param dir: path to directory where should be downloaded file,
                 if not specified or None, using temp directory in where placed this .py file
@@ -570,26 +1226,23 @@ def resume_yt_files_downloading(playlist: list, task=None, dir=None, quality=192
     :type quality: int
     :param repair_tags: define use repair tags functions or not(see tasks/tags.py to more info)
     :type repair_tags: bool
-    :param first_part_index: last successfully downloaded part number
-    :type first_part_index: int
-    :param part_size: size of part archive(in files number)
-    :type part_size: int
+    :param output_format: "mp3" or "original"(see 'remux')
+    :type output_format: str
     """
     if current_app.config['DOWNLOAD_PATH']:
         dir = current_app.config['DOWNLOAD_PATH']
     if current_app.config['SYNC_DOWNLOADINGS']:
         resume_yt_files_downloading_sync(playlist, task_id=task.id, quality=quality, dir=dir, repair_tags=repair_tags,
-                                         first_part_index=0, part_size=part_size)
+                                         output_format=output_format)
     elif current_app.config['USE_CELERY']:
         resume_yt_files_downloading_async.apply_async(args=[playlist],
                                                       kwargs={'task_id': task.id, 'quality': quality, 'dir': dir,
                                                               'repair_tags': repair_tags,
-                                                              'first_part_index': first_part_index,
-                                                              'part_size': part_size},
+                                                              'output_format': output_format},
                                                       queue='downloading_tasks',
                                                       routing_key='download.playlist')
     else:
         Thread(target=resume_yt_files_downloading_sync,
                args=[playlist],
                kwargs={'task_id': task.id, 'quality': quality, 'dir': dir, 'repair_tags': repair_tags,
-                       'first_part_index': first_part_index, 'part_size': part_size}).start()
+                       'output_format': output_format}).start()
@@ -0,0 +1,125 @@
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from threading import Lock
+
+import requests
+import time
+import os
+
+
+class HttpClient:
+    """HTTP client used for all requests to external APIs
+
+    Connections are pooled and kept alive between requests, every request has connect and read timeouts,
+    failed connections and 429/5xx responses are retried with exponential backoff.
+    Latency and number of errors are counted for every host.
+    """
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10, retries=3, backoff_factor=0.3, pool_size=10):
+        """Create client instance
+
+        :param connect_timeout: max time(in seconds) for connection to be established
+        :type connect_timeout: float
+        :param read_timeout: max time(in seconds) between bytes received from server
+        :type read_timeout: float
+        :param retries: max number of retries of one request
+        :type retries: int
+        :param backoff_factor: retry number n waits backoff_factor * 2 ** (n - 1) seconds
+        :type backoff_factor: float
+        :param pool_size: max number of kept alive connections to one host
+        :type pool_size: int
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        retry_params = dict(total=retries, backoff_factor=backoff_factor, status_forcelist=self.retry_statuses,
+                            raise_on_status=False)
+        try:
+            retry = Retry(allowed_methods=frozenset(['GET', 'POST']), **retry_params)
+        except TypeError:
+            retry = Retry(method_whitelist=frozenset(['GET', 'POST']), **retry_params)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.hosts = dict()
+        self._lock = Lock()
+
+    def request(self, method, url, **kwargs):
+        """Send request, params are the same as in requests.request
+
+        :raises requests.exceptions.RequestException: when request is failed after all retries
+
+        :rtype: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except RequestException:
+            self._count(url, time.perf_counter() - start, True)
+            raise
+        self._count(url, time.perf_counter() - start, r.status_code >= 400)
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _count(self, url, latency, failed):
+        """Write request to the host stats"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            stats = self.hosts.setdefault(host, {'requests': 0, 'errors': 0, 'time': 0.0})
+            stats['requests'] += 1
+            stats['time'] += latency
+            if failed:
+                stats['errors'] += 1
+
+    def stats(self):
+        """Get request counters
+
+        :returns: dict where host is assigned to dict with number of requests, errors and average latency
+        :rtype: dict
+        """
+        with self._lock:
+            return {host: {'requests': stats['requests'],
+                           'errors': stats['errors'],
+                           'avg_latency': round(stats['time'] / stats['requests'], 3)}
+                    for host, stats in self.hosts.items()}
+
+
+_clients = dict()
+_clients_lock = Lock()
+
+
+def get_http_client():
+    """Get http client of current process configured by HTTP_* settings
+       Connections can not be shared between forked processes(celery workers), so every process has its own client
+
+    :rtype: HttpClient
+    """
+    pid = os.getpid()
+    with _clients_lock:
+        if pid not in _clients:
+            _clients.clear()
+            _clients[pid] = HttpClient(connect_timeout=current_app.config['HTTP_CONNECT_TIMEOUT'],
+                                       read_timeout=current_app.config['HTTP_READ_TIMEOUT'],
+                                       retries=current_app.config['HTTP_RETRIES'],
+                                       backoff_factor=current_app.config['HTTP_BACKOFF_FACTOR'])
+    return _clients[pid]
+
+
+def get(url, **kwargs):
+    """Send GET request through the http client of current process"""
+    return get_http_client().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """Send POST request through the http client of current process"""
+    return get_http_client().post(url, **kwargs)
@@ -1,5 +1,7 @@
 from flask import current_app
-from requests import get
+from app.tasks.http_client import get
+from app.tasks.metadata_cache import cached_metadata
+from app.tasks.ydl_pool import get_ydl_pool
 
 import youtube_dl
 
@@ -8,6 +10,28 @@ class BadUrlError(Exception):
     pass
 
 
+def get_yt_video_id(url: str):
+    """Get video id from youtube video url
+
+    :returns: video id or None if url does not lead to youtube video
+    :rtype: str or None
+    """
+    if url.startswith('https://www.youtube.com/watch?v='):
+        return url[32:43]
+    elif url.startswith('https://youtu.be/'):
+        return url[17:28]
+    return None
+
+
+def get_error_message(r):
+    """Get error message of youtube API response, reason of status code is used if body is not API error"""
+    try:
+        return r.json()['error']['message']
+    except (ValueError, KeyError, TypeError):
+        return r.reason
+
+
+@cached_metadata('yt_info', lambda url: get_yt_video_id(url) or url, errors=(BadUrlError,))
 def get_yt_file_info(url: str):
     """Request info about youtube video, using google API key specified in config
 
@@ -23,38 +47,86 @@ def get_yt_file_info(url: str):
     :rtype: dict
     """
 
-    if url.startswith('https://www.youtube.com/watch?v='):
-        vid = url[32:43]
-    elif url.startswith('https://youtu.be/'):
-        vid = url[17:28]
-    else:
+    vid = get_yt_video_id(url)
+    if vid is None:
         raise BadUrlError('Url do not belong domain yputube.com or does not lead to video.')
 
     r = get(f'https://www.googleapis.com/youtube/v3/videos?part=contentDetails'
             f'&key={current_app.config["YOUTUBE_API_KEY"]}'
             f'&id={vid}')
 
-    if r.status_code == 200 and r.json()['kind'] and r.json()['items']:
-        try:
-            kind = r.json()['kind']
-            items = r.json()['items']
-            if kind != 'youtube#videoListResponse':
-                raise BadUrlError('No information about this video.')
-            if len(items) == 0:
-                raise BadUrlError('No information about this video.')
-        except KeyError:
+    if r.status_code == 400:
+        raise ConnectionError('Bad request, please check your API key.')
+    elif r.status_code != 200:
+        raise ConnectionError(f'{r.status_code} - {get_error_message(r)}')
+
+    data = r.json()
+    try:
+        if data['kind'] != 'youtube#videoListResponse' or not data['items']:
             raise BadUrlError('No information about this video.')
-        return {"resource": "yt", "API_response": r.json()}
-    elif r.status_code == 200:
+    except KeyError:
         raise BadUrlError('No information about this video.')
-    elif r.status_code == 400:
-        raise ConnectionError('Bad request, please check your API key.')
-    else:
-        raise ConnectionError(f'{r.status_code} - {r.json()["error"]["message"]}')
+    return {"resource": "yt", "API_response": data}
+
+
+def get_yt_files_info(ids: list):
+    """Request info(content details and snippet) about couple of youtube videos, using google API key
+       specified in config, one request is made for every 50 videos
+
+
+    :param ids: list of youtube video ids
+    :type ids: list
+
+    :raises ConnectionError: when status code not 200
+
+    :returns: dict where video id is assigned to info in the same format as 'get_yt_file_info' returns,
+              videos without information are not included
+    :rtype: dict
+    """
+    result = dict()
+    unique_ids = list(dict.fromkeys(ids))
+    for i in range(0, len(unique_ids), 50):
+        r = get(f'https://www.googleapis.com/youtube/v3/videos?part=contentDetails%2Csnippet'
+                f'&maxResults=50'
+                f'&key={current_app.config["YOUTUBE_API_KEY"]}'
+                f'&id={",".join(unique_ids[i:i + 50])}')
+        if r.status_code == 200:
+            data = r.json()
+            for item in data.get('items', []):
+                response = {'kind': data['kind'], 'items': [item]}
+                result[item['id']] = {"resource": "yt", "API_response": response}
+        elif r.status_code == 400:
+            raise ConnectionError('Bad request, please check your API key.')
+        else:
+            raise ConnectionError(f'{r.status_code} - {get_error_message(r)}')
+    return result
+
+
+def extract_sc_info(url: str, flat=False):
+    """Extract info about soundcloud file or set using youtube-dl API
+
+
+    :param url: URL to soundcloud file or set
+    :type url: str
+    :param flat: if True, entries of set are not resolved(only their urls are received)
+    :type flat: bool
+
+    :raises BadUrlError: when there is no information on request
+
+    :returns: youtube-dl info dict, which can be passed to 'download'
+    :rtype: dict
+    """
+    try:
+        with get_ydl_pool().borrow('extract_flat' if flat else 'extract') as ydl:
+            return ydl.extract_info(url, download=False)
+    except youtube_dl.DownloadError:
+        raise BadUrlError('Audio not found.')
 
 
 def get_sc_file_info(url: str):
-    """Request info about soundcloud file, using soundcloud module with API key specified in config
+    """Request info about soundcloud file, using youtube-dl API
+       File is extracted only once, so its info can be reused for tags and downloading,
+       for sets only the first entry is resolved
 
 
     :param url: URL to soundcloud file
@@ -63,8 +135,9 @@ def get_sc_file_info(url: str):
     :raises BadUrlError: when there is no information on request
 
     :returns: dict with value "sc" assigned to key "resource"
-              0 or 1 assigned to key "type" (0 - single file, 1 - playlist item)
-              and url assigned to key "url"
+              0 or 1 assigned to key "type" (0 - single file, 1 - playlist item),
+              url assigned to key "url", youtube-dl info dict assigned to key "info"
+              and duration(of the first entry for sets) assigned to key "duration"
     :rtype: dict
     """
 
@@ -72,15 +145,15 @@ def get_sc_file_info(url: str):
         url_splitted = url[8:].split("/")
         url_length = len(url_splitted)
         if url_length == 3 and url_splitted[2] != 'sets':
-            r = get(url)
-            if r.status_code == 404:
-                raise BadUrlError('Audio not found.')
-            res = {'type': 0, 'url': url}
+            info = extract_sc_info(url)
+            res = {'type': 0, 'url': url, 'info': info, 'duration': info.get('duration')}
         elif url_length == 4 and url_splitted[2] == 'sets':
-            r = get(url)
-            if r.status_code == 404:
+            info = extract_sc_info(url, flat=True)
+            entries = list(info.get('entries') or [])
+            if not entries:
                 raise BadUrlError('Audio not found.')
-            res = {'type': 1, 'url': url}
+            first_entry = extract_sc_info(entries[0]['url'])
+            res = {'type': 1, 'url': url, 'info': info, 'duration': first_entry.get('duration')}
         else:
             raise BadUrlError('Url does not lead to audio.')
     else:
@@ -252,27 +325,11 @@ def is_allowed_duration(info: dict):
             raise BadUrlError(f"Info is not processed:{info}\nReason:{err}")
 
     elif info['resource'] == "sc":
+        if info.get('duration') is not None:
+            return info['duration'] <= current_app.config["ALLOWED_DURATION"] * 60
         try:
-            class Logger:
-                def debug(self, msg):
-                    pass
-
-                def info(self, msg):
-                    pass
-
-                @staticmethod
-                def error(msg):
-                    print(msg)
-
-            ydl_opts = {'logger': Logger()}
-
             if info['type'] == 0:
-                with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-
-                    meta = ydl.extract_info(
-                        info['url'],
-                        download=False)
-                    duration = meta['duration']
+                duration = extract_sc_info(info['url'])['duration']
 
                 if duration <= current_app.config["ALLOWED_DURATION"] * 60:
                     return True
@@ -280,12 +337,8 @@ def is_allowed_duration(info: dict):
                     return False
 
             elif info['type'] == 1:
-                with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-
-                    meta = ydl.extract_info(
-                        info['url'],
-                        download=False)
-                    duration = meta["entries"][0]["duration"]
+                meta = extract_sc_info(info['url'], flat=True)
+                duration = extract_sc_info(meta["entries"][0]["url"])["duration"]
 
                 if duration <= current_app.config["ALLOWED_DURATION"] * 60:
                     return True
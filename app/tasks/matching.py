@@ -0,0 +1,119 @@
+from difflib import SequenceMatcher
+
+import re
+
+_not_word_chars = re.compile(r'[^\w\s]+')
+_iso_duration = re.compile(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$')
+
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.3
+DURATION_WEIGHT = 0.15
+ALBUM_WEIGHT = 0.05
+DURATION_TOLERANCE = 30
+
+
+class Candidate:
+    """Track found by search in external API"""
+    def __init__(self, title, artist, duration=None, album_type=None, data=None):
+        """Create candidate
+
+        :param title: track title
+        :type title: str
+        :param artist: artist name
+        :type artist: str
+        :param duration: track duration in seconds
+        :type duration: float or None
+        :param album_type: "album", "single" or "compilation"
+        :type album_type: str or None
+        :param data: original search result
+        :type data: dict
+        """
+        self.title = title
+        self.artist = artist
+        self.duration = duration
+        self.album_type = album_type
+        self.data = data
+
+
+def simplify(s: str):
+    """Get lowercase string without punctuation and extra spaces"""
+    return ' '.join(_not_word_chars.sub(' ', s.lower()).split())
+
+
+def similarity(expected: str, found: str):
+    """Get similarity of two strings from 0 to 1, string which contains expected one is fully similar"""
+    expected = simplify(expected)
+    found = simplify(found)
+    if not expected or not found:
+        return 0.0
+    if expected in found:
+        return 1.0
+    return SequenceMatcher(None, expected, found).ratio()
+
+
+def score_candidate(candidate: Candidate, title: str, artist: str, duration=None):
+    """Get score of candidate from 0 to 1
+
+    Score consists of title similarity, artist similarity, duration closeness(full score when difference
+    is 0 seconds, no score when difference is DURATION_TOLERANCE seconds or more, half score when duration
+    is unknown) and album type(tracks from albums are preferred)
+
+    :param candidate: found track
+    :type candidate: Candidate
+    :param title: expected title
+    :type title: str
+    :param artist: expected artist
+    :type artist: str
+    :param duration: expected duration in seconds
+    :type duration: float or None
+
+    :rtype: float
+    """
+    score = TITLE_WEIGHT * similarity(title, candidate.title) + ARTIST_WEIGHT * similarity(artist, candidate.artist)
+    if duration and candidate.duration:
+        score += DURATION_WEIGHT * max(0.0, 1 - abs(duration - candidate.duration) / DURATION_TOLERANCE)
+    else:
+        score += DURATION_WEIGHT / 2
+    if candidate.album_type == 'album':
+        score += ALBUM_WEIGHT
+    return score
+
+
+def pick_best_candidate(candidates: list, title: str, artist: str, duration=None, threshold=0.6):
+    """Get candidate with the highest score
+
+    :param candidates: list of Candidate objects
+    :type candidates: list
+    :param title: expected title
+    :type title: str
+    :param artist: expected artist
+    :type artist: str
+    :param duration: expected duration in seconds
+    :type duration: float or None
+    :param threshold: min score of candidate to be picked
+    :type threshold: float
+
+    :returns: candidate or None if there is no candidate with enough score
+    :rtype: Candidate or None
+    """
+    best = None
+    best_score = threshold
+    for candidate in candidates:
+        score = score_candidate(candidate, title, artist, duration)
+        if score >= best_score and (best is None or score > best_score):
+            best = candidate
+            best_score = score
+    return best
+
+
+def parse_iso_duration(duration: str):
+    """Get number of seconds from ISO 8601 duration used by youtube API(for example PT4M13S)
+
+    :returns: number of seconds or None if duration is not parsed
+    :rtype: int or None
+    """
+    match = _iso_duration.match(duration or '')
+    if not match:
+        return None
+    days, hours, minutes, seconds = (int(value or 0) for value in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
@@ -0,0 +1,160 @@
+from flask import current_app
+from functools import wraps
+from threading import Lock
+from threading import local
+
+import sqlite3
+import json
+import time
+import os
+
+
+class MetadataCache:
+    """SQLite cache of metadata received from external APIs(video info, tags)
+
+    Values are stored as json together with expiration time, so database file can be shared between processes.
+    Exceptions can be stored as well(negative caching), in this case class name and message of exception are kept.
+    """
+    cleaning_interval = 100
+
+    def __init__(self, path):
+        """Create cache instance
+
+        :param path: path to database file
+        :type path: str
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self._local = local()
+        self._lock = Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS metadata '
+                               '(key TEXT PRIMARY KEY, value TEXT, error TEXT, expires_at REAL)')
+
+    def connect(self):
+        """Get connection of current thread, connections are not shared between threads and processes"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        """Get cached value
+
+        :param key: cache key
+        :type key: str
+
+        :returns: tuple of value and tuple of exception class name and message(or None),
+                  or None if there is no such entry or it is expired
+        :rtype: tuple or None
+        """
+        row = self.connect().execute('SELECT value, error FROM metadata WHERE key = ? AND expires_at > ?',
+                                     (key, time.time())).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0]), json.loads(row[1]) if row[1] else None
+
+    def put(self, key, value, ttl, error=None):
+        """Store value or exception
+
+        :param key: cache key
+        :type key: str
+        :param value: json serializable value
+        :param ttl: entry time to live in seconds
+        :type ttl: int
+        :param error: exception to be stored instead of value
+        :type error: Exception or None
+        """
+        error = json.dumps([type(error).__name__, str(error)]) if error else None
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+                               (key, json.dumps(value), error, time.time() + ttl))
+            with self._lock:
+                self.puts += 1
+                clean = self.puts % self.cleaning_interval == 0
+            if clean:
+                connection.execute('DELETE FROM metadata WHERE expires_at <= ?', (time.time(),))
+
+    def stats(self):
+        """Get cache counters
+
+        :returns: dict with number of hits and misses
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_metadata_cache = None
+_metadata_cache_lock = Lock()
+
+
+def get_metadata_cache():
+    """Get process wide metadata cache configured by METADATA_CACHE_PATH
+
+    :returns: cache object or None if USE_METADATA_CACHE is disabled
+    :rtype: MetadataCache or None
+    """
+    global _metadata_cache
+    if not current_app.config['USE_METADATA_CACHE']:
+        return None
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache(current_app.config['METADATA_CACHE_PATH'])
+    return _metadata_cache
+
+
+def normalize(s: str):
+    """Get string which is equal for differently formatted names of the same artist or track"""
+    return ' '.join(s.lower().split())
+
+
+def cached_metadata(namespace, make_key, errors=()):
+    """Decorator which caches function results for METADATA_CACHE_TTL seconds
+       and listed exceptions for METADATA_CACHE_ERROR_TTL seconds, None results are not cached
+
+
+    :param namespace: prefix of the keys
+    :type namespace: str
+    :param make_key: function which receives arguments of decorated function and returns key string
+    :type make_key: callable
+    :param errors: tuple of exception classes to be cached, they must be constructable from message
+    :type errors: tuple
+
+    :returns: decorator
+    """
+    error_classes = {error.__name__: error for error in errors}
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_metadata_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+            key = f'{namespace}:{make_key(*args, **kwargs)}'
+            entry = cache.get(key)
+            if entry is not None:
+                value, error = entry
+                if error:
+                    raise error_classes[error[0]](error[1])
+                return value
+            try:
+                value = func(*args, **kwargs)
+            except errors as err:
+                if type(err).__name__ in error_classes:
+                    cache.put(key, None, current_app.config['METADATA_CACHE_ERROR_TTL'], error=err)
+                raise
+            if value is not None:
+                cache.put(key, value, current_app.config['METADATA_CACHE_TTL'])
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,165 @@
+from threading import Thread
+from threading import Lock
+
+import queue
+import time
+
+
+class Stage:
+    """Pool of worker threads which apply one function to the items of the pipeline"""
+    def __init__(self, name, func, workers=1):
+        """Create stage instance
+
+        :param name: stage name, used in stats
+        :type name: str
+        :param func: function which receives result of previous stage(or pipeline item) and returns new one
+        :type func: callable
+        :param workers: number of worker threads
+        :type workers: int
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self._running = 0
+        self._lock = Lock()
+
+    def add_time(self, busy_time, failed=False):
+        """Write processed item to the stage stats"""
+        with self._lock:
+            self.busy_time += busy_time
+            self.processed += 1
+            if failed:
+                self.failed += 1
+
+
+class Pipeline:
+    """Chain of stages connected by bounded queues
+
+    Every item passes all stages in specified order, items are processed by all stages at the same time,
+    so network bound and cpu bound stages can overlap. If stage raises exception, item skips the next stages
+    and exception is returned together with item result.
+    """
+    def __init__(self, stages: list, queue_size=0, app=None):
+        """Create pipeline instance
+
+        :param stages: list of Stage objects
+        :type stages: list
+        :param queue_size: max number of items waiting between two stages, 0 means unbounded queue
+        :type queue_size: int
+        :param app: flask application object, if passed its context will be pushed in every worker thread
+        :type app: Flask
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.app = app
+        self.queues = []
+        self.queue_peaks = []
+        self.started_at = None
+        self.finished_at = None
+        self._lock = Lock()
+
+    def run(self, items: list):
+        """Start all stages and yield results in the order of items
+
+        :param items: list of items to be processed
+        :type items: list
+
+        :returns: generator of tuples (result, exception or None)
+        """
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.queues = [queue.Queue()] + [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self.queue_peaks = [0 for _ in self.queues]
+
+        for index, item in enumerate(items):
+            self.queues[0].put((index, item, None))
+        self.queue_peaks[0] = len(items)
+        for _ in range(self.stages[0].workers):
+            self.queues[0].put(None)
+
+        threads = list()
+        for n, stage in enumerate(self.stages):
+            stage._running = stage.workers
+            for _ in range(stage.workers):
+                thread = Thread(target=self._work, args=(n,), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        if not items:
+            self._finish(threads)
+        pending = dict()
+        for index in range(len(items)):
+            while index not in pending:
+                i, result, err = self.queues[-1].get()
+                pending[i] = (result, err)
+            if index == len(items) - 1:
+                self._finish(threads)
+            yield pending.pop(index)
+
+    def _finish(self, threads):
+        """Wait for all worker threads to stop"""
+        for thread in threads:
+            thread.join()
+        self.finished_at = time.perf_counter()
+
+    def _work(self, n):
+        """Worker thread loop of the stage with index n"""
+        if self.app:
+            with self.app.app_context():
+                self._process(n)
+        else:
+            self._process(n)
+
+    def _process(self, n):
+        stage = self.stages[n]
+        input_queue = self.queues[n]
+        output_queue = self.queues[n + 1]
+        while True:
+            record = input_queue.get()
+            if record is None:
+                with stage._lock:
+                    stage._running -= 1
+                    last = stage._running == 0
+                if last and n + 1 < len(self.stages):
+                    for _ in range(self.stages[n + 1].workers):
+                        output_queue.put(None)
+                return
+
+            index, item, err = record
+            if err is None:
+                start = time.perf_counter()
+                try:
+                    item = stage.func(item)
+                except Exception as exc:
+                    err = exc
+                stage.add_time(time.perf_counter() - start, failed=err is not None)
+            output_queue.put((index, item, err))
+            with self._lock:
+                self.queue_peaks[n + 1] = max(self.queue_peaks[n + 1], output_queue.qsize())
+
+    def stats(self):
+        """Get current queues depth and stages busy time
+
+        utilization is a part of time in which stage workers were busy(1.0 means all workers were busy all the time)
+
+        :returns: dict with stats of stages and queues
+        :rtype: dict
+        """
+        end = self.finished_at or time.perf_counter()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        stages = dict()
+        for stage in self.stages:
+            stages[stage.name] = {'workers': stage.workers,
+                                  'processed': stage.processed,
+                                  'failed': stage.failed,
+                                  'busy_time': round(stage.busy_time, 3),
+                                  'utilization': round(stage.busy_time / (stage.workers * elapsed), 3)
+                                  if elapsed else 0.0}
+        queues = dict()
+        for n, q in enumerate(self.queues):
+            name = self.stages[n].name if n < len(self.stages) else 'output'
+            queues[name] = {'depth': q.qsize(), 'peak': self.queue_peaks[n]}
+        return {'elapsed': round(elapsed, 3), 'stages': stages, 'queues': queues}
@@ -0,0 +1,405 @@
+from app import db
+from flask import current_app
+from sqlalchemy.exc import InvalidRequestError
+from threading import Lock
+from threading import Thread
+from queue import Queue
+from queue import Empty
+
+import json
+import time
+import os
+
+# status codes after which task progress is not changed
+FINAL_STATUS_CODES = (1, 2, 4)
+
+
+class Subscription:
+    """Queue of progress messages of one task received by one subscriber"""
+    def __init__(self, channel, task_id):
+        self.channel = channel
+        self.task_id = task_id
+        self.queue = Queue()
+
+    def get(self, timeout=None):
+        """Wait for the next message
+
+        :param timeout: max time of waiting in seconds
+        :type timeout: float or None
+
+        :returns: dict with changed progress fields or None if there is no message during timeout
+        :rtype: dict or None
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.channel.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ProgressChannel:
+    """Publish/subscribe channel of task progress messages inside the process
+
+    Every subscriber costs only a queue, so a lot of idle subscribers(for example progress streams of clients)
+    can wait for messages without polling.
+    """
+    def __init__(self):
+        self._subscriptions = dict()
+        self._lock = Lock()
+
+    def subscribe(self, task_id):
+        """Subscribe on progress messages of task
+
+        :param task_id: task id
+        :type task_id: int
+
+        :rtype: Subscription
+        """
+        subscription = Subscription(self, task_id)
+        with self._lock:
+            self._subscriptions.setdefault(task_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.task_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.task_id, None)
+
+    def publish(self, task_id, message: dict):
+        """Send message to all subscribers of task
+
+        :param task_id: task id
+        :type task_id: int
+        :param message: dict with changed progress fields
+        :type message: dict
+        """
+        self.dispatch(task_id, message)
+
+    def dispatch(self, task_id, message: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(task_id, ()))
+        for subscription in subscriptions:
+            subscription.queue.put(message)
+
+    def subscribers(self):
+        """Get number of subscribers of all tasks"""
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class RedisProgressChannel(ProgressChannel):
+    """Progress channel shared between processes through redis pub/sub
+
+    Messages are published to redis, every process has one listener thread which receives messages
+    of all tasks and passes them to subscribers of the process.
+    """
+    prefix = 'dfy:progress:'
+
+    def __init__(self, redis_url):
+        """Create channel
+
+        :param redis_url: url of redis server
+        :type redis_url: str
+        """
+        import redis
+        super().__init__()
+        self.redis = redis.Redis.from_url(redis_url)
+        self._listener = None
+
+    def subscribe(self, task_id):
+        with self._lock:
+            if self._listener is None:
+                self._listener = Thread(target=self.listen, daemon=True)
+                self._listener.start()
+        return super().subscribe(task_id)
+
+    def publish(self, task_id, message: dict):
+        from redis.exceptions import RedisError
+        try:
+            self.redis.publish(f'{self.prefix}{task_id}', json.dumps(message))
+        except RedisError as err:
+            print(f'Failed to publish progress of task {task_id}: {err}')
+
+    def listen(self):
+        """Pass messages from redis to subscribers of the process(runs in listener thread), reconnects on errors"""
+        from redis.exceptions import RedisError
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(f'{self.prefix}*')
+                for item in pubsub.listen():
+                    channel = item['channel'].decode()
+                    self.dispatch(int(channel[len(self.prefix):]), json.loads(item['data']))
+            except RedisError as err:
+                print(f'Progress listener is disconnected: {err}')
+                time.sleep(1)
+
+
+class ProgressStore:
+    """Progress of running tasks kept in memory of the process
+
+    Progress is a dict with 'Status_code', 'Progress' and structured fields('Stage', 'Downloaded_bytes',
+    'Total_bytes', 'Speed', 'Eta', 'Current_item', 'Items'), it is changed much more often than Task object
+    is written to database.
+    """
+    def __init__(self):
+        self._progress = dict()
+        self._lock = Lock()
+
+    def update(self, task_id, fields: dict):
+        """Change fields of task progress
+
+        :param task_id: task id
+        :type task_id: int
+        :param fields: changed fields
+        :type fields: dict
+        """
+        with self._lock:
+            self._progress.setdefault(task_id, dict()).update(fields)
+
+    def get(self, task_id):
+        """Get progress of task
+
+        :returns: dict with progress fields(empty if task is not in store)
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._progress.get(task_id, ()))
+
+    def delete(self, task_id):
+        with self._lock:
+            self._progress.pop(task_id, None)
+
+
+class RedisProgressStore(ProgressStore):
+    """Progress of running tasks kept in redis hashes, so it is shared between processes"""
+    prefix = 'dfy:progress_state:'
+
+    def __init__(self, redis_url, ttl):
+        """Create store
+
+        :param redis_url: url of redis server
+        :type redis_url: str
+        :param ttl: time in seconds after which progress of task which is not updated is deleted
+        :type ttl: int
+        """
+        import redis
+        super().__init__()
+        self.redis = redis.Redis.from_url(redis_url)
+        self.ttl = ttl
+
+    def update(self, task_id, fields: dict):
+        from redis.exceptions import RedisError
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.hset(f'{self.prefix}{task_id}', mapping={key: json.dumps(value) for key, value in fields.items()})
+            pipeline.expire(f'{self.prefix}{task_id}', self.ttl)
+            pipeline.execute()
+        except RedisError as err:
+            print(f'Failed to store progress of task {task_id}: {err}')
+
+    def get(self, task_id):
+        from redis.exceptions import RedisError
+        try:
+            progress = self.redis.hgetall(f'{self.prefix}{task_id}')
+        except RedisError as err:
+            print(f'Failed to get progress of task {task_id}: {err}')
+            return dict()
+        return {key.decode(): json.loads(value) for key, value in progress.items()}
+
+    def delete(self, task_id):
+        from redis.exceptions import RedisError
+        try:
+            self.redis.delete(f'{self.prefix}{task_id}')
+        except RedisError as err:
+            print(f'Failed to delete progress of task {task_id}: {err}')
+
+
+_channels = dict()
+_stores = dict()
+_channels_lock = Lock()
+# time of the last database write of task progress by task id(tasks are written by one process)
+_written = dict()
+
+
+def get_progress_channel():
+    """Get progress channel of current process, if celery is used messages are sent through its redis broker
+
+    :rtype: ProgressChannel
+    """
+    pid = os.getpid()
+    with _channels_lock:
+        if pid not in _channels:
+            _channels.clear()
+            if current_app.config['USE_CELERY']:
+                from celery_config import CeleryConfig
+                _channels[pid] = RedisProgressChannel(CeleryConfig.broker_url)
+            else:
+                _channels[pid] = ProgressChannel()
+    return _channels[pid]
+
+
+def get_progress_store():
+    """Get progress store of current process, if celery is used progress is kept in its redis broker
+
+    :rtype: ProgressStore
+    """
+    pid = os.getpid()
+    with _channels_lock:
+        if pid not in _stores:
+            _stores.clear()
+            if current_app.config['USE_CELERY']:
+                from celery_config import CeleryConfig
+                _stores[pid] = RedisProgressStore(CeleryConfig.broker_url, current_app.config['PROGRESS_STORE_TTL'])
+            else:
+                _stores[pid] = ProgressStore()
+    return _stores[pid]
+
+
+def publish_task_progress(task, **fields):
+    """Publish status code and progress of task and additional fields and keep them in progress store,
+       progress of finished task is deleted from store(it is kept in database)
+
+    :param task: task object
+    :type task: Task
+    """
+    message = dict(fields, Status_code=task.status_code, Progress=task.progress)
+    if task.status_code in FINAL_STATUS_CODES:
+        get_progress_store().delete(task.id)
+        _written.pop(task.id, None)
+    else:
+        get_progress_store().update(task.id, message)
+    get_progress_channel().publish(task.id, message)
+
+
+def set_task_progress(task, progress, status_code=None, **fields):
+    """Change progress of task, Task object is written to database only when status code is changed
+       or if it was not written for PROGRESS_DB_INTERVAL seconds, pages receive progress from progress store.
+       Other changes of session(for example new FileInfo of finished task) are written together with status change
+
+    :param task: task object
+    :type task: Task
+    :param progress: progress string
+    :type progress: str
+    :param status_code: new status code of task(None to keep current one)
+    :type status_code: int or None
+    :param fields: structured progress fields('Stage', 'Downloaded_bytes', 'Total_bytes', 'Speed', 'Eta',
+                   'Current_item', 'Items')
+    """
+    transition = status_code is not None and status_code != task.status_code
+    task.progress = progress
+    if status_code is not None:
+        task.status_code = status_code
+    if not transition:
+        publish_task_progress(task, **fields)
+    now = time.monotonic()
+    if transition or now - _written.get(task.id, 0) >= current_app.config['PROGRESS_DB_INTERVAL']:
+        try:
+            db.session.add(task)
+            db.session.commit()
+            if status_code not in FINAL_STATUS_CODES:
+                _written[task.id] = now
+        except InvalidRequestError as err:
+            # progress is in store anyway, so it is written next time
+            db.session.rollback()
+            print(f'Failed to write progress of task {task.id}: {err}')
+    if transition:
+        # status change is published after it is written, so pages reacting to it read the changed task
+        publish_task_progress(task, **fields)
+
+
+def get_task_progress(task):
+    """Get progress of task from progress store, task status and progress are used if task is not in store
+
+    :param task: task object
+    :type task: Task
+
+    :returns: dict with 'Status_code', 'Progress' and structured progress fields
+    :rtype: dict
+    """
+    progress = get_progress_store().get(task.id)
+    # status code is written to database on every change, so progress of other status is out of date
+    if progress.get('Status_code') != task.status_code:
+        return {'Status_code': task.status_code, 'Progress': task.progress}
+    return progress
+
+
+def format_event(data: dict):
+    """Format dict as server-sent event"""
+    return f'data: {json.dumps(data)}\n\n'
+
+
+def progress_events(subscription, state: dict, positions=None, keepalive=15, final_codes=FINAL_STATUS_CODES,
+                    refresh=None, max_duration=None, retry=None):
+    """Generate server-sent events of task progress
+
+    The first event contains the whole state, next events contain only changed fields. Messages with
+    'Item' and 'Item_status' fields change status code of the item in 'Status_codes' string. If there is no
+    message during keepalive interval state is read again by refresh(so messages published before subscription
+    or lost by channel are not missed) and its changes are sent, if nothing is changed comment is sent, so closed
+    connections are found. Generator is finished when task gets one of final status codes or after max_duration
+    (client reconnects and receives the whole state again) and subscription is closed with it.
+
+    :param subscription: subscription on task progress
+    :type subscription: Subscription or None
+    :param state: current progress of task('Status_code', 'Progress' and optional 'Status_codes')
+    :type state: dict
+    :param positions: positions of items in 'Status_codes' by item index
+    :type positions: dict or None
+    :param keepalive: max time in seconds between events
+    :type keepalive: float
+    :param final_codes: status codes after which task progress is not changed
+    :type final_codes: iterable
+    :param refresh: function returning current state of task
+    :type refresh: callable or None
+    :param max_duration: time in seconds after which generator is finished(None for unlimited)
+    :type max_duration: float or None
+    :param retry: time in milliseconds after which client reconnects when stream is finished(None for default)
+    :type retry: int or None
+
+    :rtype: generator
+    """
+    state = dict(state)
+    positions = positions or dict()
+    deadline = time.monotonic() + max_duration if max_duration is not None else None
+    try:
+        yield (f'retry: {retry}\n' if retry is not None else '') + format_event(state)
+        if subscription is None or state.get('Status_code') in final_codes:
+            return
+        while True:
+            timeout = keepalive
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return
+            message = subscription.get(timeout=timeout)
+            timed_out = message is None
+            if timed_out:
+                message = refresh() if refresh is not None else dict()
+            message = dict(message)
+            item, item_status = message.pop('Item', None), message.pop('Item_status', None)
+            if item in positions and state.get('Status_codes'):
+                codes = state['Status_codes']
+                position = positions[item]
+                message['Status_codes'] = codes[:position] + str(item_status) + codes[position + 1:]
+            delta = {key: value for key, value in message.items() if state.get(key) != value}
+            if delta:
+                state.update(delta)
+                yield format_event(delta)
+            elif timed_out:
+                yield ': keepalive\n\n'
+            if state.get('Status_code') in final_codes:
+                return
+    finally:
+        if subscription is not None:
+            subscription.close()
@@ -0,0 +1,111 @@
+from flask import current_app
+from threading import Lock
+from contextlib import contextmanager
+
+
+class Flight:
+    """Handle of acquired key"""
+    def __init__(self, key, acquired, redis_lock=None):
+        self.key = key
+        self.acquired = acquired
+        self.redis_lock = redis_lock
+
+
+class SingleFlight:
+    """Coalescing of concurrent jobs with the same key
+
+    Only one job with certain key can run at the same time, other jobs wait until it is done,
+    so they can take its result(for example from the file cache) instead of doing the same work.
+    Jobs are coalesced between threads of the process and, if redis url is passed, between processes.
+    Key can be released by other thread than acquired it, so job can be split between pipeline stages.
+    """
+    def __init__(self, redis_url=None, timeout=600):
+        """Create single flight instance
+
+        :param redis_url: url of redis server used for coalescing between processes
+        :type redis_url: str or None
+        :param timeout: max time(in seconds) for which key can be held and for which job waits for the key
+        :type timeout: int
+        """
+        self.timeout = timeout
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url)
+        self._locks = dict()
+        self._lock = Lock()
+
+    def acquire(self, key):
+        """Wait while other job with the same key is running and acquire the key
+
+        :param key: job key
+        :type key: str
+
+        :returns: flight object which should be passed to 'release'
+        :rtype: Flight
+        """
+        with self._lock:
+            entry = self._locks.setdefault(key, [Lock(), 0])
+            entry[1] += 1
+        acquired = entry[0].acquire(timeout=self.timeout)
+        redis_lock = None
+        if self.redis:
+            from redis.exceptions import RedisError
+            try:
+                redis_lock = self.redis.lock(f'dfy:flight:{key}', timeout=self.timeout,
+                                             blocking_timeout=self.timeout, thread_local=False)
+                if not redis_lock.acquire():
+                    redis_lock = None
+            except RedisError as err:
+                print(f'Failed to coalesce job {key} between processes: {err}')
+                redis_lock = None
+        return Flight(key, acquired, redis_lock)
+
+    def release(self, flight: Flight):
+        """Release the key, so next waiting job can run
+
+        :param flight: object returned by 'acquire'
+        :type flight: Flight
+        """
+        if flight.redis_lock:
+            from redis.exceptions import RedisError
+            try:
+                flight.redis_lock.release()
+            except RedisError:
+                pass
+        with self._lock:
+            entry = self._locks[flight.key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[flight.key]
+        if flight.acquired:
+            entry[0].release()
+
+    @contextmanager
+    def hold(self, key):
+        """Acquire the key for the time of with block"""
+        flight = self.acquire(key)
+        try:
+            yield flight
+        finally:
+            self.release(flight)
+
+
+_single_flight = None
+_single_flight_lock = Lock()
+
+
+def get_single_flight():
+    """Get process wide single flight object, if celery is used jobs are coalesced through its redis broker
+
+    :rtype: SingleFlight
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            redis_url = None
+            if current_app.config['USE_CELERY']:
+                from celery_config import CeleryConfig
+                redis_url = CeleryConfig.broker_url
+            _single_flight = SingleFlight(redis_url, timeout=current_app.config['SINGLE_FLIGHT_TIMEOUT'])
+    return _single_flight
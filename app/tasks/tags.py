@@ -1,65 +1,74 @@
-from requests import get
-from requests import post
+from app.tasks.http_client import get
+from app.tasks.http_client import post
+from app.tasks.metadata_cache import cached_metadata
+from app.tasks.metadata_cache import normalize
+from app.tasks.matching import Candidate
+from app.tasks.matching import pick_best_candidate
+from app.tasks.matching import parse_iso_duration
+from app.tasks.titles import normalize_title
+from app.tasks.titles import normalize_titles
+from app.tasks.info import extract_sc_info
 from flask import current_app
 from mutagen.id3 import ID3, TIT2, TALB, TPE1, APIC, TRCK, TDRC, ID3NoHeaderError
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
+from mutagen.flac import FLAC, Picture
+from requests.exceptions import RequestException
 from simplejson import JSONDecodeError
+from threading import Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import base64
+import re
 import time
+import os
 
 
-def get_yt_video_tags(id):
+def get_yt_video_tags(id, info=None):
     """Get channel title, video title and thumbnail of video using youtube API
 
     :param id: video id
     :type id: str
+    :param info: deserialized json answer from youtube API with snippet part(see 'get_yt_files_info'),
+                 if passed no request is made
+    :type info: dict or None
 
-    :returns: tuple which contain channel title, video title and link to thumbnail
+    :returns: tuple which contain channel title, video title, link to thumbnail and duration in seconds(or None)
     :rtype: tuple
     """
-    r = get(f'https://www.googleapis.com/youtube/v3/videos?part=snippet'
-            f'&key={current_app.config["YOUTUBE_API_KEY"]}'
-            f'&id={id}')
-    info = r.json()
+    if info is None:
+        r = get(f'https://www.googleapis.com/youtube/v3/videos?part=snippet%2CcontentDetails'
+                f'&key={current_app.config["YOUTUBE_API_KEY"]}'
+                f'&id={id}')
+        info = r.json()
     video_title = info['items'][0]['snippet']['title']
     channel_title = info['items'][0]['snippet']['channelTitle']
     thumbnail_url = info['items'][0]['snippet']['thumbnails']['default']['url']
-    return channel_title, video_title, thumbnail_url
+    duration = parse_iso_duration(info['items'][0].get('contentDetails', {}).get('duration'))
+    return channel_title, video_title, thumbnail_url, duration
 
 
-def get_sc_file_tags(url: str):
+def get_sc_file_tags(url: str, info=None):
     """Get channel uploader nickname, file title and thumbnail
 
     :param url: soundcloud file url
     :type url: str
+    :param info: youtube-dl info dict of the file(see 'get_sc_file_info'), if passed file is not extracted again
+    :type info: dict or None
 
-    :returns: tuple which contain uploader nickname, file title and link to thumbnail
+    :returns: tuple which contain uploader nickname, file title, link to thumbnail and duration in seconds(or None)
     :rtype: tuple
     """
-    class Logger:
-        def debug(self, msg):
-            pass
-
-        def info(self, msg):
-            pass
-
-        @staticmethod
-        def error(msg):
-            print(msg)
-
-    ydl_opts = {'logger': Logger()}
-
-    import youtube_dl
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-
-        meta = ydl.extract_info(
-            url,
-            download=False)
-    return meta['uploader'], meta['title'], meta['thumbnails'][0]['url']
+    meta = info or extract_sc_info(url)
+    return meta['uploader'], meta['title'], meta['thumbnails'][0]['url'], meta.get('duration')
 
 
 def get_repaired_audio_tags(channel_title, video_title):
-    """Get artist and song title using some split magic
+    """Get artist and song title using rules of 'normalize_title'(see tasks/titles.py),
+       noise tokens are specified by TITLE_NOISE_TOKENS
 
     :param channel_title: channel title(uploader nickname)
     :type channel_title: str
@@ -69,77 +78,99 @@ def get_repaired_audio_tags(channel_title, video_title):
     :returns: tuple with artist and song title
     :rtype: tuple
     """
-    def capitalize_all_words(s: str):
-        res = str()
-        for el in s.split(' '):
-            if el == ' ' or len(el) == 0:
-                continue
-            res += ' ' + el.capitalize()
-        return res[1:]
-
-    quote1_index = video_title.find('"')
-    quote2_index = video_title.find('"', quote1_index + 1)
-
-    if quote1_index > -1:
-        if quote2_index > 0:
-            video_title = video_title.replace('"', '')
-
-    i1 = video_title.find('(')
-    if i1 > -1 and (i1 < quote1_index - 1 or i1 > quote2_index - 2):
-        i2 = video_title.find(')')
-        if i2 > 0:
-            title = video_title[:i1]
-            title += video_title[i2 + 1:]
-            video_title = title
-
-    i1 = video_title.find('[')
-    if i1 > -1 and (i1 < quote1_index - 1 or i1 > quote2_index - 2):
-        i2 = video_title.find(']')
-        if i2 > 0:
-            title = video_title[:i1]
-            title += video_title[i2 + 1:]
-            video_title = title
-
-    # '-' and '–' are different symbols!
-    video_title = video_title.split('-')
-    if len(video_title) == 1:
-        video_title = video_title[0].split('–')
-        if len(video_title) == 1:
-            video_title = video_title[0].split(':')
-
-    if len(video_title) > 1:
-        artist = video_title[0].strip()
-        title = '-'.join(video_title[1:]).strip().strip(' -')
-    else:
-        artist = channel_title.replace('VEVO', '').replace(' - Topic', '').strip()
-        title = video_title[0].strip()
+    return normalize_title(channel_title, video_title, tuple(current_app.config['TITLE_NOISE_TOKENS']))
 
-    artist = capitalize_all_words(artist).replace('_', ' ').replace('-', ' ')
-    title = capitalize_all_words(title)
 
-    return artist, title
+def get_repaired_audio_tags_batch(titles: list):
+    """Get artists and song titles for couple of videos(for example for whole playlist)
 
+    :param titles: list of tuples with channel title and video title
+    :type titles: list
 
-def get_spotify_auth_token():
-    """Get spotify API authentication token using current config
+    :returns: list of tuples with artist and song title
+    :rtype: list
+    """
+    return normalize_titles(titles, tuple(current_app.config['TITLE_NOISE_TOKENS']))
 
-    :returns: token as string
-    :rtype: str
+
+def request_spotify_auth_token():
+    """Request new spotify API authentication token using current config
+
+    :returns: tuple which contain token and its lifetime in seconds
+    :rtype: tuple
+
+    :raises ReparationError: when token is not received
     """
     info = base64.b64encode(f"{current_app.config['SPOTIFY_UID']}:{current_app.config['SPOTIFY_SECRET']}".encode()).decode()
     r = post('https://accounts.spotify.com/api/token',
              headers={'Authorization': f'Basic {info}'},
              data={'grant_type': 'client_credentials'})
-    token = r.json()['access_token']
-    return token
+    data = r.json()
+    if 'access_token' not in data:
+        raise ReparationError(f"Spotify authentication is failed: {data.get('error', r.reason)}")
+    return data['access_token'], data.get('expires_in', 3600)
+
+
+class SpotifyTokenManager:
+    """Keeper of spotify API token, which reuses token until it is about to expire
+
+    Only one thread requests new token, other threads wait for it.
+    """
+    refresh_margin = 60
+
+    def __init__(self, request_token=request_spotify_auth_token):
+        """Create token manager
+
+        :param request_token: function which requests new token and returns tuple of token and its lifetime
+        :type request_token: callable
+        """
+        self.request_token = request_token
+        self.token = None
+        self.expires_at = 0
+        self.credentials = None
+        self._lock = Lock()
+
+    def get_token(self, credentials=None):
+        """Get valid token, new token is requested if current one expires in less than refresh_margin seconds
+           or credentials are changed
+
+        :param credentials: credentials used to request token
+        :type credentials: tuple or None
+
+        :returns: token as string
+        :rtype: str
+        """
+        with self._lock:
+            if self.token is None or credentials != self.credentials \
+                    or time.monotonic() >= self.expires_at - self.refresh_margin:
+                token, expires_in = self.request_token()
+                self.token = token
+                self.expires_at = time.monotonic() + expires_in
+                self.credentials = credentials
+            return self.token
+
+
+_spotify_token_manager = SpotifyTokenManager()
+
+
+def get_spotify_auth_token():
+    """Get spotify API authentication token using current config, token is requested once per its lifetime
+
+    :returns: token as string
+    :rtype: str
+    """
+    return _spotify_token_manager.get_token((current_app.config['SPOTIFY_UID'], current_app.config['SPOTIFY_SECRET']))
 
 
 class ReparationError(Exception):
     pass
 
 
-def get_repaired_tags_from_spotify(token, artist, title):
+@cached_metadata('spotify_track', lambda token, artist, title, duration=None:
+                 f'{normalize(artist)}|{normalize(title)}|{duration and round(duration)}', errors=(ReparationError,))
+def get_repaired_tags_from_spotify(token, artist, title, duration=None):
     """Get tags about audio from spotify
+       One search is made, the best of found tracks is chosen by 'pick_best_candidate'(see tasks/matching.py)
 
     :param token: API token
     :type token: str
@@ -147,6 +178,8 @@ def get_repaired_tags_from_spotify(token, artist, title):
     :type artist: str
     :param title: song title
     :type title: str
+    :param duration: audio duration in seconds
+    :type duration: float or None
 
     :raises ReparationError: when nothing was found
 
@@ -155,54 +188,30 @@ def get_repaired_tags_from_spotify(token, artist, title):
     """
     result = {}
     r = get(f'https://api.spotify.com/v1/search?q=artist%3A{artist.replace(" ", "%20")}'
-             f'%20track%3A{title.replace(" ", "%20")}'
-             f'&type=track'
-             f'&limit=1',
-             headers={'Accept': 'application/json',
-                      'Content-Type': 'application_json',
-                      'Authorization': f'Bearer {token}'})
+            f'%20track%3A{title.replace(" ", "%20")}'
+            f'&type=track'
+            f'&limit={current_app.config["TAGS_SEARCH_LIMIT"]}',
+            headers={'Accept': 'application/json',
+                     'Content-Type': 'application_json',
+                     'Authorization': f'Bearer {token}'})
     tags = r.json()
-    if tags['tracks']['items']:
-        if tags['tracks']['items'][0]['album']['album_type'] == 'album':
-            result['album'] = tags['tracks']['items'][0]['album']['name']
-            result['artist'] = tags['tracks']['items'][0]['album']['artists'][0]['name']
-            if title.lower() in tags['tracks']['items'][0]['name'].lower():
-                result['title'] = tags['tracks']['items'][0]['name']
-                result['image'] = tags['tracks']['items'][0]['album']['images'][0]['url']
-                result['release_date'] = tags['tracks']['items'][0]['album']['release_date']
-                result['number'] = tags['tracks']['items'][0]['track_number']
-            else:
-                r = get(f'https://api.spotify.com/v1/search?q=artist%3A{artist.replace(" ", "%20")}'
-                        f'%20track%3A{title.replace(" ", "%20")}'
-                        f'&type=track'
-                        f'&limit=50',
-                        headers={'Accept': 'application/json',
-                                 'Content-Type': 'application_json',
-                                 'Authorization': f'Bearer {token}'})
-                tags = r.json()
-                i = 0
-                res_len = len(tags['tracks']['items'])
-                for el in tags['tracks']['items']:
-                    if title.lower() in el['name'].lower():
-                        break
-                    else:
-                        if i == res_len - 1:
-                            raise ReparationError('Failed to find such track')
-                    i += 1
-                result['title'] = tags['tracks']['items'][i]['name']
-                result['image'] = tags['tracks']['items'][i]['album']['images'][0]['url']
-                result['release_date'] = tags['tracks']['items'][i]['album']['release_date']
-                result['number'] = tags['tracks']['items'][i]['track_number']
-        else:
-            result['artist'] = tags['tracks']['items'][0]['album']['artists'][0]['name']
-            result['title'] = tags['tracks']['items'][0]['name']
-            result['image'] = tags['tracks']['items'][0]['album']['images'][0]['url']
-            result['release_date'] = tags['tracks']['items'][0]['album']['release_date']
-    else:
+    candidates = [Candidate(el['name'], el['artists'][0]['name'], el['duration_ms'] / 1000,
+                            el['album']['album_type'], el) for el in tags['tracks']['items']]
+    best = pick_best_candidate(candidates, title, artist, duration, current_app.config['TAGS_MATCH_THRESHOLD'])
+    if best is None:
         raise ReparationError('Failed to find such track')
+    track = best.data
+    if track['album']['album_type'] == 'album':
+        result['album'] = track['album']['name']
+        result['number'] = track['track_number']
+    result['artist'] = track['album']['artists'][0]['name']
+    result['title'] = track['name']
+    result['image'] = get_spotify_image_url(track['album']['images'])
+    result['release_date'] = track['album']['release_date']
     return result
 
 
+@cached_metadata('spotify_artist', lambda token, artist: normalize(artist), errors=(ReparationError,))
 def get_artist_tags_from_spotify(token, artist):
     """Get tags about artist from spotify
 
@@ -226,149 +235,275 @@ def get_artist_tags_from_spotify(token, artist):
     tags = r.json()
     if tags['artists']['items']:
         result['artist'] = artist
-        result['image'] = tags['artists']['items'][0]['images'][0]['url']
+        result['image'] = get_spotify_image_url(tags['artists']['items'][0]['images'])
     else:
         raise ReparationError('Failed to find such track')
     return result
 
 
-def get_repaired_tags_from_itunes(artist, title):
-    """Get tags about artist from spotify
+@cached_metadata('itunes_track', lambda artist, title, duration=None:
+                 f'{normalize(artist)}|{normalize(title)}|{duration and round(duration)}', errors=(ReparationError,))
+def get_repaired_tags_from_itunes(artist, title, duration=None):
+    """Get tags about audio from itunes
+       One search is made, the best of found tracks is chosen by 'pick_best_candidate'(see tasks/matching.py)
 
     :param artist: artist name
     :type artist: str
     :param title: song title
     :type title: str
+    :param duration: audio duration in seconds
+    :type duration: float or None
 
     :raises ReparationError: when nothing was found
 
-    :returns: dict with tags
-    :rtype: dict
+    :returns: dict with tags or None if response is not received
+    :rtype: dict or None
     """
     result = {}
     r = get(f'https://itunes.apple.com/search?term={"+".join(artist.split(" "))}+{"+".join(title.split(" "))}'
             f'&media=music'
-            f'&limit=1')
+            f'&limit={current_app.config["TAGS_SEARCH_LIMIT"]}')
     try:
         tags = r.json()
     except JSONDecodeError:
-        time.sleep(2)
-        r = get(f'https://itunes.apple.com/search?term={"+".join(artist.split(" "))}+{"+".join(title.split(" "))}'
-                f'&media=music'
-                f'&limit=1')
-        try:
-            tags = r.json()
-        except JSONDecodeError:
-            return
-    if tags['resultCount']:
-        if tags['results'][0]['collectionName'].endswith('Single'):
-            result['artist'] = tags['results'][0]['artistName']
-            result['title'] = tags['results'][0]['trackName']
-            result['image'] = tags['results'][0]['artworkUrl100']
-            result['release_date'] = tags['results'][0]['releaseDate']
-        else:
-            result['album'] = tags['results'][0]['collectionName']
-            result['artist'] = tags['results'][0]['artistName']
-            if tags['results'][0]['trackName'].lower() == title.lower():
-                result['title'] = tags['results'][0]['trackName']
-                result['image'] = tags['results'][0]['artworkUrl100']
-                result['release_date'] = tags['results'][0]['releaseDate']
-                result['number'] = tags['results'][0]['trackNumber']
-            else:
-                r = get(
-                    f'https://itunes.apple.com/search?term={"+".join(artist.split(" "))}+{"+".join(title.split(" "))}'
-                    f'&media=music'
-                    f'&limit=50')
-                try:
-                    tags = r.json()
-                except JSONDecodeError:
-                    time.sleep(2)
-                    r = get(
-                        f'https://itunes.apple.com/search?term={"+".join(artist.split(" "))}+{"+".join(title.split(" "))}'
-                        f'&media=music'
-                        f'&limit=50')
-                    try:
-                        tags = r.json()
-                    except JSONDecodeError:
-                        return
-                i = 0
-                res_len = len(tags['results'])
-                for el in tags['results']:
-                    if title.lower() in el['trackName'].lower():
-                        break
-                    else:
-                        if i == res_len - 1:
-                            raise ReparationError('Failed to find such track')
-                    i += 1
-                result['title'] = tags['results'][i]['trackName']
-                result['image'] = tags['results'][i]['artworkUrl100']
-                result['release_date'] = tags['results'][i]['releaseDate']
-                result['number'] = tags['results'][i]['trackNumber']
-    else:
+        return
+    candidates = [Candidate(el['trackName'], el['artistName'], el.get('trackTimeMillis', 0) / 1000 or None,
+                            'single' if el['collectionName'].endswith('Single') else 'album', el)
+                  for el in tags['results'] if 'trackName' in el and 'collectionName' in el]
+    best = pick_best_candidate(candidates, title, artist, duration, current_app.config['TAGS_MATCH_THRESHOLD'])
+    if best is None:
         raise ReparationError('Failed to find such track')
+    track = best.data
+    if best.album_type == 'album':
+        result['album'] = track['collectionName']
+        result['number'] = track['trackNumber']
+    result['artist'] = track['artistName']
+    result['title'] = track['trackName']
+    result['image'] = get_itunes_image_url(track['artworkUrl100'])
+    result['release_date'] = track['releaseDate']
+    return result
+
+
+def get_lookup_executor():
+    """Get thread pool of current process for tags lookups with TAGS_LOOKUP_WORKERS threads
+       Threads can not be shared between forked processes(celery workers), so every process has its own pool
+
+    :rtype: ThreadPoolExecutor
+    """
+    pid = os.getpid()
+    with _lookup_executors_lock:
+        if pid not in _lookup_executors:
+            _lookup_executors.clear()
+            _lookup_executors[pid] = ThreadPoolExecutor(max_workers=current_app.config['TAGS_LOOKUP_WORKERS'])
+    return _lookup_executors[pid]
+
+
+_lookup_executors = dict()
+_lookup_executors_lock = Lock()
+
+
+def run_lookups(lookups: list, timeout: float):
+    """Run lookups concurrently and get result of the first(in list order) successful one
+       Lookup is failed if it raises ReparationError, request or json error or returns None, lookups which
+       are not finished in timeout seconds after start are considered failed as well, lookups which are not
+       needed anymore and are not started yet are cancelled(running ones are finished in background)
+
+
+    :param lookups: list of functions without arguments ordered by priority
+    :type lookups: list
+    :param timeout: max time(in seconds) for all lookups
+    :type timeout: float
+
+    :returns: result of lookup or None if all of lookups are failed
+    """
+    app = current_app._get_current_object()
+
+    def call(lookup):
+        with app.app_context():
+            return lookup()
+
+    executor = get_lookup_executor()
+    futures = [executor.submit(call, lookup) for lookup in lookups]
+    deadline = time.monotonic() + timeout
+    result = None
+    for future in futures:
+        try:
+            result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            continue
+        except ReparationError:
+            continue
+        except (RequestException, JSONDecodeError) as err:
+            print(f'Tags lookup is failed: {err}')
+            continue
+        if result is not None:
+            break
+    for future in futures:
+        future.cancel()
+    return result
+
+
+def get_repaired_tags(artist, title, image=None, duration=None):
+    """Get tags about audio from spotify and itunes
+       Spotify track search, itunes search and spotify artist search are run concurrently,
+       result of the first of them(in this order) is used, lookups are limited by TAGS_LOOKUP_TIMEOUT
+
+
+    :param artist: artist name
+    :type artist: str
+    :param title: song title
+    :type title: str
+    :param image: url of image to be used when nothing was found
+    :type image: str
+    :param duration: audio duration in seconds, used to choose between found tracks
+    :type duration: float or None
+
+    :returns: dict with tags
+    :rtype: dict
+    """
+    # token is received by spotify lookups, so itunes lookup is not blocked by failed authentication
+    def get_artist_tags():
+        result = get_artist_tags_from_spotify(get_spotify_auth_token(), artist)
+        result['title'] = title
+        return result
+
+    result = run_lookups([lambda: get_repaired_tags_from_spotify(get_spotify_auth_token(), artist, title, duration),
+                          lambda: get_repaired_tags_from_itunes(artist, title, duration),
+                          get_artist_tags],
+                         current_app.config['TAGS_LOOKUP_TIMEOUT'])
+    if result is None:
+        result = {'artist': artist, 'title': title, 'image': image}
     return result
 
 
-def get_repaired_tags_for_yt(id):
+def get_repaired_tags_for_yt(id, info=None):
     """Get tags related to youtube video using its id
 
     :param id: youtube video id
     :type id: str
+    :param info: deserialized json answer from youtube API with snippet part, if passed video is not requested
+    :type info: dict or None
 
     :returns: dict with tags
     :rtype: dict
     """
-    video_tags = get_yt_video_tags(id)
+    video_tags = get_yt_video_tags(id, info)
     primary_tags = get_repaired_audio_tags(video_tags[0], video_tags[1])
-    result = {}
-    token = get_spotify_auth_token()
-    try:
-        result = get_repaired_tags_from_spotify(token, primary_tags[0], primary_tags[1])
-    except ReparationError:
-        try:
-            result = get_repaired_tags_from_itunes(primary_tags[0], primary_tags[1])
-        except ReparationError:
-            try:
-                result = get_artist_tags_from_spotify(token, primary_tags[0])
-                result['title'] = primary_tags[1]
-            except ReparationError:
-                result['artist'] = primary_tags[0]
-                result['title'] = primary_tags[1]
-                result['image'] = video_tags[2]
-    return result
+    return get_repaired_tags(primary_tags[0], primary_tags[1], video_tags[2], video_tags[3])
 
 
-def get_repaired_tags_for_sc(url):
+def get_repaired_tags_for_sc(url, info=None):
     """Get tags related to soundcloud file using its url
 
     :param url: url that leads to file
     :type url: str
+    :param info: youtube-dl info dict of the file, if passed file is not extracted again
+    :type info: dict or None
 
     :returns: dict with tags
     :rtype: dict
     """
-    video_tags = get_sc_file_tags(url)
+    video_tags = get_sc_file_tags(url, info)
     primary_tags = get_repaired_audio_tags(video_tags[0], video_tags[1])
-    result = {}
-    token = get_spotify_auth_token()
-    try:
-        result = get_repaired_tags_from_spotify(token, primary_tags[0], primary_tags[1])
-    except ReparationError:
-        try:
-            result = get_repaired_tags_from_itunes(primary_tags[0], primary_tags[1])
-        except ReparationError:
-            try:
-                result = get_artist_tags_from_spotify(token, primary_tags[0])
-                result['title'] = primary_tags[1]
-            except ReparationError:
-                result['artist'] = primary_tags[0]
-                result['title'] = primary_tags[1]
-                result['image'] = video_tags[2]
-    return result
+    return get_repaired_tags(primary_tags[0], primary_tags[1], video_tags[2], video_tags[3])
+
+
+def get_spotify_image_url(images: list):
+    """Get url of the smallest image which is not smaller than COVER_SIZE(or the largest image)
+
+    :param images: list of spotify image objects(dicts with url, width and height)
+    :type images: list
+
+    :returns: url of image
+    :rtype: str
+    """
+    size = current_app.config['COVER_SIZE']
+    fitting = [image for image in images if (image.get('width') or size) >= size]
+    if fitting:
+        return min(fitting, key=lambda image: image.get('width') or size)['url']
+    return max(images, key=lambda image: image.get('width') or 0)['url']
+
+
+def get_itunes_image_url(url: str):
+    """Get url of itunes artwork with size COVER_SIZE, itunes renders artwork of size specified in url
+
+    :param url: url of artwork(for example artworkUrl100)
+    :type url: str
+
+    :returns: url of image
+    :rtype: str
+    """
+    size = current_app.config['COVER_SIZE']
+    return re.sub(r'/\d+x\d+bb\.(jpg|png)$', f'/{size}x{size}bb.jpg', url)
+
+
+class CoverCache:
+    """Memory cache of cover images, least recently used images are removed when size of images exceeds max_size"""
+    def __init__(self, max_size):
+        """Create cache instance
+
+        :param max_size: max size of all cached images(in bytes)
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get(self, url):
+        """Get cached image or None"""
+        with self._lock:
+            data = self.images.get(url)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.images.move_to_end(url)
+            return data
+
+    def put(self, url, data):
+        """Store image and remove least recently used images if cache is overflowed"""
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            if url in self.images:
+                return
+            self.images[url] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, old_data = self.images.popitem(last=False)
+                self.size -= len(old_data)
+
+    def stats(self):
+        """Get cache counters
+
+        :returns: dict with number of hits, misses and size of cached images
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': self.size}
+
+
+_cover_cache = None
+_cover_cache_lock = Lock()
+
+
+def get_cover_cache():
+    """Get process wide cover cache with size COVER_CACHE_SIZE(in megabytes)
+
+    :rtype: CoverCache
+    """
+    global _cover_cache
+    with _cover_cache_lock:
+        if _cover_cache is None:
+            _cover_cache = CoverCache(current_app.config['COVER_CACHE_SIZE'] * 1024 * 1024)
+    return _cover_cache
 
 
 def get_image_bytes_from_url(url):
-    """Get image bytes from specified url
+    """Get image bytes from specified url, images are taken from cover cache if they were received before
 
     :param url: url that leads to file
     :type url: str
@@ -376,7 +511,29 @@ def get_image_bytes_from_url(url):
     :returns: image data
     :rtype: bytes
     """
-    return get(url, stream=True).raw.read()
+    cache = get_cover_cache()
+    data = cache.get(url)
+    if data is None:
+        data = get(url).content
+        cache.put(url, data)
+    return data
+
+
+def get_ffmpeg_metadata_options(tags):
+    """Get ffmpeg options which write tags into output file(cover should be passed as separate input)
+
+    :param tags: dict of tags
+    :type tags: dict
+
+    :returns: list of ffmpeg options
+    :rtype: list
+    """
+    names = {'album': 'album', 'artist': 'artist', 'title': 'title', 'release_date': 'date', 'number': 'track'}
+    options = list()
+    for key in tags:
+        if key in names and tags[key] is not None:
+            options += ['-metadata', f'{names[key]}={tags[key]}']
+    return options
 
 
 def insert_tags(filepath, tags):
@@ -405,3 +562,92 @@ def insert_tags(filepath, tags):
         elif key == 'number':
             file['TRCK'] = TRCK(encoding=3, text=str(tags[key]))
     file.save(filepath)
+
+
+def get_cover_bytes(tags):
+    """Get bytes of cover image specified in tags
+
+    :returns: image data or None if there is no cover or it is failed to be received
+    :rtype: bytes or None
+    """
+    if not tags.get('image'):
+        return None
+    try:
+        return get_image_bytes_from_url(tags['image'])
+    except RequestException as err:
+        print(f'Failed to receive cover {tags["image"]}: {err}')
+        return None
+
+
+def insert_mp4_tags(filepath, tags):
+    """Using mutagen inject tags inside m4a file
+
+    :param filepath: path to file
+    :type filepath: str
+    :param tags: dict of tags
+    :type tags: dict
+    """
+    names = {'album': '\xa9alb', 'artist': '\xa9ART', 'title': '\xa9nam', 'release_date': '\xa9day'}
+    file = MP4(filepath)
+    for key in tags:
+        if key in names and tags[key] is not None:
+            file[names[key]] = [str(tags[key])]
+        elif key == 'number' and tags[key] is not None:
+            file['trkn'] = [(int(tags[key]), 0)]
+    cover = get_cover_bytes(tags)
+    if cover:
+        file['covr'] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    file.save()
+
+
+def insert_vorbis_tags(filepath, tags):
+    """Using mutagen inject tags(vorbis comments) inside opus, ogg or flac file
+
+    :param filepath: path to file
+    :type filepath: str
+    :param tags: dict of tags
+    :type tags: dict
+    """
+    names = {'album': 'album', 'artist': 'artist', 'title': 'title', 'release_date': 'date', 'number': 'tracknumber'}
+    ext = os.path.splitext(filepath)[1]
+    if ext == '.flac':
+        file = FLAC(filepath)
+    elif ext == '.opus':
+        file = OggOpus(filepath)
+    else:
+        file = OggVorbis(filepath)
+    for key in tags:
+        if key in names and tags[key] is not None:
+            file[names[key]] = [str(tags[key])]
+    cover = get_cover_bytes(tags)
+    if cover:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.desc = 'Front cover'
+        picture.data = cover
+        if ext == '.flac':
+            file.clear_pictures()
+            file.add_picture(picture)
+        else:
+            file['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+    file.save()
+
+
+def insert_audio_tags(filepath, tags):
+    """Inject tags inside file using tags format of its container(defined by extension)
+
+    :param filepath: path to mp3, m4a, opus, ogg or flac file
+    :type filepath: str
+    :param tags: dict of tags
+    :type tags: dict
+    """
+    ext = os.path.splitext(filepath)[1]
+    if ext == '.m4a':
+        insert_mp4_tags(filepath, tags)
+    elif ext in ('.opus', '.ogg', '.flac'):
+        insert_vorbis_tags(filepath, tags)
+    elif ext == '.mp3':
+        insert_tags(filepath, tags)
+    else:
+        print(f'Tags are not supported for {ext} files')
@@ -0,0 +1,96 @@
+from functools import lru_cache
+
+import re
+
+_quoted = re.compile(r'"[^"]*"')
+_brackets = re.compile(r'\([^()]*\)|\[[^\[\]]*\]')
+# '-' and '–' are different symbols!
+_separators = [re.compile(r'\s[-–—]\s'), re.compile(r'[-–]'), re.compile(r':')]
+_spaces = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=64)
+def compile_noise(noise_tokens: tuple):
+    """Get regex which matches any of noise tokens(case insensitive)"""
+    if not noise_tokens:
+        return None
+    tokens = sorted(noise_tokens, key=len, reverse=True)
+    return re.compile('|'.join(r'(?<!\w)' + re.escape(token) + r'(?!\w)' for token in tokens), re.IGNORECASE)
+
+
+@lru_cache(maxsize=64)
+def compile_noise_suffix(noise_tokens: tuple):
+    """Get regex which matches noise token glued to the end of channel title(for example "LinkinParkVEVO"),
+       tokens are matched case sensitive, so ordinary words ending with the same letters are kept"""
+    if not noise_tokens:
+        return None
+    tokens = sorted(noise_tokens, key=len, reverse=True)
+    return re.compile('(?:' + '|'.join(re.escape(token) for token in tokens) + r')\s*$')
+
+
+def remove_brackets(s: str):
+    """Remove text in round and square brackets, which is not inside quotes, and remove quotes"""
+    parts = list()
+    position = 0
+    for match in _quoted.finditer(s):
+        parts.append(_brackets.sub('', s[position:match.start()]))
+        parts.append(match.group()[1:-1])
+        position = match.end()
+    parts.append(_brackets.sub('', s[position:]))
+    return ''.join(parts)
+
+
+def capitalize_all_words(s: str):
+    return ' '.join(word.capitalize() for word in s.split())
+
+
+@lru_cache(maxsize=4096)
+def normalize_title(channel_title: str, video_title: str, noise_tokens=()):
+    """Get artist and song title from channel title and video title
+
+    Quotes, text in brackets(outside quotes) and noise tokens(also glued to the end of channel title)
+    are removed, then title is split by the first separator(dash surrounded by spaces, any dash, colon)
+    into artist and song title, if there is no separator channel title is used as artist
+
+    :param channel_title: channel title(uploader nickname)
+    :type channel_title: str
+    :param video_title: video(file) title
+    :type video_title: str
+    :param noise_tokens: tuple of strings to be removed from titles(for example "Official Video")
+    :type noise_tokens: tuple
+
+    :returns: tuple with artist and song title
+    :rtype: tuple
+    """
+    noise = compile_noise(noise_tokens)
+    video_title = remove_brackets(video_title)
+    if noise:
+        video_title = noise.sub('', video_title)
+        channel_title = compile_noise_suffix(noise_tokens).sub('', noise.sub('', channel_title))
+
+    for separator in _separators:
+        parts = separator.split(video_title, maxsplit=1)
+        if len(parts) > 1 and parts[0].strip():
+            artist = parts[0].strip()
+            title = parts[1].strip().strip(' -–|')
+            break
+    else:
+        artist = channel_title.strip().strip(' -|')
+        title = video_title.strip().strip(' -–|')
+
+    artist = capitalize_all_words(artist).replace('_', ' ').replace('-', ' ')
+    return _spaces.sub(' ', artist).strip(), capitalize_all_words(title)
+
+
+def normalize_titles(titles: list, noise_tokens=()):
+    """Get artists and song titles for couple of videos(for example for whole playlist)
+
+    :param titles: list of tuples with channel title and video title
+    :type titles: list
+    :param noise_tokens: tuple of strings to be removed from titles
+    :type noise_tokens: tuple
+
+    :returns: list of tuples with artist and song title
+    :rtype: list
+    """
+    return [normalize_title(channel_title, video_title, noise_tokens) for channel_title, video_title in titles]
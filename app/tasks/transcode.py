@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from youtube_dl.postprocessor.ffmpeg import FFmpegPostProcessorError
+
+import subprocess
+import shutil
+import math
+import os
+
+SAMPLE_RATE = 44100
+# number of samples in one mp3 frame
+FRAME_SIZE = 1152
+# number of frames encoded before and after every segment(except the track edges) and cut off after encoding,
+# it covers encoder delay, MDCT windows and psychoacoustic lookahead, so frames around segment boundaries
+# are encoded the same way as in one process and segments are joined without gaps and clicks(encoder delay
+# shifts audio of every segment in its frames, boundaries are aligned to frames, so the shift is the same
+# in all segments and frames are cut at the same positions of the track)
+OVERLAP_FRAMES = 2
+# bitrates(kbit/s) of MPEG-1 Layer III frames by bitrate index
+BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+
+def get_segments(duration: float, count: int, overlap_frames=OVERLAP_FRAMES):
+    """Split track into segments which boundaries are aligned to mp3 frames
+
+    :param duration: track duration in seconds
+    :type duration: float
+    :param count: number of segments
+    :type count: int
+    :param overlap_frames: number of frames encoded before segment to be cut off
+    :type overlap_frames: int
+
+    :returns: list of tuples with start of encoded part, its length(None for the last segment) and length
+              of overlap to be cut off(in seconds)
+    :rtype: list
+    """
+    frame_duration = FRAME_SIZE / SAMPLE_RATE
+    frames = math.ceil(duration / frame_duration)
+    count = max(1, min(count, frames // (overlap_frames * 4) or 1))
+    bounds = [round(frames * i / count) for i in range(count + 1)]
+    segments = list()
+    for i in range(count):
+        overlap = min(overlap_frames, bounds[i])
+        start = (bounds[i] - overlap) * frame_duration
+        length = (bounds[i + 1] - bounds[i] + overlap) * frame_duration if i < count - 1 else None
+        segments.append((start, length, overlap * frame_duration))
+    return segments
+
+
+def read_frames(filename: str):
+    """Read frames of mp3 file written without tags and Xing header
+
+    :param filename: path to mp3 file
+    :type filename: str
+
+    :returns: list of frames(bytes)
+    :rtype: list
+
+    :raises FFmpegPostProcessorError: when file has something else than MPEG-1 Layer III frames
+    """
+    with open(filename, 'rb') as file:
+        data = file.read()
+    frames = list()
+    pos = 0
+    while pos < len(data):
+        if len(data) - pos < 4 or data[pos] != 0xFF or data[pos + 1] & 0xFE != 0xFA or \
+                not 0 < data[pos + 2] >> 4 < len(BITRATES):
+            raise FFmpegPostProcessorError(f'Invalid mp3 frame at {pos} in {filename}')
+        size = 144000 * BITRATES[data[pos + 2] >> 4] // SAMPLE_RATE + (data[pos + 2] >> 1 & 1)
+        frames.append(data[pos:pos + size])
+        pos += size
+    return frames
+
+
+def run_ffmpeg(executable: str, args: list):
+    """Run ffmpeg with args
+
+    :raises FFmpegPostProcessorError: when ffmpeg is failed
+    """
+    p = subprocess.Popen([executable, '-y', '-loglevel', 'error'] + args,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise FFmpegPostProcessorError(stderr.decode('utf-8', 'replace').strip().split('\n')[-1])
+
+
+def transcode_segments(executable: str, filename: str, out_filename: str, quality: int, duration: float,
+                       workers: int, inputs=(), options=()):
+    """Encode file to mp3 by segments in parallel ffmpeg processes and join segments into one file
+
+    Segment boundaries are aligned to mp3 frames and bit reservoir is disabled(so every frame can be decoded
+    independently). Segments are joined by frames: overlap encoded before every segment and frames written
+    after its end(overlap, encoder delay and padding of the last frame) are cut off, so joined file has
+    no gaps and clicks on segment boundaries
+
+    :param executable: path to ffmpeg
+    :type executable: str
+    :param filename: path to source file
+    :type filename: str
+    :param out_filename: path to mp3 file
+    :type out_filename: str
+    :param quality: mp3 bitrate(or VBR quality if it is less than 10)
+    :type quality: int
+    :param duration: source duration in seconds
+    :type duration: float
+    :param workers: number of segments encoded simultaneously
+    :type workers: int
+    :param inputs: additional inputs of the joining call(for example cover)
+    :type inputs: iterable
+    :param options: options of the joining call(stream mapping, cover and metadata options), audio should be copied
+    :type options: iterable
+
+    :raises FFmpegPostProcessorError: when ffmpeg is failed
+    """
+    temp_dir = out_filename + '.segments'
+    os.makedirs(temp_dir, exist_ok=True)
+    if quality < 10:
+        codec_options = ['-c:a', 'libmp3lame', '-q:a', str(quality)]
+    else:
+        codec_options = ['-c:a', 'libmp3lame', '-b:a', f'{quality}k']
+    segments = get_segments(duration, workers)
+    frame_duration = FRAME_SIZE / SAMPLE_RATE
+
+    def encode(i):
+        start, length, overlap = segments[i]
+        args = ['-ss', f'{start:.6f}', '-i', filename]
+        if length is not None:
+            args += ['-t', f'{length + OVERLAP_FRAMES * frame_duration:.6f}']
+        args += ['-map', '0:a:0', '-vn', '-ar', str(SAMPLE_RATE), '-reservoir', '0', '-write_xing', '0',
+                 '-id3v2_version', '0', '-map_metadata', '-1']
+        run_ffmpeg(executable, args + codec_options + [temp_dir + os.path.sep + f'{i}.mp3'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(encode, range(len(segments))))
+        joined_filename = temp_dir + os.path.sep + 'joined.mp3'
+        with open(joined_filename, 'wb') as file:
+            for i, (start, length, overlap) in enumerate(segments):
+                frames = read_frames(temp_dir + os.path.sep + f'{i}.mp3')
+                end = round(length / frame_duration) if length is not None else None
+                file.write(b''.join(frames[round(overlap / frame_duration):end]))
+        args = ['-i', joined_filename]
+        for path in inputs:
+            args += ['-i', path]
+        run_ffmpeg(executable, args + list(options) + [out_filename])
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,112 @@
+from flask import current_app
+from threading import Lock
+from contextlib import contextmanager
+
+import youtube_dl
+import os
+
+
+class Logger:
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    @staticmethod
+    def error(msg):
+        print(msg)
+
+
+PROFILES = {
+    'fetch': {'format': 'bestaudio/best'},
+    'convert': {},
+    'extract': {},
+    'extract_flat': {'extract_flat': 'in_playlist'},
+}
+
+
+class YoutubeDLPool:
+    """Pool of ready YoutubeDL instances grouped by option profiles
+
+    Creation of YoutubeDL instance and its extractors is not free, so instances are reused between jobs.
+    Instance is borrowed by one thread at once, options of the job(output template, progress hooks)
+    are applied while instance is borrowed and reset when it is returned.
+    """
+    def __init__(self, profiles: dict, max_idle=4):
+        """Create pool
+
+        :param profiles: dict where profile name is assigned to dict of YoutubeDL options
+        :type profiles: dict
+        :param max_idle: max number of instances of one profile kept in pool
+        :type max_idle: int
+        """
+        self.profiles = profiles
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle = {profile: [] for profile in profiles}
+        self._lock = Lock()
+
+    @contextmanager
+    def borrow(self, profile: str, progress_hooks=(), **params):
+        """Take instance for the time of with block
+
+        :param profile: profile name
+        :type profile: str
+        :param progress_hooks: progress hooks of the job
+        :type progress_hooks: iterable
+        :param params: YoutubeDL options of the job(for example outtmpl)
+
+        :returns: YoutubeDL instance
+        """
+        with self._lock:
+            idle = self._idle[profile]
+            ydl = idle.pop() if idle else None
+            if ydl is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if ydl is None:
+            ydl = youtube_dl.YoutubeDL(dict(self.profiles[profile], logger=Logger()))
+
+        base_params = dict(ydl.params)
+        ydl.params.update(params)
+        for hook in progress_hooks:
+            ydl.add_progress_hook(hook)
+        yield ydl
+
+        ydl.params.clear()
+        ydl.params.update(base_params)
+        ydl._progress_hooks = []
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+        with self._lock:
+            if len(idle) < self.max_idle:
+                idle.append(ydl)
+
+    def stats(self):
+        """Get pool counters
+
+        :returns: dict with number of created and reused instances
+        :rtype: dict
+        """
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused}
+
+
+_pools = dict()
+_pools_lock = Lock()
+
+
+def get_ydl_pool():
+    """Get YoutubeDL pool of current process, YDL_POOL_SIZE instances of every profile are kept
+
+    :rtype: YoutubeDLPool
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools.clear()
+            _pools[pid] = YoutubeDLPool(PROFILES, max_idle=current_app.config['YDL_POOL_SIZE'])
+    return _pools[pid]
@@ -0,0 +1,65 @@
+"""Benchmark of track matching(app/tasks/matching.py) over the corpus of real titles
+
+Compares accuracy and number of search requests of candidate scoring with the previous rule
+(first candidate which title contains searched title, second request with more results when
+the first candidate does not match) and measures time of choosing the best candidate.
+
+Run from repository root: python benchmarks/match_candidates.py
+"""
+from timeit import timeit
+
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tasks.matching import Candidate  # noqa: E402
+from app.tasks.matching import pick_best_candidate  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'tests', 'data', 'match_corpus.json')
+
+
+def pick_by_substring(candidates, title):
+    """Previous rule, returns index of chosen candidate and number of requests"""
+    if not candidates:
+        return None, 1
+    if title.lower() in candidates[0]['title'].lower():
+        return 0, 1
+    for i, candidate in enumerate(candidates):
+        if title.lower() in candidate['title'].lower():
+            return i, 2
+    return None, 2
+
+
+def main():
+    with open(CORPUS_PATH) as file:
+        corpus = json.load(file)
+
+    old_correct = new_correct = old_requests = 0
+    cases = list()
+    for case in corpus:
+        index, requests = pick_by_substring(case['candidates'], case['title'])
+        old_correct += index == case['expected']
+        old_requests += requests
+        candidates = [Candidate(c['title'], c['artist'], c['duration'], c['album_type'], i)
+                      for i, c in enumerate(case['candidates'])]
+        best = pick_best_candidate(candidates, case['title'], case['artist'], case['duration'])
+        new_correct += (best.data if best else None) == case['expected']
+        cases.append((candidates, case))
+
+    def run():
+        for candidates, case in cases:
+            pick_best_candidate(candidates, case['title'], case['artist'], case['duration'])
+
+    number = 200
+    seconds = timeit(run, number=number)
+    print(f'corpus: {len(corpus)} tracks')
+    print(f'substring rule: {old_correct}/{len(corpus)} correct, {old_requests} search requests')
+    print(f'scoring:        {new_correct}/{len(corpus)} correct, {len(corpus)} search requests')
+    print(f'scoring time:   {seconds / number / len(corpus) * 1e6:.1f} us per track')
+
+
+if __name__ == '__main__':
+    main()
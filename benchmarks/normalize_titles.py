@@ -0,0 +1,49 @@
+"""Micro-benchmark of video title normalization(app/tasks/titles.py) over the regression corpus
+
+Measures time of normalization without memoization(cold), with memoization(warm)
+and of batch normalization of the whole corpus, so new rules can be checked not to slow down tagging.
+
+Run from repository root: python benchmarks/normalize_titles.py
+"""
+from timeit import timeit
+
+import json
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tasks.titles import normalize_title  # noqa: E402
+from app.tasks.titles import normalize_titles  # noqa: E402
+from config import Config  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'tests', 'data', 'titles.json')
+
+
+def main():
+    with open(CORPUS_PATH) as file:
+        corpus = json.load(file)
+    titles = [(case['channel_title'], case['video_title']) for case in corpus]
+    noise_tokens = tuple(Config.TITLE_NOISE_TOKENS)
+    number = 500
+
+    def cold():
+        for channel_title, video_title in titles:
+            normalize_title.__wrapped__(channel_title, video_title, noise_tokens)
+
+    def warm():
+        for channel_title, video_title in titles:
+            normalize_title(channel_title, video_title, noise_tokens)
+
+    def batch():
+        normalize_titles(titles, noise_tokens)
+
+    print(f'corpus: {len(titles)} titles')
+    for name, func in (('cold', cold), ('warm', warm), ('batch', batch)):
+        seconds = timeit(func, number=number)
+        print(f'{name}: {seconds / number / len(titles) * 1e6:.2f} us per title')
+
+
+if __name__ == '__main__':
+    main()
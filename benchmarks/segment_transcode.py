@@ -0,0 +1,53 @@
+"""Benchmark of segment-parallel mp3 encoding(app/tasks/transcode.py) against one ffmpeg process
+
+Generates 20 minutes(ALLOWED_DURATION) test track with ffmpeg and measures time of its encoding
+by one process and by segments with different number of workers, requires ffmpeg in PATH.
+
+Run from repository root: python benchmarks/segment_transcode.py
+"""
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.tasks.transcode import run_ffmpeg  # noqa: E402
+from app.tasks.transcode import transcode_segments  # noqa: E402
+
+DURATION = 20 * 60
+QUALITY = 192
+
+
+def main():
+    executable = shutil.which('ffmpeg')
+    if not executable:
+        print('ffmpeg is not found')
+        return
+    temp_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(temp_dir, 'source.wav')
+        run_ffmpeg(executable, ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={DURATION}', '-ac', '2',
+                                '-ar', '44100', source])
+
+        start = time.perf_counter()
+        run_ffmpeg(executable, ['-i', source, '-c:a', 'libmp3lame', '-b:a', f'{QUALITY}k',
+                                os.path.join(temp_dir, 'single.mp3')])
+        single = time.perf_counter() - start
+        print(f'single process: {single:.2f} s')
+
+        for workers in sorted({2, 4, os.cpu_count() or 1}):
+            out_filename = os.path.join(temp_dir, f'segments{workers}.mp3')
+            start = time.perf_counter()
+            transcode_segments(executable, source, out_filename, QUALITY, DURATION, workers,
+                               options=['-map', '0:a:0', '-c:a', 'copy'])
+            seconds = time.perf_counter() - start
+            print(f'{workers} segments: {seconds:.2f} s({single / seconds:.1f}x), '
+                  f'size {os.path.getsize(out_filename)} bytes')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
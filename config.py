@@ -24,7 +24,44 @@ class Config:
     ALLOWED_DURATION = 20
     EXPIRATION_TIME = 5
     MAX_PLAYLIST_ITEMS = 20
-    PLAYLIST_PART_SIZE = 3
+    PLAYLIST_LOOKUP_WORKERS = 4
+    PLAYLIST_WORKERS = 4
+    PLAYLIST_TRANSCODERS = os.cpu_count() or 1
+    PLAYLIST_QUEUE_SIZE = 4
+    PLAYLIST_STREAM_TIMEOUT = 1800
+    USE_FILE_CACHE = True
+    FILE_CACHE_PATH = os.path.join(basedir, 'app', 'tasks', 'cache')
+    FILE_CACHE_SIZE = 2048
+    USE_SOURCE_CACHE = True
+    SOURCE_CACHE_PATH = os.path.join(basedir, 'app', 'tasks', 'sources')
+    SOURCE_CACHE_SIZE = 1024
+    SOURCE_CACHE_TTL = 30
+    PREENCODE_QUALITIES = []
+    SEGMENT_TRANSCODE_DURATION = 600
+    SEGMENT_TRANSCODE_WORKERS = os.cpu_count() or 1
+    SINGLE_FLIGHT_TIMEOUT = 600
+    YDL_POOL_SIZE = 4
+    PROGRESS_KEEPALIVE = 15
+    PROGRESS_STREAMS_MAX = 50
+    PROGRESS_STREAM_MAX_DURATION = 300
+    PROGRESS_DB_INTERVAL = 10
+    PROGRESS_STORE_TTL = 86400
+    HTTP_CONNECT_TIMEOUT = 3.05
+    HTTP_READ_TIMEOUT = 10
+    HTTP_RETRIES = 3
+    HTTP_BACKOFF_FACTOR = 0.3
+    USE_METADATA_CACHE = True
+    METADATA_CACHE_PATH = os.path.join(basedir, 'app', 'tasks', 'metadata.sqlite')
+    METADATA_CACHE_TTL = 7 * 24 * 60 * 60
+    METADATA_CACHE_ERROR_TTL = 60 * 60
+    TITLE_NOISE_TOKENS = ['Official Music Video', 'Official Video', 'Official Audio', 'Official Lyric Video',
+                          'Lyric Video', 'Lyrics', 'VEVO', '- Topic']
+    TAGS_LOOKUP_TIMEOUT = 10
+    TAGS_SEARCH_LIMIT = 10
+    TAGS_MATCH_THRESHOLD = 0.6
+    TAGS_LOOKUP_WORKERS = 12
+    COVER_SIZE = 300
+    COVER_CACHE_SIZE = 32
     PLAYLIST_LIVE_TIME = 3
     MAIN_TIMER_DELTA = 1
     UNCONFIRMED_ACC_EXPIRATION_TIME = 180
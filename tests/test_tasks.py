@@ -1,12 +1,62 @@
 from app import db, create_app
 from app.models import User
+from app.models import Task
+from app.models import FileInfo
 from app.tasks.info import *
 from app.tasks.download import download
 from app.tasks.download import download_yt_files_sync
+from app.tasks.download import download_file_sync
+from app.tasks.download import run_in_background
+from app.tasks.download import get_source_format
+from app.tasks.download import cap_quality
+from app.tasks.download import fetch
+from app.tasks.download import fetch_and_convert
+from app.tasks.download import fetch_source
+from app.tasks.download import iter_playlist_files
+from app.tasks.download import remux
+from app.tasks.download import get_mp3_output_options
+from app.tasks.pipeline import Pipeline
+from app.tasks.pipeline import Stage
+from app.tasks.archive import stream_zip
+from app.tasks.archive import write_zip
+from app.tasks.cache import FileCache
+from app.tasks.singleflight import SingleFlight
+from app.tasks.http_client import HttpClient
+from app.tasks.ydl_pool import YoutubeDLPool
+from app.tasks.transcode import get_segments
+from app.tasks.transcode import run_ffmpeg
+from app.tasks.transcode import transcode_segments
+from app.tasks.transcode import FRAME_SIZE
+from app.tasks.transcode import SAMPLE_RATE
+from app.tasks.progress import ProgressChannel
+from app.tasks.progress import progress_events
+from app.tasks.progress import set_task_progress
+from app.tasks.progress import get_task_progress
+from app.tasks.progress import get_progress_store
+from app.tasks.progress import get_progress_channel
+from app.tasks.metadata_cache import MetadataCache
+from app.tasks.matching import Candidate
+from app.tasks.matching import pick_best_candidate
+from app.tasks.matching import parse_iso_duration
+from app.tasks.metadata_cache import cached_metadata
 from app.tasks.tags import *
 from config import Config
+from flask import current_app
+from threading import Thread
+from http.server import HTTPServer
+from http.server import BaseHTTPRequestHandler
+from mutagen.ogg import OggPage
+from mutagen.oggopus import OggOpus
 
 import pytest
+import requests
+import struct
+import array
+import json
+import time
+import hashlib
+import zipfile
+import io
 import os
 import shutil
 
@@ -17,6 +67,9 @@ class TestConfig(Config):
     WTF_CSRF_ENABLED = False
     USE_CELERY = False
     SEND_MAILS = False
+    USE_FILE_CACHE = False
+    USE_METADATA_CACHE = False
+    USE_SOURCE_CACHE = False
 
 
 app = create_app(TestConfig)
@@ -77,6 +130,34 @@ def test_get_yt_file_info(client):
         get_yt_file_info('https://www.youtube.com/watch?v=rTyKk5')
 
 
+def test_get_yt_files_info(client):
+    infos = get_yt_files_info(['rTyKk53Wq3w', 'JR6aKhnAcFA', 'rTyKk53Wq3s'])
+    assert set(infos) == {'rTyKk53Wq3w', 'JR6aKhnAcFA'}
+    for info in infos.values():
+        assert info['resource'] == 'yt'
+        assert 'duration' in info['API_response']['items'][0]['contentDetails']
+        assert 'title' in info['API_response']['items'][0]['snippet']
+        assert is_allowed_duration(info) in (True, False)
+
+    tags = get_yt_video_tags('rTyKk53Wq3w', infos['rTyKk53Wq3w']['API_response'])
+    assert tags == get_yt_video_tags('rTyKk53Wq3w')
+
+
+def test_yt_info_errors(client, monkeypatch):
+    def fake_get(url, **kwargs):
+        r = requests.Response()
+        r.status_code = 503
+        r.reason = 'Service Unavailable'
+        r._content = b'<html>Service Unavailable</html>'
+        return r
+
+    monkeypatch.setattr('app.tasks.info.get', fake_get)
+    with pytest.raises(ConnectionError, match='503 - Service Unavailable'):
+        get_yt_file_info('https://www.youtube.com/watch?v=rTyKk53Wq3w')
+    with pytest.raises(ConnectionError, match='503 - Service Unavailable'):
+        get_yt_files_info(['rTyKk53Wq3w'])
+
+
 def test_get_sc_file_info(client):
     info = get_sc_file_info("https://soundcloud.com/elinacooper/"
                             "bring-me-the-horizon-nihilist-bluescover-by-the-veer-union")
@@ -153,6 +234,77 @@ def test_download_from_sc(client):
     assert os.path.isfile(filename) is True
 
 
+def test_download_returns_converted_file(client, monkeypatch):
+    def fake_fetch(link, dir, task=None, log_info=None, info=None, quality=None, source=None):
+        os.makedirs(dir, exist_ok=True)
+        with open(dir + os.path.sep + 'Song.webm', 'wb') as file:
+            file.write(b'0' * 1000)
+        return dir + os.path.sep + 'Song.webm'
+
+    def fake_convert(filename, quality=192, tags=None, source_bitrate=None, extra_qualities=(), outputs=None,
+                     duration=None):
+        # the real conversion deletes downloaded file
+        os.rename(filename, filename[:-5] + '.mp3')
+        return filename[:-5] + '.mp3'
+
+    monkeypatch.setattr('app.tasks.download.fetch', fake_fetch)
+    monkeypatch.setattr('app.tasks.download.convert', fake_convert)
+    monkeypatch.setattr('app.tasks.download.get_source_cache', lambda: None)
+    link = 'https://www.youtube.com/watch?v=rTyKk53Wq3w'
+    filename = download(link, dir=TEMP_DIR + os.path.sep + '1')
+    assert filename == TEMP_DIR + os.path.sep + '1' + os.path.sep + 'Song.mp3'
+    assert os.path.isfile(filename)
+    cache = FileCache(TEMP_DIR + os.path.sep + 'cache', max_size=10000)
+    monkeypatch.setattr('app.tasks.download.get_file_cache', lambda: cache)
+    for i in (2, 3):
+        filename = download(link, dir=TEMP_DIR + os.path.sep + str(i))
+        assert filename == TEMP_DIR + os.path.sep + str(i) + os.path.sep + 'Song.mp3'
+        assert os.path.isfile(filename)
+    shutil.rmtree(TEMP_DIR)
+
+
+def test_download_file_sync(client, monkeypatch):
+    def fake_fetch(link, dir, task=None, log_info=None, info=None, quality=None, source=None):
+        os.makedirs(dir, exist_ok=True)
+        with open(dir + os.path.sep + 'Song.webm', 'wb') as file:
+            file.write(b'0' * 1000)
+        return dir + os.path.sep + 'Song.webm'
+
+    def fake_convert(filename, quality=192, tags=None, source_bitrate=None, extra_qualities=(), outputs=None,
+                     duration=None):
+        os.rename(filename, filename[:-5] + '.mp3')
+        return filename[:-5] + '.mp3'
+
+    monkeypatch.setattr('app.tasks.download.fetch', fake_fetch)
+    monkeypatch.setattr('app.tasks.download.convert', fake_convert)
+    monkeypatch.setattr('app.tasks.download.get_source_cache', lambda: None)
+    task = Task(description='Downloading mp3', user_ip='127.0.0.1', status_code=0, progress='Waiting')
+    db.session.add(task)
+    db.session.commit()
+    download_file_sync('https://www.youtube.com/watch?v=rTyKk53Wq3w', task_id=task.id, dir=TEMP_DIR, app=app)
+    task = Task.query.get(task.id)
+    assert task.status_code == 4
+    assert task.files.first().filename == 'Song.mp3'
+    assert os.path.isfile(task.unique_process_info + os.path.sep + 'Song.mp3')
+    r = client.get('/get_ready_file')
+    assert r.status_code == 200
+    assert 'Song.mp3' in r.headers['Content-Disposition']
+    r.close()
+
+    def fake_download(*args, **kwargs):
+        raise RuntimeError('Unexpected error')
+
+    monkeypatch.setattr('app.tasks.download.download', fake_download)
+    task = Task(description='Downloading mp3', user_ip='127.0.0.1', status_code=0, progress='Waiting')
+    db.session.add(task)
+    db.session.commit()
+    download_file_sync('https://www.youtube.com/watch?v=rTyKk53Wq3w', task_id=task.id, dir=TEMP_DIR, app=app)
+    task = Task.query.get(task.id)
+    assert task.status_code == 1
+    assert task.progress == 'Download error'
+    shutil.rmtree(TEMP_DIR)
+
+
 def test_download_yt_files(client):
     try:
         os.mkdir(TEMP_DIR)
@@ -163,6 +315,584 @@ def test_download_yt_files(client):
     assert os.path.isfile(path[0]) is True
 
 
+# Testing pipeline module
+
+
+def test_pipeline():
+    def double(x):
+        if x == 3:
+            raise ValueError('Bad item')
+        return x * 2
+
+    pipeline = Pipeline([Stage('double', double, workers=3), Stage('increment', lambda x: x + 1, workers=2)],
+                        queue_size=1)
+    results = list(pipeline.run(list(range(6))))
+    assert [el[0] for el in results if el[1] is None] == [1, 3, 5, 9, 11]
+    assert isinstance(results[3][1], ValueError)
+    stats = pipeline.stats()
+    assert stats['stages']['double']['processed'] == 6
+    assert stats['stages']['double']['failed'] == 1
+    assert stats['stages']['increment']['processed'] == 5
+    assert stats['queues']['increment']['peak'] <= 1
+
+
+# Testing archive module
+
+
+def test_run_in_background(client):
+    def get_config_value(name):
+        time.sleep(0.1)
+        return current_app.config[name]
+
+    future = run_in_background(get_config_value, 'PLAYLIST_WORKERS')
+    assert future.done() is False
+    assert future.result() == app.config['PLAYLIST_WORKERS']
+    with pytest.raises(KeyError):
+        run_in_background(get_config_value, 'NOT_EXISTING').result()
+
+
+def test_download_playlist_items_concurrently(client, monkeypatch):
+    playlist = ['aaaaaaaaaaa', 'bbbbbbbbbbb', 'xxxxxxxxbad', 'aaaaaaaaaaa', 'ccccccccccc']
+
+    def fake_fetch(link, dir, task=None, log_info=None, info=None, quality=None, source=None):
+        # every video has the same title, items are finished in reverse order
+        time.sleep(0.05 * (len(playlist) - playlist.index(link[-11:])))
+        os.makedirs(dir, exist_ok=True)
+        with open(dir + os.path.sep + 'Same title.webm', 'wb') as file:
+            file.write(link[-11:].encode())
+        return dir + os.path.sep + 'Same title.webm'
+
+    def fake_convert(filename, quality=192, tags=None, source_bitrate=None, extra_qualities=(), outputs=None,
+                     duration=None):
+        os.rename(filename, filename[:-5] + '.mp3')
+        return filename[:-5] + '.mp3'
+
+    monkeypatch.setattr('app.tasks.download.get_yt_files_info', lambda ids: {i: {'id': i} for i in ids})
+    monkeypatch.setattr('app.tasks.download.is_allowed_duration', lambda info: not info['id'].endswith('bad'))
+    monkeypatch.setattr('app.tasks.download.get_file_cache', lambda: None)
+    monkeypatch.setattr('app.tasks.download.get_source_cache', lambda: None)
+    monkeypatch.setattr('app.tasks.download.fetch', fake_fetch)
+    monkeypatch.setattr('app.tasks.download.convert', fake_convert)
+    monkeypatch.setitem(app.config, 'PLAYLIST_WORKERS', 4)
+    task = Task(description='Downloading playlist items', user_id=1, status_code=3, progress='Waiting')
+    db.session.add(task)
+    db.session.commit()
+    FileInfo.make_records(playlist, task.id)
+    dir = TEMP_DIR + os.path.sep + f'Task{task.id}'
+    os.makedirs(dir, exist_ok=True)
+    task.unique_process_info = os.path.abspath(dir)
+    db.session.commit()
+
+    download_yt_files_sync(playlist, task_id=task.id, dir=dir, app=app, send_mails=False)
+    task = Task.query.get(task.id)
+    files = sorted(task.files.all(), key=lambda file: file.index)
+    assert task.status_code == 4
+    assert [file.status_code for file in files] == [1, 1, 2, 1, 1]
+    assert len({file.filename for file in files if file.filename}) == 4
+    for file, record in zip(files, playlist):
+        if file.status_code == 1:
+            with open(dir + os.path.sep + file.filename, 'rb') as f:
+                assert f.read() == record.encode()
+    shutil.rmtree(TEMP_DIR)
+
+def test_ydl_pool(client):
+    pool = YoutubeDLPool({'fetch': {'format': 'bestaudio/best'}}, max_idle=1)
+    hook = lambda d: None
+    with pool.borrow('fetch', [hook], outtmpl='first/%(title)s.%(ext)s') as ydl:
+        assert ydl.params['outtmpl'] == 'first/%(title)s.%(ext)s'
+        assert ydl.params['format'] == 'bestaudio/best'
+        assert ydl._progress_hooks == [hook]
+        with pool.borrow('fetch') as other:
+            assert other is not ydl
+    with pool.borrow('fetch') as reused:
+        assert reused is ydl or reused is other
+        assert 'outtmpl' not in reused.params
+        assert reused.params['format'] == 'bestaudio/best'
+        assert reused._progress_hooks == []
+    with pytest.raises(ValueError):
+        with pool.borrow('fetch') as failed:
+            raise ValueError
+    with pool.borrow('fetch') as ydl:
+        assert ydl is not failed
+    assert pool.stats() == {'created': 3, 'reused': 2}
+
+
+def test_source_format(client):
+    assert get_source_format(64) == 'worstaudio[abr>=64]/bestaudio/best'
+    assert get_source_format(320) == 'worstaudio[abr>=320]/bestaudio/best'
+    assert get_source_format(None) == 'bestaudio/best'
+    assert cap_quality(320, 128) == 128
+    assert cap_quality(320, 129.5) == 160
+    assert cap_quality(128, 160) == 128
+    assert cap_quality(192, None) == 192
+    assert cap_quality(320, 500) == 320
+
+
+def write_opus_file(filename):
+    packets = [b'OpusHead' + bytes([1, 2]) + struct.pack('<HIhB', 312, 48000, 0, 0),
+               b'OpusTags' + struct.pack('<II', 0, 0),
+               b'\xf8\xff\xfe']
+    with open(filename, 'wb') as file:
+        for sequence, packet in enumerate(packets):
+            page = OggPage()
+            page.serial = 1
+            page.sequence = sequence
+            page.first = sequence == 0
+            page.position = 960 if sequence == 2 else 0
+            page.packets = [packet]
+            file.write(page.write())
+
+
+def test_insert_audio_tags(client):
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    filename = TEMP_DIR + os.path.sep + 'track.opus'
+    write_opus_file(filename)
+    insert_audio_tags(filename, {'artist': 'Artist', 'title': 'Title', 'album': 'Album', 'number': 2,
+                                 'release_date': '2020', 'image': None})
+    tags = OggOpus(filename)
+    assert tags['artist'] == ['Artist']
+    assert tags['title'] == ['Title']
+    assert tags['tracknumber'] == ['2']
+    assert tags['date'] == ['2020']
+    shutil.rmtree(TEMP_DIR)
+
+
+def test_stream_zip(client):
+    try:
+        os.mkdir(TEMP_DIR)
+    except FileExistsError:
+        pass
+    sep = os.path.sep
+    files = list()
+    for i in range(3):
+        with open(TEMP_DIR + sep + f'{i}.mp3', 'wb') as file:
+            file.write(os.urandom(1500 + i))
+        files.append((TEMP_DIR + sep + f'{i}.mp3', f'{i}.mp3'))
+    data = b''.join(stream_zip(files, block_size=1000))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['0.mp3', '1.mp3', '2.mp3']
+        with open(TEMP_DIR + sep + '2.mp3', 'rb') as file:
+            assert archive.read('2.mp3') == file.read()
+
+
+def test_write_zip(client):
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    sep = os.path.sep
+    files = list()
+    for i in range(2):
+        with open(TEMP_DIR + sep + f'{i}.mp3', 'wb') as file:
+            file.write(os.urandom(1500))
+        files.append((TEMP_DIR + sep + f'{i}.mp3', f'{i}.mp3'))
+    arc_hash = write_zip(files, TEMP_DIR + sep + 'playlist.zip', block_size=1000)
+    with open(TEMP_DIR + sep + 'playlist.zip', 'rb') as file:
+        assert arc_hash == hashlib.sha256(file.read()).hexdigest()
+    with zipfile.ZipFile(TEMP_DIR + sep + 'playlist.zip') as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['0.mp3', '1.mp3']
+    shutil.rmtree(TEMP_DIR)
+
+def test_iter_playlist_files(client):
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    sep = os.path.sep
+    task = Task(description='Downloading playlist', user_id=1, status_code=3, progress='Downloading',
+                unique_process_info=TEMP_DIR)
+    db.session.add(task)
+    db.session.commit()
+    # ready, failed, ready without file, stuck, ready after stuck one
+    for index, status_code in enumerate((1, 2, 1, 0, 1), start=1):
+        db.session.add(FileInfo(index=index, file_id=f'id{index}', task_id=task.id, status_code=status_code,
+                                filename=f'{index}.mp3'))
+        if index != 3:
+            with open(TEMP_DIR + sep + f'{index}.mp3', 'wb') as file:
+                file.write(b'0' * 100)
+    db.session.commit()
+
+    start = time.monotonic()
+    data = b''.join(stream_zip(iter_playlist_files(task, check_interval=0.1, timeout=0.3)))
+    assert time.monotonic() - start < 2
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == ['1.mp3', '5.mp3', 'errors.txt']
+        assert archive.read('errors.txt').decode().split('\n') == ['2. id2: failed to download',
+                                                                  '3. id3: file is missing',
+                                                                  '4. id4: not downloaded in time', '']
+
+    # waiting is stopped when task is completed
+    task.status_code = 1
+    db.session.commit()
+    files = list(iter_playlist_files(task, check_interval=0.1))
+    assert [arcname for path, arcname in files] == ['1.mp3', '5.mp3', 'errors.txt']
+    assert files[-1][0].decode().split('\n')[2] == '4. id4: not downloaded before task is completed'
+    shutil.rmtree(TEMP_DIR)
+
+
+# Testing cache module
+
+
+def test_file_cache(client):
+    sep = os.path.sep
+    os.makedirs(TEMP_DIR + sep + 'src', exist_ok=True)
+    cache = FileCache(TEMP_DIR + sep + 'cache', max_size=2500)
+    keys = list()
+    for i in range(3):
+        with open(TEMP_DIR + sep + 'src' + sep + f'{i}.mp3', 'wb') as file:
+            file.write(b'0' * 1000)
+        keys.append(cache.make_key('yt', f'id{i}', 192, False))
+        cache.put(keys[-1], TEMP_DIR + sep + 'src' + sep + f'{i}.mp3')
+        os.utime(cache.get_entry_path(keys[-1]), (i, i))
+        if i == 1:
+            assert cache.get(keys[0], TEMP_DIR + sep + 'dst') == TEMP_DIR + sep + 'dst' + sep + '0.mp3'
+
+    assert cache.make_key('yt', 'id0', 192, False) != cache.make_key('yt', 'id0', 320, False)
+    assert cache.get(keys[1], TEMP_DIR + sep + 'dst') is None
+    assert cache.get(keys[2], TEMP_DIR + sep + 'dst') == TEMP_DIR + sep + 'dst' + sep + '2.mp3'
+    assert os.path.isfile(TEMP_DIR + sep + 'dst' + sep + '2.mp3') is True
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'evictions': 1}
+
+
+def test_file_cache_expire(client):
+    sep = os.path.sep
+    os.makedirs(TEMP_DIR + sep + 'src', exist_ok=True)
+    cache = FileCache(TEMP_DIR + sep + 'cache', max_size=10000)
+    for i in range(2):
+        with open(TEMP_DIR + sep + 'src' + sep + f'{i}.webm', 'wb') as file:
+            file.write(b'0' * 1000)
+        cache.put(cache.make_key('yt', f'id{i}', 'source', None), TEMP_DIR + sep + 'src' + sep + f'{i}.webm')
+    os.utime(cache.get_entry_path(cache.make_key('yt', 'id0', 'source', None)), (0, 0))
+    assert cache.expire(60) == 1
+    assert cache.get(cache.make_key('yt', 'id0', 'source', None), TEMP_DIR + sep + 'dst') is None
+    assert cache.get(cache.make_key('yt', 'id1', 'source', None), TEMP_DIR + sep + 'dst') is not None
+
+
+def serve_audio_formats():
+    """Start HTTP server with two audio formats of one video
+
+    :returns: tuple of server and youtube-dl info dict of the video
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/webm')
+            self.send_header('Content-Length', '1000')
+            self.end_headers()
+            self.wfile.write(b'0' * 1000)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    info = {'id': 'rTyKk53Wq3w', 'title': 'title', 'duration': 700, 'extractor': 'youtube',
+            'extractor_key': 'Youtube', 'webpage_url': 'https://www.youtube.com/watch?v=rTyKk53Wq3w',
+            'formats': [{'format_id': '249', 'url': url + '/249', 'ext': 'webm', 'abr': 50, 'vcodec': 'none'},
+                        {'format_id': '251', 'url': url + '/251', 'ext': 'webm', 'abr': 160, 'vcodec': 'none'}]}
+    return server, info
+
+
+def test_fetch(client):
+    sep = os.path.sep
+    server, info = serve_audio_formats()
+    source = dict()
+    try:
+        filename = fetch(info['webpage_url'], TEMP_DIR, info=info, quality=128, source=source)
+    finally:
+        server.shutdown()
+    assert filename == TEMP_DIR + sep + 'title.webm' and os.path.getsize(filename) == 1000
+    # stream info is taken from the format chosen by youtube-dl
+    assert source == {'bytes': 1000, 'abr': 160, 'format': '251', 'duration': 700}
+
+
+def test_fetch_and_convert(client, monkeypatch):
+    converted = list()
+
+    def fake_convert(filename, quality=192, tags=None, source_bitrate=None, extra_qualities=(), outputs=None,
+                     duration=None):
+        converted.append((quality, source_bitrate, duration))
+        return filename
+
+    monkeypatch.setattr('app.tasks.download.convert', fake_convert)
+    server, info = serve_audio_formats()
+    try:
+        fetch_and_convert(info['webpage_url'], dir=TEMP_DIR, quality=320, info=info)
+    finally:
+        server.shutdown()
+    # bitrate cap and segmented encoding get stream info of the downloaded format
+    assert converted == [(320, 160, 700)]
+
+
+def test_fetch_source(client, monkeypatch):
+    sep = os.path.sep
+    cache = FileCache(TEMP_DIR + sep + 'sources', max_size=10000)
+    fetched = list()
+
+    def fake_fetch(link, dir, task=None, log_info=None, info=None, quality=None, source=None):
+        fetched.append(quality)
+        os.makedirs(dir, exist_ok=True)
+        with open(dir + sep + 'title.webm', 'wb') as file:
+            file.write(b'0' * 1000)
+        source.update({'bytes': 1000, 'abr': quality, 'format': '251', 'duration': 700})
+        return dir + sep + 'title.webm'
+
+    monkeypatch.setattr('app.tasks.download.get_source_cache', lambda: cache)
+    monkeypatch.setattr('app.tasks.download.fetch', fake_fetch)
+    link = 'https://www.youtube.com/watch?v=rTyKk53Wq3w'
+    assert fetch_source(link, TEMP_DIR + sep + '1', 192) == TEMP_DIR + sep + '1' + sep + 'title.webm'
+    source = dict()
+    assert fetch_source(link, TEMP_DIR + sep + '2', 128, source=source) == TEMP_DIR + sep + '2' + sep + 'title.webm'
+    # stream info is restored on cache hit, so bitrate cap and segmented encoding do not depend on cache state
+    assert source == {'bytes': 1000, 'abr': 192, 'format': '251', 'duration': 700}
+    assert os.listdir(TEMP_DIR + sep + '2') == ['title.webm']
+    assert fetch_source(link, TEMP_DIR + sep + '3', 320) == TEMP_DIR + sep + '3' + sep + 'title.webm'
+    assert fetched == [192, 320]
+
+    # stream info of real download is kept with cached source
+    monkeypatch.undo()
+    cache = FileCache(TEMP_DIR + sep + 'real_sources', max_size=10000)
+    monkeypatch.setattr('app.tasks.download.get_source_cache', lambda: cache)
+    server, info = serve_audio_formats()
+    try:
+        fetch_source(info['webpage_url'], TEMP_DIR + sep + '4', 160, info=info)
+    finally:
+        server.shutdown()
+    source = dict()
+    assert fetch_source(info['webpage_url'], TEMP_DIR + sep + '5', 160, source=source) == \
+        TEMP_DIR + sep + '5' + sep + 'title.webm'
+    assert source == {'bytes': 1000, 'abr': 160, 'format': '251', 'duration': 700}
+
+
+def test_remux_cached_source(client, monkeypatch):
+    sep = os.path.sep
+    cache = FileCache(TEMP_DIR + sep + 'sources', max_size=10000)
+    os.makedirs(TEMP_DIR + sep + 'src', exist_ok=True)
+    with open(TEMP_DIR + sep + 'src' + sep + 'title.m4a', 'wb') as file:
+        file.write(b'0' * 1000)
+    cache.put('key', TEMP_DIR + sep + 'src' + sep + 'title.m4a')
+    filename = cache.get('key', TEMP_DIR + sep + 'task')
+
+    class FakePP:
+        # m4a is not remuxed, postprocessor returns the same file
+        def __init__(self, ydl, preferredcodec=None):
+            pass
+
+        def run(self, info):
+            return [], info
+
+    def fake_insert_audio_tags(filename, tags):
+        with open(filename, 'ab') as file:
+            file.write(b'tags')
+
+    monkeypatch.setattr('app.tasks.download.FFmpegExtractAudioPP', FakePP)
+    monkeypatch.setattr('app.tasks.download.insert_audio_tags', fake_insert_audio_tags)
+    assert remux(filename, {'title': 'title'}) == filename
+    with open(filename, 'rb') as file:
+        assert file.read() == b'0' * 1000 + b'tags'
+    # cache entry is not changed by tags of the task file
+    with open(cache.get('key', TEMP_DIR + sep + 'other'), 'rb') as file:
+        assert file.read() == b'0' * 1000
+
+
+def test_mp3_output_options(client):
+    assert get_mp3_output_options(320) == ['-map', '0:a:0', '-vn', '-c:a', 'libmp3lame', '-b:a', '320k']
+    assert get_mp3_output_options(2)[-2:] == ['-q:a', '2']
+    assert get_mp3_output_options(128, copy=True)[-2:] == ['-c:a', 'copy']
+    assert get_mp3_output_options(128, cover=True)[:4] == ['-map', '0:a:0', '-map', '1:0']
+
+
+def test_get_segments(client):
+    frame_duration = FRAME_SIZE / SAMPLE_RATE
+    segments = get_segments(1200, 4)
+    assert len(segments) == 4
+    assert segments[0][0] == 0 and segments[0][2] == 0
+    assert segments[-1][1] is None
+    for (start, length, overlap), (next_start, next_length, next_overlap) in zip(segments, segments[1:]):
+        assert round(start / frame_duration, 6).is_integer()
+        assert next_overlap == pytest.approx(2 * frame_duration)
+        assert start + length == pytest.approx(next_start + next_overlap)
+    assert get_segments(0.1, 8) == [(0.0, None, 0.0)]
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg is not found')
+def test_transcode_segments(client):
+    # libmp3lame encoder delay plus mp3 decoder delay(in samples)
+    encoder_delay = 1105
+    executable = shutil.which('ffmpeg')
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    source = TEMP_DIR + os.path.sep + 'source.wav'
+    out_filename = TEMP_DIR + os.path.sep + 'segments.mp3'
+    run_ffmpeg(executable, ['-f', 'lavfi', '-i', 'sine=frequency=441:duration=10', '-ac', '1',
+                            '-ar', str(SAMPLE_RATE), source])
+    transcode_segments(executable, source, out_filename, 192, 10, 4, options=['-map', '0:a:0', '-c:a', 'copy'])
+
+    def decode(filename):
+        run_ffmpeg(executable, ['-i', filename, '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), filename + '.pcm'])
+        samples = array.array('h')
+        with open(filename + '.pcm', 'rb') as file:
+            samples.frombytes(file.read())
+        return samples
+
+    def max_step(samples):
+        return max(abs(b - a) for a, b in zip(samples, samples[1:]))
+
+    source_samples = decode(source)
+    samples = decode(out_filename)
+    # only encoder delay and padding of the last frame are added, segment boundaries add nothing
+    assert 0 <= len(samples) - len(source_samples) < encoder_delay + FRAME_SIZE
+    # no clicks on segment boundaries
+    assert max_step(samples[FRAME_SIZE:]) < 2 * max_step(source_samples)
+    shutil.rmtree(TEMP_DIR)
+
+
+def test_progress_events(client):
+    channel = ProgressChannel()
+    subscription = channel.subscribe(1)
+    assert channel.subscribers() == 1
+    channel.publish(2, {'Progress': 'Downloading 1 of 2'})
+    assert subscription.get(timeout=0.01) is None
+    events = progress_events(subscription, {'Status_code': 3, 'Progress': 'Waiting', 'Status_codes': '00'},
+                             {1: 0, 2: 1}, keepalive=0.01)
+    assert json.loads(next(events)[6:]) == {'Status_code': 3, 'Progress': 'Waiting', 'Status_codes': '00'}
+    assert next(events) == ': keepalive\n\n'
+    channel.publish(1, {'Status_code': 3, 'Progress': 'Downloading 1 of 2'})
+    assert json.loads(next(events)[6:]) == {'Progress': 'Downloading 1 of 2'}
+    channel.publish(1, {'Item': 2, 'Item_status': 2})
+    assert json.loads(next(events)[6:]) == {'Status_codes': '02'}
+    channel.publish(1, {'Status_code': 4, 'Progress': 'Files downloaded(2) with 1 fails'})
+    assert json.loads(next(events)[6:]) == {'Status_code': 4, 'Progress': 'Files downloaded(2) with 1 fails'}
+    with pytest.raises(StopIteration):
+        next(events)
+    assert channel.subscribers() == 0
+    # progress published before subscription is read again when no message comes
+    states = [{'Status_code': 3, 'Progress': 'Waiting'}, {'Status_code': 3, 'Progress': 'Downloading 1 of 2'},
+              {'Status_code': 4, 'Progress': 'Files downloaded(2)'}]
+    events = progress_events(channel.subscribe(1), states[0], keepalive=0.01, refresh=lambda: states[0])
+    assert json.loads(next(events)[6:]) == {'Status_code': 3, 'Progress': 'Waiting'}
+    assert next(events) == ': keepalive\n\n'
+    states.pop(0)
+    assert json.loads(next(events)[6:]) == {'Progress': 'Downloading 1 of 2'}
+    states.pop(0)
+    assert json.loads(next(events)[6:]) == {'Status_code': 4, 'Progress': 'Files downloaded(2)'}
+    with pytest.raises(StopIteration):
+        next(events)
+    assert channel.subscribers() == 0
+
+
+def test_task_progress(client):
+    task = Task(description='Downloading mp3', user_id=1, status_code=0, progress='Waiting')
+    db.session.add(task)
+    db.session.commit()
+    set_task_progress(task, 'Downloading', Stage='downloading')
+    assert task not in db.session.dirty
+    set_task_progress(task, 'Downloading 50%', Stage='downloading', Downloaded_bytes=50, Total_bytes=100)
+    # written to database only after PROGRESS_DB_INTERVAL
+    assert task in db.session.dirty
+    assert get_task_progress(task) == {'Status_code': 0, 'Progress': 'Downloading 50%', 'Stage': 'downloading',
+                                       'Downloaded_bytes': 50, 'Total_bytes': 100}
+    subscription = get_progress_channel().subscribe(task.id)
+    file_info = FileInfo(index=1, file_id='nMUyQqlTR_4', task_id=task.id, status_code=1, filename='file.mp3')
+    db.session.add(file_info)
+    set_task_progress(task, 'Download error', status_code=1)
+    # status change is written with other changes of session before it is published
+    assert task not in db.session.dirty and file_info not in db.session.new
+    assert subscription.get(timeout=1) == {'Status_code': 1, 'Progress': 'Download error'}
+    subscription.close()
+    assert get_progress_store().get(task.id) == {}
+    assert get_task_progress(task) == {'Status_code': 1, 'Progress': 'Download error'}
+
+
+def test_single_flight(client):
+    flights = SingleFlight(timeout=10)
+    results = dict()
+    calls = list()
+
+    def job(name, key):
+        with flights.hold(key):
+            if key not in results:
+                calls.append(name)
+                time.sleep(0.2)
+                results[key] = name
+
+    threads = [Thread(target=job, args=(i, 'a' if i < 3 else 'b')) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 2
+    assert flights._locks == dict()
+
+    # key can be released by other thread than acquired it
+    flight = flights.acquire('a')
+    thread = Thread(target=flights.release, args=(flight,))
+    thread.start()
+    thread.join()
+    assert flights.acquire('a').acquired is True
+
+
+def test_http_client(client):
+    requests_count = list()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_count.append(self.path)
+            status = 503 if self.path == '/fail' or len(requests_count) == 1 else 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '11')
+            self.end_headers()
+            self.wfile.write(b'{"ok": "1"}')
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    http = HttpClient(retries=2, backoff_factor=0)
+    try:
+        r = http.get(url + '/ok')
+        assert r.status_code == 200
+        assert r.json() == {'ok': '1'}
+        assert len(requests_count) == 2
+        assert http.get(url + '/fail').status_code == 503
+        assert len(requests_count) == 5
+    finally:
+        server.shutdown()
+        server.server_close()
+    stats = http.stats()[f'127.0.0.1:{server.server_port}']
+    assert stats['requests'] == 2
+    assert stats['errors'] == 1
+
+
+def test_metadata_cache(client, monkeypatch):
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    cache = MetadataCache(TEMP_DIR + os.path.sep + 'metadata.sqlite')
+    cache.put('a', {'title': 'A'}, ttl=60)
+    cache.put('b', None, ttl=60, error=BadUrlError('No information about this video.'))
+    cache.put('c', {'title': 'C'}, ttl=-1)
+    assert cache.get('a') == ({'title': 'A'}, None)
+    assert cache.get('b') == (None, ['BadUrlError', 'No information about this video.'])
+    assert cache.get('c') is None
+    assert cache.stats() == {'hits': 2, 'misses': 1}
+
+    calls = list()
+
+    @cached_metadata('test', lambda artist, title: f'{artist.lower()}|{title.lower()}', errors=(ReparationError,))
+    def lookup(artist, title):
+        calls.append((artist, title))
+        if title == 'missing':
+            raise ReparationError('Failed to find such track')
+        return {'artist': artist, 'title': title}
+
+    monkeypatch.setattr('app.tasks.metadata_cache.get_metadata_cache', lambda: cache)
+    assert lookup('Starset', 'Perfect Machine') == {'artist': 'Starset', 'title': 'Perfect Machine'}
+    assert lookup('STARSET', 'perfect machine') == {'artist': 'Starset', 'title': 'Perfect Machine'}
+    for _ in range(2):
+        with pytest.raises(ReparationError, match='Failed to find such track'):
+            lookup('Starset', 'missing')
+    assert len(calls) == 2
+
+
 # Testing tags module
 
 
@@ -190,8 +920,119 @@ def test_get_repaired_video_tags(client):
     assert tags[1] == 'Perfect Machine'
 
 
+def test_titles_corpus(client):
+    with open(os.path.join('tests', 'data', 'titles.json'), encoding='utf-8') as file:
+        corpus = json.load(file)
+    titles = [(case['channel_title'], case['video_title']) for case in corpus]
+    for case, tags in zip(corpus, get_repaired_audio_tags_batch(titles)):
+        assert tags == (case['artist'], case['title']), case['video_title']
+        assert get_repaired_audio_tags(case['channel_title'], case['video_title']) == tags
+
+
+def test_cover_cache(client):
+    cache = CoverCache(max_size=25)
+    cache.put('a', b'0' * 10)
+    cache.put('b', b'1' * 10)
+    assert cache.get('a') == b'0' * 10
+    cache.put('c', b'2' * 10)
+    cache.put('d', b'3' * 30)
+    assert cache.get('b') is None
+    assert cache.get('c') == b'2' * 10
+    assert cache.get('d') is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'size': 20}
+
+
+def test_get_image_url(client):
+    images = [{'url': '640', 'width': 640}, {'url': '300', 'width': 300}, {'url': '64', 'width': 64}]
+    assert get_spotify_image_url(images) == '300'
+    assert get_spotify_image_url(images[2:]) == '64'
+    assert get_itunes_image_url('https://is1-ssl.mzstatic.com/image/thumb/Music/source/100x100bb.jpg') == \
+        'https://is1-ssl.mzstatic.com/image/thumb/Music/source/300x300bb.jpg'
+
+
+def test_get_ffmpeg_metadata_options(client):
+    options = get_ffmpeg_metadata_options({'artist': 'Starset', 'title': 'Perfect Machine', 'number': 3,
+                                           'image': 'https://example.com/cover.jpg'})
+    assert options == ['-metadata', 'artist=Starset', '-metadata', 'title=Perfect Machine', '-metadata', 'track=3']
+
+
+def test_run_lookups(client):
+    def lookup(result, delay=0.0):
+        def func():
+            time.sleep(delay)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return func
+
+    assert run_lookups([lookup('first', 0.2), lookup('second')], timeout=5) == 'first'
+    assert run_lookups([lookup(ReparationError('Failed to find such track')), lookup(None), lookup('third')],
+                       timeout=5) == 'third'
+    start = time.monotonic()
+    assert run_lookups([lookup('first', 1), lookup('second', 0.1)], timeout=0.3) == 'second'
+    assert time.monotonic() - start < 0.9
+    assert run_lookups([lookup(requests.RequestException('Connection refused')), lookup('second')],
+                       timeout=1) == 'second'
+    with pytest.raises(KeyError):
+        run_lookups([lookup(KeyError('items'))], timeout=1)
+
+
+def test_repaired_tags_without_spotify(client, monkeypatch):
+    def failed_token():
+        raise requests.ConnectionError('Connection refused')
+
+    monkeypatch.setattr('app.tasks.tags.get_spotify_auth_token', failed_token)
+    monkeypatch.setattr('app.tasks.tags.get_repaired_tags_from_itunes',
+                        lambda artist, title, duration=None: {'artist': artist, 'title': title, 'album': 'Meteora'})
+    # itunes lookup is used when spotify authentication is failed
+    assert get_repaired_tags('Linkin Park', 'Numb') == {'artist': 'Linkin Park', 'title': 'Numb', 'album': 'Meteora'}
+
+
+def test_match_corpus(client):
+    with open(os.path.join('tests', 'data', 'match_corpus.json')) as file:
+        corpus = json.load(file)
+    for case in corpus:
+        candidates = [Candidate(c['title'], c['artist'], c['duration'], c['album_type'], i)
+                      for i, c in enumerate(case['candidates'])]
+        best = pick_best_candidate(candidates, case['title'], case['artist'], case['duration'],
+                                   app.config['TAGS_MATCH_THRESHOLD'])
+        assert (best.data if best else None) == case['expected'], case['title']
+
+
+def test_parse_iso_duration(client):
+    assert parse_iso_duration('PT4M13S') == 253
+    assert parse_iso_duration('PT1H2M') == 3720
+    assert parse_iso_duration('PT45S') == 45
+    assert parse_iso_duration('P1DT1S') == 86401
+    assert parse_iso_duration(None) is None
+
+
 def test_get_spotify_auth_token(client):
     assert get_spotify_auth_token() is not None
+    assert get_spotify_auth_token() == get_spotify_auth_token()
+
+
+def test_spotify_token_manager(client):
+    tokens = list()
+
+    def request_token():
+        time.sleep(0.1)
+        tokens.append(f'token{len(tokens)}')
+        return tokens[-1], 3600
+
+    manager = SpotifyTokenManager(request_token)
+    threads = [Thread(target=manager.get_token) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert manager.get_token() == 'token0'
+    assert len(tokens) == 1
+
+    manager.expires_at = time.monotonic() + manager.refresh_margin - 1
+    assert manager.get_token() == 'token1'
+    assert manager.get_token(('uid', 'secret')) == 'token2'
+    assert manager.get_token(('uid', 'secret')) == 'token2'
 
 
 def test_get_repaired_tags_from_spotify(client):
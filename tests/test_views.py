@@ -1,5 +1,7 @@
 from app import create_app, db
 from app.models import User
+from app.models import Task
+from app.tasks.progress import get_progress_channel
 from app.tasks.tags import get_repaired_tags_for_yt
 from app.tasks.tags import get_repaired_tags_for_sc
 from app.tasks.tags import ID3, TIT2
@@ -7,6 +9,8 @@ from config import Config
 
 import time
 import pytest
+import zipfile
+import io
 import shutil
 import os
 
@@ -22,6 +26,9 @@ class TestConfig(Config):
     SEND_MAILS = False
     SYNC_DOWNLOADINGS = True
     DOWNLOAD_PATH = TEMP_DIR
+    USE_FILE_CACHE = False
+    USE_METADATA_CACHE = False
+    USE_SOURCE_CACHE = False
 
 
 app = create_app(TestConfig)
@@ -84,12 +91,65 @@ def test_get_progress_view(client):
     assert data['Progress'] == 'Done'
 
 
+def test_get_ready_file_view(client):
+    r = client.get('/get_ready_file')
+    assert r.status_code == 404
+    r = client.post('/download_yt', data=dict(link='https://www.youtube.com/watch'),
+                    headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert r.get_json()['Status_code'] == 2
+
+
+def test_progress_stream_view(client, monkeypatch):
+    r = client.get('/progress_stream')
+    assert r.mimetype == 'text/event-stream'
+    assert r.get_data(as_text=True) == 'data: {"Status_code": 1, "Progress": "Done"}\n\n'
+    r = client.get('/progress_stream?task=playlist')
+    assert r.status_code == 403
+
+    # progress which is not published is read from database after keepalive interval
+    monkeypatch.setitem(app.config, 'PROGRESS_KEEPALIVE', 0.01)
+    task = Task(description='Downloading mp3', user_ip='127.0.0.1', status_code=0, progress='Waiting')
+    db.session.add(task)
+    db.session.commit()
+    r = client.get('/progress_stream', buffered=False)
+    events = iter(r.response)
+    assert next(events) == b'data: {"Status_code": 0, "Progress": "Waiting"}\n\n'
+    assert next(events) == b': keepalive\n\n'
+    Task.query.filter_by(id=task.id).update({'status_code': 1, 'progress': 'Download error'})
+    db.session.commit()
+    assert next(events) == b'data: {"Status_code": 1, "Progress": "Download error"}\n\n'
+    with pytest.raises(StopIteration):
+        next(events)
+    r.close()
+
+    # stream is finished after max duration and client reconnects
+    monkeypatch.setitem(app.config, 'PROGRESS_STREAM_MAX_DURATION', 0.05)
+    task = Task(description='Downloading mp3', user_ip='127.0.0.1', status_code=0, progress='Waiting')
+    db.session.add(task)
+    db.session.commit()
+    r = client.get('/progress_stream', buffered=False)
+    events = list(r.response)
+    assert events[0] == b'data: {"Status_code": 0, "Progress": "Waiting"}\n\n'
+    assert set(events[1:]) == {b': keepalive\n\n'}
+    r.close()
+    assert get_progress_channel().subscribers() == 0
+
+    # over the limit of streams client receives the current progress and reconnects later
+    monkeypatch.setitem(app.config, 'PROGRESS_STREAMS_MAX', 0)
+    r = client.get('/progress_stream')
+    assert r.get_data(as_text=True) == 'retry: 10\ndata: {"Status_code": 0, "Progress": "Waiting"}\n\n'
+
+
 def test_download_yt_view(client):
     r = client.get('/download_yt')
     assert r.status_code == 302
     r = client.post('/download_yt', data=dict(link='https://www.youtube.com/watch?v=nMUyqlTR_4'))
     assert r.status_code == 302
     r = client.post('/download_yt', data=dict(link='https://www.youtube.com/watch?v=nMUyQqlTR_4'))
+    assert r.status_code == 302
+    r = client.get('/get_progress')
+    assert r.get_json()['Status_code'] == 4
+    r = client.get('/get_ready_file')
     assert r.status_code == 200
 
 
@@ -101,6 +161,8 @@ def test_download_sc_view(client):
     assert r.status_code == 302
     r = client.post('/download_sc', data=dict(link='https://soundcloud.com/elinacooper/'
                                                    'bring-me-the-horizon-nihilist-bluescover-by-the-veer-union'))
+    assert r.status_code == 302
+    r = client.get('/get_ready_file')
     assert r.status_code == 200
 
 
@@ -174,9 +236,11 @@ def test_download_playlist_items_view(client):
             time.sleep(1)
             pass
         elif data['Status_code'] == 4:
-            sep = os.path.sep
-            dir = f'{TEMP_DIR}{sep}Task1{sep}'
-            assert os.path.isfile(dir + os.listdir(dir)[0]) is True
+            r = client.get('/get_file')
+            assert r.status_code == 200
+            with zipfile.ZipFile(io.BytesIO(r.data)) as archive:
+                assert archive.testzip() is None
+                assert len(archive.namelist()) == data['Status_codes'].count('1')
             file_ready = True
         else:
             raise Exception('Unexpected task status code')